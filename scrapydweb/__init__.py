@@ -13,6 +13,7 @@ from logparser import __version__ as LOGPARSER_VERSION
 from .__version__ import __url__, __version__
 from .common import handle_metadata
 from .models import Metadata, db
+from .utils.settings import Config
 from .vars import PYTHON_VERSION, SQLALCHEMY_BINDS, SQLALCHEMY_DATABASE_URI
 # from .utils.scheduler import scheduler
 
@@ -61,6 +62,8 @@ def internal_server_error(error):
 
 def create_app(test_config=None):
     app = Flask(__name__, instance_relative_config=True)
+    # To reuse the Settings for all views until app.config is modified, see utils/settings.py
+    app.config = Config(app.config.root_path, app.config)
     app.config.from_mapping(
         SECRET_KEY='dev',
     )
@@ -172,7 +175,8 @@ def handle_route(app):
     register_view(MetadataView, 'metadata', [('metadata', None)])
 
     # Overview
-    from .views.overview.servers import ServersView
+    from .views.overview.servers import ServersView, ServersDaemonStatusView
+    register_view(ServersDaemonStatusView, 'servers.daemonstatus', [('servers/daemonstatus', None)])
     register_view(ServersView, 'servers', [
         ('servers/getreports/<project>/<spider>/<version_job>', dict(opt='getreports')),
         ('servers/<opt>/<project>/<version_job>/<spider>', None),
@@ -182,7 +186,11 @@ def handle_route(app):
         ('servers', dict(opt=None, project=None, version_job=None, spider=None))
     ])
 
-    from .views.overview.multinode import MultinodeView
+    from .views.overview.multinode import MultinodeView, MultinodeXhrView
+    register_view(MultinodeXhrView, 'multinode.xhr', [
+        ('multinode/xhr/<opt>/<project>/<version_job>', None),
+        ('multinode/xhr/<opt>/<project>', dict(version_job=None))
+    ])
     register_view(MultinodeView, 'multinode', [
         ('multinode/<opt>/<project>/<version_job>', None),
         ('multinode/<opt>/<project>', dict(version_job=None))
@@ -204,13 +212,18 @@ def handle_route(app):
     app.register_blueprint(bp_tasks_history)
 
     # Dashboard
-    from .views.dashboard.jobs import JobsView, JobsXhrView
+    from .views.dashboard.jobs import JobsView, JobsXhrView, JobsDeltaView, JobsStreamView
     register_view(JobsView, 'jobs', [('jobs', None)])
+    register_view(JobsDeltaView, 'jobs.delta', [('jobs/delta', None)])
+    register_view(JobsStreamView, 'jobs.stream', [('jobs/stream', None)])
     register_view(JobsXhrView, 'jobs.xhr', [('jobs/xhr/<action>/<int:id>', None)])
 
     from .views.dashboard.node_reports import NodeReportsView
     register_view(NodeReportsView, 'nodereports', [('nodereports', None)])
 
+    from .views.dashboard.cluster_jobs import ClusterJobsView
+    register_view(ClusterJobsView, 'clusterjobs', [('clusterjobs', None)])
+
     from .views.dashboard.cluster_reports import ClusterReportsView
     register_view(ClusterReportsView, 'clusterreports', [
         ('clusterreports/<project>/<spider>/<job>', None),
@@ -218,13 +231,17 @@ def handle_route(app):
     ])
 
     # Operations
-    from .views.operations.deploy import DeployView, DeployUploadView, DeployXhrView
+    from .views.operations.deploy import (DeployView, DeployUploadView, DeployBuildView, DeployBuildStatusView,
+                                          DeployXhrView, DeployMultinodeView)
     register_view(DeployView, 'deploy', [('deploy', None)])
     register_view(DeployUploadView, 'deploy.upload', [('deploy/upload', None)])
+    register_view(DeployBuildView, 'deploy.build', [('deploy/build', None)])
+    register_view(DeployBuildStatusView, 'deploy.build_status', [('deploy/build/<build_id>', None)])
     register_view(DeployXhrView, 'deploy.xhr', [('deploy/xhr/<eggname>/<project>/<version>', None)])
+    register_view(DeployMultinodeView, 'deploy.multinode', [('deploy/multinode/<eggname>/<project>/<version>', None)])
 
     from .views.operations.schedule import (ScheduleView, ScheduleCheckView, ScheduleRunView,
-                                            ScheduleXhrView, ScheduleTaskView)
+                                            ScheduleXhrView, ScheduleTaskView, ScheduleBatchView)
     register_view(ScheduleView, 'schedule', [
         ('schedule/<project>/<version>/<spider>', None),
         ('schedule/<project>/<version>', dict(spider=None)),
@@ -235,6 +252,7 @@ def handle_route(app):
     register_view(ScheduleRunView, 'schedule.run', [('schedule/run', None)])
     register_view(ScheduleXhrView, 'schedule.xhr', [('schedule/xhr/<filename>', None)])
     register_view(ScheduleTaskView, 'schedule.task', [('schedule/task', None)])
+    register_view(ScheduleBatchView, 'schedule.batch', [('schedule/batch', None)])
 
     from .views.operations.schedule import bp as bp_schedule_history
     app.register_blueprint(bp_schedule_history)
@@ -1,23 +1,35 @@
 # coding: utf-8
+import atexit
 import json
+import logging
 import os
 import re
+import threading
 import time
 import traceback
 
-from flask import current_app as app
 from flask import Response
 import requests
 from requests.adapters import HTTPAdapter
-from w3lib.http import basic_auth_header
 
 from .__version__ import __version__
 from .models import Metadata, db
+from .utils.jobs_listing import jobs_cache
+from .utils.node_client import NodeClient
 
 
-session = requests.Session()
-session.mount('http://', HTTPAdapter(pool_connections=1000, pool_maxsize=1000))
-session.mount('https://', HTTPAdapter(pool_connections=1000, pool_maxsize=1000))
+# The pending increments of counters like pageview are written into the database at most once per interval
+METADATA_FLUSH_INTERVAL = 60
+
+# Shared by all the requests to the Scrapyd servers, see configure() called in check_app_config()
+session = NodeClient()
+# For the requests to ScrapydWeb itself and the third-party APIs like Slack and Telegram,
+# which should neither go through the circuit breakers nor count in the health of the Scrapyd servers
+web_session = requests.Session()
+web_session.mount('http://', HTTPAdapter(pool_connections=1000, pool_maxsize=1000))
+web_session.mount('https://', HTTPAdapter(pool_connections=1000, pool_maxsize=1000))
+# The timeout of the requests via web_session, in seconds
+WEB_REQUEST_TIMEOUT = 60
 
 
 # http://flask.pocoo.org/snippets/category/authentication/
@@ -45,54 +57,199 @@ def get_now_string(allow_space=False):
         return time.strftime('%Y-%m-%dT%H_%M_%S')
 
 
-def get_response_from_view(url, auth=None, data=None, as_json=False):
-    # https://stackoverflow.com/a/21342070/10517783  How do I call one Flask view from another one?
-    # https://stackoverflow.com/a/30250045/10517783
-    # python - Flask test_client() doesn't have request.authorization with pytest
-    client = app.test_client()
-    if auth is not None:
-        headers = {'Authorization': basic_auth_header(*auth)}
-    else:
-        headers = {}
-    if data is not None:
-        response = client.post(url, headers=headers, data=data, content_type='multipart/form-data')
-        # response = client.post(url, headers=headers, data=data, content_type='application/json')
-    else:
-        response = client.get(url, headers=headers)
-
-    text = response.get_data(as_text=True)
-    if as_json:
-        # e.g. when used in schedule_task()
-        # 'node index error: %s, which should be between 1 and %s' % (self.node, self.SCRAPYD_SERVERS_AMOUNT)
-        # json.decoder.JSONDecodeError: Expecting value: line 1 column 1 (char 0)
-        try:
-            return json.loads(text)
-        except ValueError:
-            # '_status': '500 INTERNAL SERVER ERROR',
-            # '_status_code': 500,
-            # See 500.html
-            # <tr><th>Error</th><td>node index error: 2, which should be between 1 and 1</td></tr>
-            # <pre>Traceback...AssertionError: node index error: 2, which should be between 1 and 1 </pre>
-            m = re.search(r'<tr><th>Error</th><td>(.+?)</td></tr>', text, re.S)
-            message = m.group(1) if m else text
-            return dict(status_code=getattr(response, '_status_code', 500), status='error', message=message)
+def make_request(url, data=None, auth=None, as_json=True, dumps_json=True, check_status=True, timeout=None,
+                 logger=None, headers=None, to_scrapyd=True):
+    """
+    :param url: url to make request
+    :param data: None or a dict object to post, or a file-like object like EggUploadBody to be streamed
+    :param auth: None or (username, password) for basic auth
+    :param as_json: return a dict object if set True, else text
+    :param dumps_json: whether to dumps the json response when as_json is set to True
+    :param check_status: whether to log error when status != 'ok'
+    :param timeout: timeout when making request, in seconds, defaults to the timeout of the operation
+    :param logger: the logger of the caller
+    :param headers: None or a dict of extra headers, like the Content-Type of a file-like data
+    :param to_scrapyd: whether the url is of a Scrapyd server, set False for the other urls like that of Slack
+    """
+    logger = logger or logging.getLogger('make_request')
+    try:
+        if 'addversion.json' in url and data:
+            logger.debug(">>>>> POST %s", url)
+            if isinstance(data, dict):
+                project, version, egg_size = data['project'], data['version'], len(data['egg'])
+            else:
+                project, version, egg_size = data.project, data.version, data.egg_size
+            logger.debug(json_dumps(dict(project=project, version=version,
+                                         egg="%s bytes binary egg file" % egg_size)))
+        else:
+            logger.debug(">>>>> %s %s", 'POST' if data else 'GET', url)
+            if data:
+                logger.debug("POST data: %s", json_dumps(data))
+
+        client = session if to_scrapyd else web_session
+        timeout = timeout if to_scrapyd else (timeout or WEB_REQUEST_TIMEOUT)
+        if data:
+            r = client.post(url, data=data, auth=auth, timeout=timeout, headers=headers)
+            # 'http://127.0.0.1:6800/schedule.json' -> the cached job listing of '127.0.0.1:6800' is outdated
+            if re.search(r'/(?:schedule|cancel)\.json$', url):
+                jobs_cache.invalidate(url.split('/')[2])
+        else:
+            r = client.get(url, auth=auth, timeout=timeout)
+        r.encoding = 'utf-8'
+    except Exception as err:
+        # logger.error('!!!!! %s %s' % (err.__class__.__name__, err))
+        logger.error("!!!!! error with %s: %s", url, err)
+        if as_json:
+            r_json = dict(url=url, auth=auth, status_code=-1, status='error',
+                          message=str(err), when=get_now_string(True))
+            return -1, r_json
+        else:
+            return -1, str(err)
     else:
-        return text
+        if as_json:
+            r_json = {}
+            try:
+                # listprojects would get 502 html when Scrapyd server reboots
+                r_json = r.json()  # PY3: json.decoder.JSONDecodeError  PY2: exceptions.ValueError
+            except ValueError as err:  # issubclass(JSONDecodeError, ValueError)
+                logger.error("Fail to decode json from %s: %s", url, err)
+                r_json = dict(status='error', message=r.text)
+            finally:
+                # Scrapyd in Python2: Traceback (most recent call last):\\n
+                # Scrapyd in Python3: Traceback (most recent call last):\r\n
+                message = r_json.get('message', '')
+                if message and not isinstance(message, dict):
+                    r_json['message'] = re.sub(r'\\n', '\n', message)
+                r_json.update(dict(url=url, auth=auth, status_code=r.status_code, when=get_now_string(True)))
+                status = r_json.setdefault('status', 'N/A')
+                if r.status_code != 200 or (check_status and status != 'ok'):
+                    logger.error("!!!!! (%s) %s: %s", r.status_code, status, url)
+                else:
+                    logger.debug("<<<<< (%s) %s: %s", r.status_code, status, url)
+                if dumps_json:
+                    logger.debug("Got json from %s: %s", url, json_dumps(r_json))
+                else:
+                    logger.debug("Got keys from (%s) %s %s: %s",
+                                 r_json.get('status_code'), r_json.get('status'), url, r_json.keys())
 
+                return r.status_code, r_json
+        else:
+            if r.status_code == 200:
+                _text = r.text[:100] + '......' + r.text[-100:] if len(r.text) > 200 else r.text
+                logger.debug("<<<<< (%s) %s\n%s", r.status_code, url, repr(_text))
+            else:
+                logger.error("!!!!! (%s) %s\n%s", r.status_code, url, r.text)
 
-def handle_metadata(key=None, value=None):
-    with db.app.app_context():
-        metadata = Metadata.query.filter_by(version=__version__).first()
-        if key is None:
+            return r.status_code, r.text
+
+
+class MetadataCache(object):
+    """Write-through cache of the Metadata row of the current version, shared by all threads in the process.
+
+    The row is queried only once, after that reads are served from memory. Updates are committed at once
+    and then applied to the cache, except that counters like pageview are increased in memory and
+    written in batch every METADATA_FLUSH_INTERVAL seconds, see increase().
+    Call invalidate() if the row could have been modified by another process.
+    """
+
+    def __init__(self, flush_interval=METADATA_FLUSH_INTERVAL):
+        self.lock = threading.RLock()
+        self.values = None  # Not loaded yet
+        self.increments = {}  # {key: amount}, not written into the database yet
+        self.flush_interval = flush_interval
+        self.flush_timestamp = time.time()
+
+    def load(self):
+        with db.app.app_context():
+            # Not to flush the pending changes of the caller, like the Job rows formatted for display in JobsView
+            with db.session.no_autoflush:
+                metadata = Metadata.query.filter_by(version=__version__).first()
+            if not metadata:  # Not cached, see handle_db() in __init__.py
+                return None
             # '_sa_instance_state': <sqlalchemy.orm.state.InstanceState object at 0x0000000005194080>,
-            return dict((k, v) for (k, v) in metadata.__dict__.items() if not k.startswith('_')) if metadata else {}
-        else:
-            try:
-                setattr(metadata, key, value)
-                db.session.commit()
-            except:
-                print(traceback.format_exc())
-                db.session.rollback()
+            values = dict((k, v) for (k, v) in metadata.__dict__.items() if not k.startswith('_'))
+        for key, amount in self.increments.items():
+            values[key] = (values.get(key) or 0) + amount
+        return values
+
+    def get(self):
+        with self.lock:
+            if self.values is None:
+                self.values = self.load()
+            return dict(self.values or {})
+
+    def set(self, key, value):
+        with self.lock:
+            self.increments.pop(key, None)
+            with db.app.app_context():
+                try:
+                    metadata = Metadata.query.filter_by(version=__version__).first()
+                    setattr(metadata, key, value)
+                    db.session.commit()
+                except:
+                    print(traceback.format_exc())
+                    db.session.rollback()
+                    self.values = None
+                else:
+                    if self.values is not None:
+                        self.values[key] = value
+
+    def increase(self, key, amount=1):
+        """Return the value increased, which would be written into the database in the next flush()."""
+        with self.lock:
+            if self.values is None:
+                self.values = self.load()
+                if self.values is None:
+                    return amount
+            self.values[key] = (self.values.get(key) or 0) + amount
+            self.increments[key] = self.increments.get(key, 0) + amount
+            if time.time() - self.flush_timestamp >= self.flush_interval:
+                self.flush()
+            return self.values[key]
+
+    def flush(self):
+        with self.lock:
+            increments, self.increments = self.increments, {}
+            self.flush_timestamp = time.time()
+            if not increments:
+                return
+            with db.app.app_context():
+                try:
+                    # UPDATE metadata SET pageview=(metadata.pageview + 10) WHERE metadata.version = '1.4.0'
+                    Metadata.query.filter_by(version=__version__).update(
+                        dict((getattr(Metadata, k), getattr(Metadata, k) + v) for (k, v) in increments.items()),
+                        synchronize_session=False)
+                    db.session.commit()
+                except:
+                    print(traceback.format_exc())
+                    db.session.rollback()
+                    # Kept for the next flush
+                    for key, amount in increments.items():
+                        self.increments[key] = self.increments.get(key, 0) + amount
+
+    def invalidate(self):
+        with self.lock:
+            self.flush()
+            self.values = None
+
+
+metadata_cache = MetadataCache()
+atexit.register(metadata_cache.flush)
+
+
+def handle_metadata(key=None, value=None):
+    if key is None:
+        return metadata_cache.get()
+    else:
+        metadata_cache.set(key, value)
+
+
+def increase_metadata(key, amount=1):
+    return metadata_cache.increase(key, amount)
+
+
+def invalidate_metadata():
+    metadata_cache.invalidate()
 
 
 def handle_slash(string):
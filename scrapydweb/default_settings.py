@@ -97,12 +97,49 @@ PRIVATEKEY_FILEPATH = ''
 # e.g. 'C:/Users/username/myprojects' or '/home/username/myprojects'
 SCRAPY_PROJECTS_DIR = ''
 
+# The eggs built from the projects are cached with a hash of the content of the project,
+# so that redeploying a project which has not been modified would skip building the egg.
+# The cached eggs beyond EGG_CACHE_SIZE in MB, or not used for EGG_CACHE_MAX_AGE days, are evicted.
+# The default is 100, set it to 0 to disable the cache.
+EGG_CACHE_SIZE = 100
+# The default is 7.
+EGG_CACHE_MAX_AGE = 7
+
+# The eggs are built in a pool of N processes in the background, so that deploying would not
+# block ScrapydWeb while running 'setup.py bdist_egg'. The default is 2.
+EGG_BUILD_PROCESSES = 2
+
+# The eggs being deployed and the data of Run Spider are cached in memory up to N MB in total,
+# for the requests to the other selected nodes. An egg larger than a quarter of it
+# would be streamed from disk instead. The default is 64, set it to 0 to always read from disk.
+MEMORY_CACHE_SIZE = 64
+
 
 ############################## Scrapyd ########################################
 # ScrapydWeb would try every extension in sequence to locate the Scrapy logfile.
 # The default is ['.log', '.log.gz', '.txt'].
 SCRAPYD_LOG_EXTENSIONS = ['.log', '.log.gz', '.txt']
 
+# The timeout in seconds of the requests to the Scrapyd servers, per operation.
+# The default is {'daemonstatus': 3, 'listjobs': 30, 'logs': 30, 'addversion': 120},
+# set it to a dict like {'listjobs': 60} to override some of the values.
+# The other requests like schedule.json would time out after 60 seconds.
+SCRAPYD_REQUEST_TIMEOUTS = {}
+
+# After a Scrapyd server fails to respond for N times in a row, the requests to it would fail fast
+# without being sent, until a probe request is let through after CIRCUIT_BREAKER_COOLDOWN seconds.
+# The health of the Scrapyd servers is displayed in the Servers page.
+# The default is 5, set it to 0 to disable the circuit breaker.
+CIRCUIT_BREAKER_THRESHOLD = 5
+# The default is 30.
+CIRCUIT_BREAKER_COOLDOWN = 30
+
+# With the placement 'least-loaded' in the Run Spider page, the timer tasks, or the batch schedule API,
+# the spider would be run on the selected nodes with the fewest pending and running jobs per capacity.
+# The default is {}, which means the capacity of every Scrapyd server is 1,
+# set it to a dict like {'127.0.0.1:6800': 4, '127.0.0.1:6801': 0.5} to customize the capacities.
+SCRAPYD_SERVERS_CAPACITIES = {}
+
 
 ############################## LogParser ######################################
 # Whether to backup the stats json files locally after you visit the Stats page of a job
@@ -152,6 +189,10 @@ SCHEDULE_DOWNLOAD_DELAY = None
 # Use '\r\n' as the line separator.
 SCHEDULE_ADDITIONAL = "-d setting=CLOSESPIDER_TIMEOUT=60\r\n-d setting=CLOSESPIDER_PAGECOUNT=10\r\n-d arg1=val1"
 
+# The batch schedule API at /1/schedule/batch/ sends at most N requests per second to each Scrapyd server.
+# The default is 5, set it to a positive number like 0.5 to slow down, or 0 for no limit.
+SCHEDULE_RATE_LIMIT = 5
+
 
 ############################## Page Display ###################################
 # The default is True, set it to False to hide the Items page, as well as
@@ -169,6 +210,21 @@ JOBS_FINISHED_JOBS_LIMIT = 0
 # The default is 300, set it to 0 to disable auto-reloading.
 JOBS_RELOAD_INTERVAL = 300
 
+# The parsed job listing of a Scrapyd server is cached for N seconds and shared by all requests
+# for the Jobs page and the Node Reports page, so that they would trigger only one fetch in the meantime.
+# The default is 5, set it to 0 to disable caching.
+JOBS_CACHE_TTL = 5
+
+# The default is False, set it to True so that the Jobs page would subscribe to the changes of jobs
+# pushed via Server-Sent Events, instead of fetching the changes every JOBS_RELOAD_INTERVAL seconds.
+# Note that it takes effect only if ENABLE_MONITOR is True, since the jobs are synced by the poll subprocess
+# every POLL_ROUND_INTERVAL seconds, no matter how many browser tabs are open.
+ENABLE_JOBS_STREAM = False
+
+# The Cluster Jobs page requests all Scrapyd servers in parallel, and a Scrapyd server failing to
+# respond within N seconds would be reported as unreachable. The default is 10.
+CLUSTER_JOBS_TIMEOUT = 10
+
 # The load status of the current Scrapyd server is checked every N seconds,
 # which is displayed in the top right corner of the page.
 # The default is 10, set it to 0 to disable auto-refreshing.
@@ -260,7 +316,10 @@ ENABLE_MONITOR = False
 # Sleep N seconds before starting next round of poll, the default is 300.
 POLL_ROUND_INTERVAL = 300
 # Sleep N seconds between each request to the Scrapyd server while polling, the default is 10.
+# Note that all Scrapyd servers are polled in parallel, so the interval applies to each server separately.
 POLL_REQUEST_INTERVAL = 10
+# Max number of concurrent requests to the same Scrapyd server while polling, the default is 1.
+POLL_REQUEST_CONCURRENCY = 1
 
 ########## alert switcher ##########
 # Tip: Set the SCRAPYDWEB_BIND option the in "QUICK SETUP" section to the actual IP of your host,
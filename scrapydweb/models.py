@@ -1,11 +1,12 @@
 # coding: utf-8
 from datetime import datetime
 from pprint import pformat
+import re
 import time
 
 from flask_sqlalchemy import SQLAlchemy
 
-from .vars import STATE_RUNNING
+from .vars import STATE_RUNNING, STRICT_NAME_PATTERN
 
 
 db = SQLAlchemy(session_options=dict(autocommit=False, autoflush=True))
@@ -40,44 +41,87 @@ class Metadata(db.Model):
 
 
 # TODO: Timezone Conversions https://blog.miguelgrinberg.com/post/the-flask-mega-tutorial-part-xii-dates-and-times
-def create_jobs_table(server):
-    class Job(db.Model):
-        __tablename__ = server
-        __bind_key__ = 'jobs'
-        # https://stackoverflow.com/questions/10059345/sqlalchemy-unique-across-multiple-columns
-        # https://stackoverflow.com/questions/43975349/why-uniqueconstraint-doesnt-work-in-flask-sqlalchemy
-        __table_args__ = (db.UniqueConstraint('project', 'spider', 'job'), )
-
-        id = db.Column(db.Integer, primary_key=True)
-        project = db.Column(db.String(255), unique=False, nullable=False)  # Pending
-        spider = db.Column(db.String(255), unique=False, nullable=False)  # Pending
-        job = db.Column(db.String(255), unique=False, nullable=False)  # Pending
-        status = db.Column(db.String(1), unique=False, nullable=False, index=True)  # Pending 0, Running 1, Finished 2
-        deleted = db.Column(db.String(1), unique=False, nullable=False, default='0', index=True)
-        create_time = db.Column(db.DateTime, unique=False, nullable=False, default=datetime.now)
-        update_time = db.Column(db.DateTime, unique=False, nullable=False, default=datetime.now)
-
-        pages = db.Column(db.Integer, unique=False, nullable=True)
-        items = db.Column(db.Integer, unique=False, nullable=True)
-        pid = db.Column(db.Integer, unique=False, nullable=True)  # Running
-        start = db.Column(db.DateTime, unique=False, nullable=True, index=True)
-        runtime = db.Column(db.String(20), unique=False, nullable=True)
-        finish = db.Column(db.DateTime, unique=False, nullable=True, index=True)  # Finished
-        href_log = db.Column(db.Text(), unique=False, nullable=True)
-        href_items = db.Column(db.Text(), unique=False, nullable=True)
-
-        def __repr__(self):
-            return "<Job #%s in table %s, %s/%s/%s start: %s>" % (
-                self.id, self.__tablename__, self.project, self.spider, self.job, self.start)
-
-    return Job
-    # sqlalchemy/ext/declarative/clsregistry.py:128: SAWarning: This declarative base already contains a class
-    # with the same class name and module name as scrapydweb.models.Job,
-    # and will be replaced in the string-lookup table.
-    # https://stackoverflow.com/questions/27773489/dynamically-create-a-python-subclass-in-a-function
-    # return type('Job_%s' % server, (Job, ), dict(__tablename__=server,  __bind_key__='jobs'))
-
-# print(dir([create_table(s) for s in 'abc'][0]))
+# Jobs of all Scrapyd servers are kept in the same table, see migrate_jobs_tables() for the legacy tables.
+class Job(db.Model):
+    __tablename__ = 'job'
+    __bind_key__ = 'jobs'
+    # https://stackoverflow.com/questions/10059345/sqlalchemy-unique-across-multiple-columns
+    # MySQL: Specified key was too long; max key length is 3072 bytes, i.e. 4 * 191 * 4 bytes for utf8mb4
+    __table_args__ = (db.Index('ix_job_node_server_project_spider_job', 'node_server', 'project', 'spider', 'job',
+                               unique=True, mysql_length=191), )
+
+    id = db.Column(db.Integer, primary_key=True)
+    node_server = db.Column(db.String(255), unique=False, nullable=False)  # '127.0.0.1:6800'
+    project = db.Column(db.String(255), unique=False, nullable=False)  # Pending
+    spider = db.Column(db.String(255), unique=False, nullable=False)  # Pending
+    job = db.Column(db.String(255), unique=False, nullable=False)  # Pending
+    status = db.Column(db.String(1), unique=False, nullable=False)  # Pending 0, Running 1, Finished 2
+    deleted = db.Column(db.String(1), unique=False, nullable=False, default='0')
+    create_time = db.Column(db.DateTime, unique=False, nullable=False, default=datetime.now)
+    update_time = db.Column(db.DateTime, unique=False, nullable=False, default=datetime.now)
+
+    pages = db.Column(db.Integer, unique=False, nullable=True)
+    items = db.Column(db.Integer, unique=False, nullable=True)
+    pid = db.Column(db.Integer, unique=False, nullable=True)  # Running
+    start = db.Column(db.DateTime, unique=False, nullable=True)
+    runtime = db.Column(db.String(20), unique=False, nullable=True)
+    finish = db.Column(db.DateTime, unique=False, nullable=True)  # Finished
+    href_log = db.Column(db.Text(), unique=False, nullable=True)
+    href_items = db.Column(db.Text(), unique=False, nullable=True)
+
+    def __repr__(self):
+        return "<Job #%s of %s, %s/%s/%s start: %s>" % (
+            self.id, self.node_server, self.project, self.spider, self.job, self.start)
+
+
+# Same as the order_by() in JobsView.query_jobs(), so that a page of jobs is read from the index in order.
+db.Index('ix_job_node_server_deleted_status_finish_start_id', Job.node_server, Job.deleted, Job.status,
+         Job.finish.desc(), Job.start, Job.id, mysql_length=dict(node_server=191))
+# For the changes of jobs since a watermark, see JobsDeltaView.
+db.Index('ix_job_node_server_update_time', Job.node_server, Job.update_time, mysql_length=dict(node_server=191))
+
+
+def migrate_jobs_tables(scrapyd_servers):
+    """Copy the jobs in the legacy tables named after each Scrapyd server (e.g. '127_0_0_1_6800')
+    into the 'job' table, and then rename the legacy table with the suffix '_migrated'.
+    Return a list of the migrated tables.
+    """
+    engine = db.get_engine(bind='jobs')
+    table_names = db.inspect(engine).get_table_names()
+    columns = [c.name for c in Job.__table__.columns if c.name not in ['id', 'node_server']]
+    migrated = []
+    for scrapyd_server in scrapyd_servers:
+        table_name = re.sub(STRICT_NAME_PATTERN, '_', scrapyd_server)
+        if table_name not in table_names or table_name + '_migrated' in table_names:
+            continue
+        legacy = db.Table(table_name, db.MetaData(), autoload=True, autoload_with=engine)
+        select = db.select([db.literal(scrapyd_server).label('node_server')] + [legacy.c[c] for c in columns])
+        preparer = engine.dialect.identifier_preparer
+        with engine.begin() as conn:  # All in one transaction, except for MySQL which commits on DDL
+            conn.execute(Job.__table__.insert().from_select(['node_server'] + columns, select))
+            conn.execute("ALTER TABLE %s RENAME TO %s" % (preparer.quote(table_name),
+                                                          preparer.quote(table_name + '_migrated')))
+        migrated.append(table_name)
+    return migrated
+
+
+def migrate_task_table():
+    """Add the nullable columns introduced after the 'task' table was created, e.g. 'placement'.
+    Return a list of the added columns.
+    """
+    engine = db.get_engine()
+    existing = [c['name'] for c in db.inspect(engine).get_columns(Task.__tablename__)]
+    preparer = engine.dialect.identifier_preparer
+    added = []
+    for column in Task.__table__.columns:
+        if column.name in existing or not column.nullable:
+            continue
+        with engine.begin() as conn:
+            conn.execute("ALTER TABLE %s ADD COLUMN %s %s" % (preparer.quote(Task.__tablename__),
+                                                              preparer.quote(column.name),
+                                                              column.type.compile(engine.dialect)))
+        added.append(column.name)
+    return added
 
 
 # http://flask-sqlalchemy.pocoo.org/2.3/models/    One-to-Many Relationships
@@ -101,6 +145,8 @@ class Task(db.Model):
     jobid = db.Column(db.String(255), unique=False, nullable=False)
     settings_arguments = db.Column(db.Text(), unique=False, nullable=False)
     selected_nodes = db.Column(db.Text(), unique=False, nullable=False)
+    # None for all the selected nodes, or '{"amount": 1, "mode": "least_loaded"}', see utils/node_load.py
+    placement = db.Column(db.Text(), unique=False, nullable=True)
 
     year = db.Column(db.String(255), unique=False, nullable=False)
     month = db.Column(db.String(255), unique=False, nullable=False)
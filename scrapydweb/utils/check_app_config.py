@@ -4,14 +4,17 @@ from multiprocessing.dummy import Pool as ThreadPool
 import os
 import re
 
-from ..common import handle_metadata, handle_slash, json_dumps, session
-from ..models import create_jobs_table, db
+from ..common import handle_metadata, handle_slash, json_dumps, session, web_session
+from ..models import db, migrate_jobs_tables, migrate_task_table
 from ..utils.scheduler import scheduler
 from ..utils.setup_database import test_database_url_pattern
+from ..views.operations.utils import rate_limiter, slot
 from ..vars import (ALLOWED_SCRAPYD_LOG_EXTENSIONS, ALERT_TRIGGER_KEYS,
                     SCHEDULER_STATE_DICT, STATE_PAUSED, STATE_RUNNING,
-                    SCHEDULE_ADDITIONAL, STRICT_NAME_PATTERN, UA_DICT,
-                    jobs_table_map)
+                    SCHEDULE_ADDITIONAL, UA_DICT)
+from .egg_builder import egg_builder
+from .egg_cache import egg_cache
+from .node_client import OPERATION_TIMEOUTS
 from .send_email import send_email
 from .sub_process import init_logparser, init_poll
 
@@ -102,16 +105,24 @@ def check_app_config(config):
     if SCRAPY_PROJECTS_DIR:
         assert os.path.isdir(SCRAPY_PROJECTS_DIR), "SCRAPY_PROJECTS_DIR not found: %s" % SCRAPY_PROJECTS_DIR
         logger.info("Setting up SCRAPY_PROJECTS_DIR: %s", handle_slash(SCRAPY_PROJECTS_DIR))
+    check_assert('EGG_CACHE_SIZE', 100, int)
+    check_assert('EGG_CACHE_MAX_AGE', 7, int, allow_zero=False)
+    egg_cache.configure(max_size=config.get('EGG_CACHE_SIZE', 100) * 1024 * 1024,
+                        max_age=config.get('EGG_CACHE_MAX_AGE', 7) * 24 * 3600)
+    check_assert('EGG_BUILD_PROCESSES', 2, int, allow_zero=False)
+    egg_builder.configure(processes=config.get('EGG_BUILD_PROCESSES', 2))
+    check_assert('MEMORY_CACHE_SIZE', 64, int)
+    slot.configure(max_bytes=config.get('MEMORY_CACHE_SIZE', 64) * 1024 * 1024)
 
     # Scrapyd
     check_scrapyd_servers(config)
     # For JobsView
-    for node, scrapyd_server in enumerate(config['SCRAPYD_SERVERS'], 1):
-        # Note that check_app_config() is executed multiple times in test
-        if node not in jobs_table_map:
-            jobs_table_map[node] = create_jobs_table(re.sub(STRICT_NAME_PATTERN, '_', scrapyd_server))
     db.create_all(bind='jobs')
-    logger.debug("Created %s tables for JobsView", len(jobs_table_map))
+    for table_name in migrate_jobs_tables(config['SCRAPYD_SERVERS']):
+        logger.info("Migrated jobs in table %s into table job", table_name)
+    # For the timer tasks
+    for column_name in migrate_task_table():
+        logger.info("Added column %s into table task", column_name)
 
     check_assert('LOCAL_SCRAPYD_LOGS_DIR', '', str)
     check_assert('LOCAL_SCRAPYD_SERVER', '', str)
@@ -148,6 +159,24 @@ def check_app_config(config):
          "Current value: %s" % (ALLOWED_SCRAPYD_LOG_EXTENSIONS, SCRAPYD_LOG_EXTENSIONS))
     logger.info("Locating scrapy logfiles with SCRAPYD_LOG_EXTENSIONS: %s", SCRAPYD_LOG_EXTENSIONS)
 
+    check_assert('SCRAPYD_REQUEST_TIMEOUTS', {}, dict)
+    SCRAPYD_REQUEST_TIMEOUTS = config.get('SCRAPYD_REQUEST_TIMEOUTS', {})
+    assert all([k in OPERATION_TIMEOUTS and isinstance(v, int) and v > 0
+                for (k, v) in SCRAPYD_REQUEST_TIMEOUTS.items()]), \
+        ("SCRAPYD_REQUEST_TIMEOUTS should be a dict with keys in %s and positive integers as values. "
+         "Current value: %s" % (sorted(OPERATION_TIMEOUTS), SCRAPYD_REQUEST_TIMEOUTS))
+    check_assert('CIRCUIT_BREAKER_THRESHOLD', 5, int)
+    check_assert('CIRCUIT_BREAKER_COOLDOWN', 30, int, allow_zero=False)
+    session.configure(threshold=config.get('CIRCUIT_BREAKER_THRESHOLD', 5),
+                      cooldown=config.get('CIRCUIT_BREAKER_COOLDOWN', 30),
+                      timeouts=SCRAPYD_REQUEST_TIMEOUTS)
+    check_assert('SCRAPYD_SERVERS_CAPACITIES', {}, dict)
+    SCRAPYD_SERVERS_CAPACITIES = config.get('SCRAPYD_SERVERS_CAPACITIES', {})
+    assert all([k in config['SCRAPYD_SERVERS'] and isinstance(v, (int, float)) and not isinstance(v, bool) and v > 0
+                for (k, v) in SCRAPYD_SERVERS_CAPACITIES.items()]), \
+        ("SCRAPYD_SERVERS_CAPACITIES should be a dict with keys in %s and positive numbers as values. "
+         "Current value: %s" % (config['SCRAPYD_SERVERS'], SCRAPYD_SERVERS_CAPACITIES))
+
     # LogParser
     check_assert('ENABLE_LOGPARSER', False, bool)
     if config.get('ENABLE_LOGPARSER', False):
@@ -182,12 +211,21 @@ def check_app_config(config):
         else:
             check_assert('SCHEDULE_DOWNLOAD_DELAY', 0, int)
     check_assert('SCHEDULE_ADDITIONAL', SCHEDULE_ADDITIONAL, str)
+    rate_limit = config.setdefault('SCHEDULE_RATE_LIMIT', 5)
+    if isinstance(rate_limit, float):
+        assert rate_limit >= 0.0, "SCHEDULE_RATE_LIMIT should a non-negative number. Current value: %s" % rate_limit
+    else:
+        check_assert('SCHEDULE_RATE_LIMIT', 5, int)
+    rate_limiter.configure(rate=rate_limit)
 
     # Page Display
     check_assert('SHOW_SCRAPYD_ITEMS', True, bool)
     check_assert('SHOW_JOBS_JOB_COLUMN', False, bool)
     check_assert('JOBS_FINISHED_JOBS_LIMIT', 0, int)
     check_assert('JOBS_RELOAD_INTERVAL', 300, int)
+    check_assert('JOBS_CACHE_TTL', 5, int)
+    check_assert('ENABLE_JOBS_STREAM', False, bool)
+    check_assert('CLUSTER_JOBS_TIMEOUT', 10, int, allow_zero=False)
     check_assert('DAEMONSTATUS_REFRESH_INTERVAL', 10, int)
 
     # Send text
@@ -226,6 +264,7 @@ def check_app_config(config):
     if config.get('ENABLE_MONITOR', False):
         check_assert('POLL_ROUND_INTERVAL', 300, int, allow_zero=False)
         check_assert('POLL_REQUEST_INTERVAL', 10, int, allow_zero=False)
+        check_assert('POLL_REQUEST_CONCURRENCY', 1, int, allow_zero=False)
 
         check_assert('ENABLE_SLACK_ALERT', False, bool)
         check_assert('ENABLE_TELEGRAM_ALERT', False, bool)
@@ -315,7 +354,7 @@ def create_jobs_snapshot(url_jobs, auth, nodes):
     for node in nodes:
         url_jobs = re.sub(REPLACE_URL_NODE_PATTERN, r'\g<1>%s/' % node, url_jobs, count=1)
         try:
-            r = session.post(url_jobs, auth=auth, timeout=60)
+            r = web_session.post(url_jobs, auth=auth, timeout=60)
             assert r.status_code == 200, "Request got status_code: %s" % r.status_code
         except Exception as err:
             print("Fail to create jobs snapshot: %s\n%s" % (url_jobs, err))
@@ -406,7 +445,7 @@ def check_slack_telegram(config, service):
         data = dict(chat_id=config['TELEGRAM_CHAT_ID'], text=text)
     r = None
     try:
-        r = session.post(url, data=data, timeout=30)
+        r = web_session.post(url, data=data, timeout=30)
         js = r.json()
         assert r.status_code == 200 and js['ok'] is True
     except Exception as err:
@@ -0,0 +1,203 @@
+# coding: utf-8
+"""Build the eggs in a process pool with EGG_BUILD_PROCESSES processes, so that running 'setup.py bdist_egg'
+would not block the threads serving the requests, nor change the working directory of the ScrapydWeb process.
+
+A build is identified by a build_id, which can be polled via the deploy.build_status endpoint.
+The concurrent builds of the same content are deduplicated, see EggBuilder.submit().
+"""
+import atexit
+from collections import OrderedDict
+import logging
+import multiprocessing
+import os
+from shutil import rmtree
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+
+from six import PY2
+
+from .egg_cache import egg_cache
+
+
+logger = logging.getLogger(__name__)
+
+BUILDING = 'building'
+OK = 'ok'
+ERROR = 'error'
+# Give up waiting for a build after N seconds
+BUILD_TIMEOUT = 600
+# Keep the results of the last N builds, along with the eggs built
+MAX_BUILDS = 20
+
+
+def build_egg_in_process(scrapy_cfg_path):
+    """Run in the process pool. Return a tuple (error_type, message) on failure, or ('', (egg, tmpdir)),
+    so that the exceptions would not need to be pickled.
+    """
+    # Imported here since this module is imported by check_app_config.py
+    from six.moves.configparser import Error as ScrapyCfgParseError
+    from subprocess import CalledProcessError
+    from ..views.operations.scrapyd_deploy import _build_egg
+
+    try:
+        return '', _build_egg(scrapy_cfg_path)
+    except ScrapyCfgParseError as err:
+        return 'scrapy_cfg_parse_error', str(err)
+    except CalledProcessError as err:
+        return 'build_egg_subprocess_error', str(err)
+    except Exception:
+        return 'build_egg_subprocess_error', traceback.format_exc()
+
+
+class EggBuilder(object):
+
+    def __init__(self, processes=2):
+        self.processes = processes
+        self.pool = None  # Created in configure()
+        self.lock = threading.Lock()
+        self.builds = OrderedDict()  # {build_id: dict(status='building', ...)}
+        self.events = {}  # {build_id: threading.Event()}, set when the build finishes
+        self.building = {}  # {key: build_id}, see egg_cache.get_key()
+
+    def configure(self, processes=2):
+        """Called by check_app_config() at startup, so that the pool is forked before app.run()
+        starts the threads serving the requests, which might be holding a lock like that of logging.
+        """
+        with self.lock:
+            if processes != self.processes and self.pool is not None:
+                self.pool.close()  # The builds submitted would still be finished
+                self.pool = None
+            self.processes = processes
+            self.start()
+
+    def start(self):
+        # Called with the lock acquired
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.processes)
+
+    def submit(self, scrapy_cfg_path):
+        """Return the build_id at once, which is shared by the builds of the same content in progress.
+        If the egg of the same content has been cached, the build would be finished at once.
+        """
+        key = egg_cache.get_key(os.path.dirname(scrapy_cfg_path))
+        with self.lock:
+            if key and key in self.building:
+                logger.debug("Share build %s for %s", self.building[key], scrapy_cfg_path)
+                return self.building[key]
+            self.drop_old_builds()
+            build_id = uuid.uuid4().hex
+            self.builds[build_id] = dict(build_id=build_id, status=BUILDING, key=key, scrapy_cfg_path=scrapy_cfg_path,
+                                         egg='', tmpdir='', error_type='', message='', cached=False,
+                                         submitted_at=time.time(), finished_at=0)
+            self.events[build_id] = threading.Event()
+            egg, tmpdir = self.get_cached_egg(key)
+            if not egg:
+                if key:
+                    self.building[key] = build_id
+                self.start()  # In case configure() is not called, e.g. in the tests
+                kwargs = dict(callback=lambda result: self.finish(build_id, result))
+                if not PY2:
+                    # e.g. the result can not be pickled, which would not be caught by build_egg_in_process()
+                    kwargs['error_callback'] = lambda err: self.finish(build_id, ('build_egg_subprocess_error',
+                                                                                  repr(err)))
+                self.pool.apply_async(build_egg_in_process, (scrapy_cfg_path, ), **kwargs)
+        if egg:
+            self.finish(build_id, ('', (egg, tmpdir)), cached=True)
+        return build_id
+
+    @staticmethod
+    def get_cached_egg(key):
+        """Return a tuple (egg, tmpdir) with a copy of the cached egg in tmpdir, which is removed along with
+        the build, see drop_old_builds(), or ('', '') if not cached.
+        """
+        if not key or egg_cache.max_size <= 0:
+            return '', ''
+        tmpdir = tempfile.mkdtemp(prefix='scrapydweb-deploy-')
+        egg = os.path.join(tmpdir, '%s.egg' % key)
+        if egg_cache.get(key, egg):
+            return egg, tmpdir
+        rmtree(tmpdir, ignore_errors=True)
+        return '', ''
+
+    def finish(self, build_id, result, cached=False):
+        error_type, value = result
+        with self.lock:
+            build = self.builds.get(build_id)
+            if build is None or build['status'] != BUILDING:
+                # The build has been dropped or expired, see drop_old_builds()
+                if not error_type and value[1]:
+                    rmtree(value[1], ignore_errors=True)
+                return
+            if self.building.get(build['key']) == build_id:
+                self.building.pop(build['key'])
+            if error_type:
+                build.update(status=ERROR, error_type=error_type, message=value)
+            else:
+                build.update(status=OK, egg=value[0], tmpdir=value[1], cached=cached)
+            build['finished_at'] = time.time()
+            event = self.events.pop(build_id)
+        if error_type:
+            logger.error("Fail to build egg for %s: %s", build['scrapy_cfg_path'], value)
+        elif not cached:
+            egg_cache.add(build['key'], build['egg'])
+        event.set()
+
+    def drop_old_builds(self):
+        # Called with the lock acquired
+        self.expire_builds()
+        for build_id in list(self.builds):
+            if len(self.builds) < MAX_BUILDS:  # Called before adding a new one
+                break
+            build = self.builds[build_id]
+            if build['status'] != BUILDING:
+                self.builds.pop(build_id)
+                if build['tmpdir']:
+                    rmtree(build['tmpdir'], ignore_errors=True)
+
+    def expire_builds(self):
+        # Called with the lock acquired. Neither callback of apply_async() would be called
+        # if the worker process hangs or gets killed, see submit().
+        now = time.time()
+        for build_id, build in self.builds.items():
+            if build['status'] != BUILDING or now - build['submitted_at'] < BUILD_TIMEOUT:
+                continue
+            if self.building.get(build['key']) == build_id:
+                self.building.pop(build['key'])
+            build.update(status=ERROR, error_type='build_egg_subprocess_error', finished_at=now,
+                         message="Timeout after waiting %s seconds for building the egg" % BUILD_TIMEOUT)
+            logger.error("Fail to build egg for %s: %s", build['scrapy_cfg_path'], build['message'])
+            self.events.pop(build_id).set()
+
+    def get(self, build_id):
+        with self.lock:
+            self.expire_builds()
+            build = self.builds.get(build_id)
+            return dict(build) if build else None
+
+    def wait(self, build_id, timeout=BUILD_TIMEOUT):
+        """Return the build after it finishes, or still building after timeout, or None if not found."""
+        with self.lock:
+            event = self.events.get(build_id)
+        if event is not None:
+            event.wait(timeout)
+        return self.get(build_id)
+
+    @staticmethod
+    def summarize(build):
+        keys = ['build_id', 'status', 'error_type', 'message', 'cached']
+        js = dict((k, build[k]) for k in keys)
+        js['seconds'] = int((build['finished_at'] or time.time()) - build['submitted_at'])
+        return js
+
+    def close(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool = None
+
+
+egg_builder = EggBuilder()
+atexit.register(egg_builder.close)
@@ -0,0 +1,145 @@
+# coding: utf-8
+"""Cache the eggs built from the Scrapy projects, keyed by a hash of the content of the project,
+so that redeploying a project which has not been modified would skip running 'setup.py bdist_egg'.
+
+The cached eggs are stored in EGG_CACHE_PATH and evicted by size and age, see EggCache.evict().
+"""
+import glob
+import hashlib
+import io
+import logging
+import os
+from shutil import copyfile
+import threading
+import time
+
+from ..vars import EGG_CACHE_PATH
+
+
+logger = logging.getLogger(__name__)
+
+# Excluded from the top directory of the project, as in DeployView.get_modification_time().
+# setup.py is not hashed since _build_egg() in scrapyd_deploy.py always overwrites it with the one generated
+# from the settings option in scrapy.cfg, which is hashed, and backs up the original one as setup_backup.py.
+EXCLUDED_DIRS = ['build', 'project.egg-info']
+EXCLUDED_FILES = ['setup.py', 'setup_backup.py']
+# Clear the hashes of the files once there are too many of them
+MAX_FILE_HASHES = 100000
+
+
+class EggCache(object):
+    """The cached eggs beyond `max_size` bytes in total or not used for `max_age` seconds are evicted,
+    with the least recently used ones first. Set max_size to 0 to disable the cache.
+    """
+
+    def __init__(self, path, max_size=100 * 1024 * 1024, max_age=7 * 24 * 3600):
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.file_hashes = {}  # {filepath: (size, mtime, sha1)}, to avoid hashing unmodified files again
+
+    def configure(self, max_size=100 * 1024 * 1024, max_age=7 * 24 * 3600):
+        with self.lock:
+            self.max_size = max_size
+            self.max_age = max_age
+        self.evict()
+
+    def get_key(self, project_dir):
+        """Return the sha1 of the relative paths and the content of the files in project_dir,
+        or None if the project can not be hashed, e.g. when it contains illegal filenames.
+        """
+        sha1 = hashlib.sha1()
+        try:
+            for dirpath, dirnames, filenames in os.walk(project_dir):
+                in_top_dir = dirpath == project_dir
+                dirnames[:] = sorted(d for d in dirnames
+                                     if not (d == '__pycache__' or (in_top_dir and d in EXCLUDED_DIRS)))
+                for filename in sorted(filenames):
+                    if filename.endswith(('.egg', '.pyc')) or (in_top_dir and filename in EXCLUDED_FILES):
+                        continue
+                    filepath = os.path.join(dirpath, filename)
+                    relpath = os.path.relpath(filepath, project_dir).replace(os.sep, '/')
+                    sha1.update(relpath.encode('utf-8'))
+                    sha1.update(self.get_file_hash(filepath).encode('ascii'))
+        except Exception as err:
+            logger.error("Fail to hash the project in %s: %s", project_dir, err)
+            return None
+        return sha1.hexdigest()
+
+    def get_file_hash(self, filepath):
+        stat = os.stat(filepath)
+        cached = self.file_hashes.get(filepath)
+        if cached and cached[:2] == (stat.st_size, stat.st_mtime):
+            return cached[2]
+        sha1 = hashlib.sha1()
+        with io.open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha1.update(chunk)
+        if len(self.file_hashes) >= MAX_FILE_HASHES:
+            self.file_hashes.clear()
+        self.file_hashes[filepath] = (stat.st_size, stat.st_mtime, sha1.hexdigest())
+        return sha1.hexdigest()
+
+    def get(self, key, destination):
+        """Copy the cached egg to the path `destination` and return True, or False if not cached or expired.
+        The egg is copied with the lock acquired, so that it would not be evicted by add() in the meantime.
+        """
+        if not key or self.max_size <= 0:
+            return False
+        eggpath = os.path.join(self.path, '%s.egg' % key)
+        with self.lock:
+            if not os.path.exists(eggpath):
+                return False
+            if time.time() - os.path.getmtime(eggpath) > self.max_age:
+                self.remove(eggpath)
+                return False
+            # The modification time is used as the last access time, see evict()
+            os.utime(eggpath, None)
+            copyfile(eggpath, destination)
+        logger.debug("Hit egg cache %s", key)
+        return True
+
+    def add(self, key, egg):
+        if not key or self.max_size <= 0:
+            return
+        eggpath = os.path.join(self.path, '%s.egg' % key)
+        tmppath = '%s.%s.tmp' % (eggpath, threading.current_thread().ident)
+        copyfile(egg, tmppath)
+        with self.lock:
+            if os.path.exists(eggpath):
+                os.remove(eggpath)  # os.rename() would fail in Windows if the target exists
+            os.rename(tmppath, eggpath)
+        logger.debug("Add egg cache %s", key)
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            now = time.time()
+            entries = []
+            for eggpath in glob.glob(os.path.join(self.path, '*.egg')):
+                try:
+                    mtime, size = os.path.getmtime(eggpath), os.path.getsize(eggpath)
+                except OSError:  # Removed by another process
+                    continue
+                if now - mtime > self.max_age:
+                    self.remove(eggpath)
+                else:
+                    entries.append((mtime, size, eggpath))
+            total_size = 0
+            for mtime, size, eggpath in sorted(entries, reverse=True):  # The most recently used first
+                total_size += size
+                if total_size > self.max_size:
+                    self.remove(eggpath)
+
+    @staticmethod
+    def remove(eggpath):
+        try:
+            os.remove(eggpath)
+        except OSError as err:
+            logger.warning("Fail to remove %s: %s", eggpath, err)
+        else:
+            logger.debug("Evict egg cache %s", os.path.basename(eggpath))
+
+
+egg_cache = EggCache(EGG_CACHE_PATH)
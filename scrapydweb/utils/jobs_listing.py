@@ -0,0 +1,245 @@
+# coding: utf-8
+"""Fetch the jobs of a Scrapyd server as compact row tuples.
+
+The listjobs.json API is preferred if it supports listing the jobs of all projects (Scrapyd >= 1.3.0),
+otherwise the HTML of the Jobs page is streamed and tokenized row by row in linear time.
+Note that this module is also imported by poll.py, which runs as a standalone script,
+so only the standard library and requests are allowed here.
+"""
+from collections import namedtuple
+from datetime import datetime
+import re
+import threading
+import time
+
+
+JOB_KEYS = ['project', 'spider', 'job', 'pid', 'start', 'runtime', 'finish', 'href_log', 'href_items']
+# All fields are strings, same as the cells in the Jobs page, e.g.
+# JobRow(project='demo', spider='test', job='2019-01-01T0_00_01', pid='', start='2019-01-01 00:00:01',
+#        runtime='0:01:00', finish='2019-01-01 00:01:01', href_log='/logs/demo/test/2019-01-01T0_00_01.log',
+#        href_items='')
+JobRow = namedtuple('JobRow', JOB_KEYS)
+EMPTY_CELLS = [''] * len(JOB_KEYS)
+HREF_PATTERN = re.compile(r"""href=['"](.+?)['"]""")
+CHUNK_SIZE = 64 * 1024
+# A stale listing would be returned instead of waiting for the ongoing fetch of a slow node,
+# as long as it was fetched within the last STALE_WHILE_REVALIDATE seconds after expiration.
+STALE_WHILE_REVALIDATE = 60
+
+# {'127.0.0.1:6800': False}, False if listjobs.json of the Scrapyd server requires the project argument.
+listjobs_support_dict = {}
+
+
+class JobsTableParser(object):
+    """Collect the rows of the table in the Jobs page of Scrapyd, in a single pass over the text.
+
+    feed() can be called with chunks of any size, only the incomplete row at the end is buffered.
+    Header rows like <tr><th colspan='9'>Pending</th></tr> are skipped, and the href of the anchor
+    is collected for the Log and Items cells.
+    """
+
+    def __init__(self):
+        self.found_title = False
+        self.rows = []
+        self.buffer = ''
+
+    def feed(self, chunk):
+        text = self.buffer + chunk
+        if not self.found_title:
+            self.found_title = '<h1>Jobs</h1>' in text
+        segments = text.split('</tr>')
+        self.buffer = segments.pop()
+        for segment in segments:
+            index = segment.rfind('<tr>')
+            if index == -1 or not segment.startswith('<td>', index + 4):
+                continue
+            cells = []
+            for cell in segment[index + 8:].split('<td>')[:len(JOB_KEYS)]:
+                cell = cell.split('</td>', 1)[0]
+                # <td><a href='/logs/demo/test/2019-01-01T0_00_01.log'>Log</a></td>
+                if cell.startswith('<a '):
+                    m = HREF_PATTERN.search(cell)
+                    cell = m.group(1) if m else cell
+                cells.append(cell)
+            if len(cells) < len(JOB_KEYS):
+                cells.extend(EMPTY_CELLS[len(cells):])
+            self.rows.append(JobRow._make(cells))
+
+
+def parse_jobs_html(text):
+    """Return a list of JobRow, or None if the text is not the Jobs page of Scrapyd."""
+    parser = JobsTableParser()
+    parser.feed(text)
+    return parser.rows if parser.found_title else None
+
+
+def parse_time(string):
+    string = (string or '')[:19]  # '2019-01-01 00:00:01.123456'
+    return datetime.strptime(string, '%Y-%m-%d %H:%M:%S') if string else None
+
+
+def parse_listjobs(js):
+    """Convert the response of listjobs.json to a list of JobRow, in the same order as the Jobs page."""
+    now = datetime.now().replace(microsecond=0)
+    rows = []
+    for status in ['pending', 'running', 'finished']:
+        for job in js.get(status, []):
+            start = parse_time(job.get('start_time'))
+            finish = parse_time(job.get('end_time'))
+            runtime = ((finish or now) - start) if start else ''
+            rows.append(JobRow(
+                project=job['project'],
+                spider=job['spider'],
+                job=job['id'],
+                pid=str(job['pid']) if status == 'running' and job.get('pid') else '',
+                start=str(start or ''),
+                runtime=str(runtime),
+                finish=str(finish or ''),
+                href_log=job.get('log_url') or '',
+                href_items=job.get('items_url') or ''
+            ))
+    return rows
+
+
+def list_jobs(session, scrapyd_server, auth=None, timeout=None):
+    """Return a tuple (status_code, rows, text) for the jobs of all projects in a Scrapyd server,
+    where rows is None on failure and text is the response for the failure page.
+    The session is a NodeClient, which applies the timeout of listjobs if timeout is None.
+    """
+    if listjobs_support_dict.get(scrapyd_server, True):
+        url = 'http://%s/listjobs.json' % scrapyd_server
+        try:
+            r = session.get(url, auth=auth, timeout=timeout)
+        except Exception as err:
+            return -1, None, str(err)
+        try:
+            js = r.json()
+            assert r.status_code == 200 and js['status'] == 'ok', js
+            # Scrapyd < 1.3.0: {"status": "error", "message": "'project'"}
+            assert all('project' in job for job in js['pending'] + js['running'] + js['finished'])
+            rows = parse_listjobs(js)
+        except Exception:
+            # Unauthorized or other errors would be handled along with the Jobs page below
+            listjobs_support_dict[scrapyd_server] = r.status_code not in [200, 400]
+        else:
+            listjobs_support_dict[scrapyd_server] = True
+            return r.status_code, rows, ''
+
+    url = 'http://%s/jobs' % scrapyd_server
+    try:
+        r = session.get(url, auth=auth, timeout=timeout, stream=True)
+        if r.status_code != 200:
+            return r.status_code, None, r.text
+        r.encoding = 'utf-8'
+        parser = JobsTableParser()
+        chunks = []  # Kept for the failure page until the title is found
+        for chunk in r.iter_content(chunk_size=CHUNK_SIZE, decode_unicode=True):
+            parser.feed(chunk)
+            if not parser.found_title:
+                chunks.append(chunk)
+    except Exception as err:
+        return -1, None, str(err)
+    if not parser.found_title:
+        return r.status_code, None, ''.join(chunks)
+    return r.status_code, parser.rows, ''
+
+
+class SingleFlightCache(object):
+    """Process-wide cache keyed by Scrapyd server, where the concurrent callers for the same Scrapyd server
+    share a single upstream fetch, which is run in the background if a stale result can be returned instead.
+
+    A result is cached for `ttl` seconds, and can be returned as stale within `stale_ttl` seconds after that.
+    Only the results accepted by is_valid() are cached, see JobsCache and DaemonStatusCache in servers.py.
+    """
+
+    def __init__(self, ttl=0, stale_ttl=0):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.lock = threading.Lock()
+        self.entries = {}  # {scrapyd_server: (timestamp, result)}
+        self.flights = {}  # {scrapyd_server: [threading.Event(), result]}
+
+    def is_valid(self, result):
+        return result is not None
+
+    def get_failed(self, scrapyd_server):
+        """Called by the callers waiting for a fetch which raised an exception."""
+        raise RuntimeError("Fail to fetch from %s" % scrapyd_server)
+
+    def get(self, scrapyd_server, fetch, ttl=None):
+        """Return the cached result, or the result of fetch() shared by the concurrent callers."""
+        ttl = self.ttl if ttl is None else ttl
+        with self.lock:
+            timestamp, result = self.entries.get(scrapyd_server, (0, None))
+            age = time.time() - timestamp
+            if result is not None and age < ttl:
+                return result
+            flight = self.flights.get(scrapyd_server)
+            is_leader = flight is None
+            if is_leader:
+                flight = self.flights[scrapyd_server] = [threading.Event(), None]
+        stale = result is not None and age < ttl + self.stale_ttl
+        if is_leader and not stale:
+            return self.run(scrapyd_server, flight, fetch)
+        if is_leader:
+            # Refresh in the background, so that the leader would not wait for a slow node either
+            thread = threading.Thread(target=self.run, args=(scrapyd_server, flight, fetch))
+            thread.daemon = True
+            thread.start()
+        if stale:
+            return result
+        flight[0].wait()
+        if flight[1] is None:
+            return self.get_failed(scrapyd_server)
+        return flight[1]
+
+    def run(self, scrapyd_server, flight, fetch):
+        result = None
+        try:
+            result = fetch()
+        finally:
+            with self.lock:
+                # The flight would have been discarded by invalidate() in the meantime
+                if self.flights.get(scrapyd_server) is flight:
+                    self.flights.pop(scrapyd_server)
+                    if self.is_valid(result):
+                        self.entries[scrapyd_server] = (time.time(), result)
+            flight[1] = result
+            flight[0].set()
+        return result
+
+    def invalidate(self, scrapyd_server):
+        with self.lock:
+            self.entries.pop(scrapyd_server, None)
+            self.flights.pop(scrapyd_server, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class JobsCache(SingleFlightCache):
+    """Cache of list_jobs() shared by the Jobs page, the Node Reports page, the jobs snapshot
+    and the auto-reloading browser tabs. Only successful results are cached.
+    See invalidate() for schedule.json and cancel.json.
+    """
+
+    def __init__(self):
+        super(JobsCache, self).__init__(stale_ttl=STALE_WHILE_REVALIDATE)
+
+    def is_valid(self, result):
+        return result is not None and result[1] is not None
+
+    def get_failed(self, scrapyd_server):
+        return -1, None, "Fail to list jobs of %s" % scrapyd_server
+
+    def get(self, session, scrapyd_server, auth=None, timeout=None, ttl=0):
+        if ttl <= 0:
+            return list_jobs(session, scrapyd_server, auth=auth, timeout=timeout)
+
+        def fetch():
+            return list_jobs(session, scrapyd_server, auth=auth, timeout=timeout)
+        return super(JobsCache, self).get(scrapyd_server, fetch, ttl=ttl)
+
+
+jobs_cache = JobsCache()
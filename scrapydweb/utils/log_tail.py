@@ -0,0 +1,136 @@
+# coding: utf-8
+import io
+import logging
+import os
+import re
+
+from logparser.logparser import LogParser
+
+from ..common import session
+
+
+logger = logging.getLogger(__name__)
+
+# Same as the default values in logparser/settings.py
+LOG_ENCODING = 'utf-8'
+LOG_HEAD_LINES = 100
+LOG_TAIL_LINES = 200
+LOG_CATEGORIES_LIMIT = 10
+CHUNK_SIZE = 10 * 1000 * 1000
+CONTENT_RANGE_PATTERN = re.compile(r'bytes\s+(?:\d+-\d+|\*)/(\d+)')
+
+
+# noinspection PyMissingConstructor
+class LogTail(LogParser):
+    """Keep the byte offset and the parsed data of a Scrapy logfile,
+    so that only the appended bytes would be read and parsed in the next update().
+
+    The source can be a local path, or a URL of Scrapyd which supports HTTP Range requests.
+    If the server ignores the Range header, the whole logfile is requested once per update() instead.
+    Note that gzipped logfiles are not supported.
+    """
+    logger = logger
+
+    def __init__(self, source, auth=None, timeout=None, chunk_size=CHUNK_SIZE):
+        # LogParser.__init__() is not invoked since it would create stats.json in the logs_dir.
+        self.LOG_ENCODING = LOG_ENCODING
+        self.LOG_HEAD_LINES = LOG_HEAD_LINES
+        self.LOG_TAIL_LINES = LOG_TAIL_LINES
+        self.LOG_CATEGORIES_LIMIT = LOG_CATEGORIES_LIMIT
+        self.CHUNK_SIZE = chunk_size
+
+        self.source = source
+        self.is_url = re.match(r'https?://', source) is not None
+        self.auth = auth
+        self.timeout = timeout
+        self.support_range = True  # Set to False once the server answers 200 to a Range request
+        self.data = {}
+        self.reset()
+
+    def reset(self):
+        # See handle_logfile() of LogParser
+        self.data = dict(position=0, status='ok', _head='')
+
+    def decode(self, content):
+        # A multi-byte character may be split at the end of a chunk, retry with at most 3 bytes cut off.
+        for cut in range(4):
+            try:
+                return content[:len(content) - cut].decode(self.LOG_ENCODING), cut
+            except UnicodeDecodeError:
+                continue
+        self.logger.warning("Use decode(%s, 'replace') instead: %s", self.LOG_ENCODING, self.source)
+        return content.decode(self.LOG_ENCODING, 'replace'), 0
+
+    def read_local(self, position, chunk_size):
+        size = os.path.getsize(self.source)
+        if size < position:
+            return 200, None, size
+        with io.open(self.source, 'rb') as f:
+            f.seek(position)
+            return 200, f.read(chunk_size), size
+
+    def read_remote(self, position, chunk_size):
+        if self.support_range:
+            headers = {'Range': 'bytes=%s-%s' % (position, position + chunk_size - 1)}
+        else:
+            headers = {}
+        try:
+            r = session.get(self.source, headers=headers, auth=self.auth, timeout=self.timeout)
+            content = r.content
+        except Exception as err:
+            self.logger.error("Fail to request logfile from %s: %s", self.source, err)
+            return -1, None, 0
+        m = re.search(CONTENT_RANGE_PATTERN, r.headers.get('Content-Range', ''))
+        size = int(m.group(1)) if m else 0
+        if r.status_code == 206:
+            return 200, content, size
+        elif r.status_code == 416:  # Range Not Satisfiable
+            if size < position:
+                return 200, None, size
+            return 200, b'', size
+        elif r.status_code == 200:  # The Range header is ignored by the server
+            # Return all the bytes after position, rather than requesting the whole logfile again per chunk
+            self.support_range = False
+            size = len(content)
+            if size < position:
+                return 200, None, size
+            return 200, content[position:], size
+        else:
+            return r.status_code, None, 0
+
+    def read_appended_bytes(self, chunk_size):
+        read = self.read_remote if self.is_url else self.read_local
+        position = self.data['position']
+        status_code, content, size = read(position, chunk_size)
+        if status_code == 200 and content is None:
+            self.logger.warning("Logfile with smaller size: %s (position: %s, now: %s bytes) -> parse from 0",
+                                self.source, position, size)
+            self.reset()
+            status_code, content, size = read(0, chunk_size)
+        return status_code, content or b''
+
+    def update(self):
+        """Return the status_code of the last read, the parsed data would be kept in self.data."""
+        chunk_size = self.CHUNK_SIZE
+        while True:
+            position = self.data['position']
+            status_code, content = self.read_appended_bytes(chunk_size)
+            if status_code != 200:
+                return status_code
+            text, cut = self.decode(content)
+            # See read_appended_log() of LogParser
+            text_to_ignore = self.find_text_to_ignore(text)
+            if text_to_ignore == text:
+                appended_log = ''
+            else:
+                self.data['position'] = (self.data['position'] + len(content) - cut
+                                         - len(text_to_ignore.encode(self.LOG_ENCODING)))
+                appended_log = text[:-len(text_to_ignore)] if text_to_ignore else text
+            self.logger.debug("Parse %s bytes appended to %s (position: %s -> %s)",
+                              len(content), self.source, position, self.data['position'])
+            if appended_log or 'first_log_time' not in self.data:
+                self.parse_appended_log(self.data, appended_log)
+            if len(content) < chunk_size or (self.is_url and not self.support_range):
+                return status_code
+            # Read more bytes in the next loop in case that a log block is larger than chunk_size
+            chunk_size = self.CHUNK_SIZE if self.data['position'] != position else chunk_size * 2
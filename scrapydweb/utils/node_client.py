@@ -0,0 +1,196 @@
+# coding: utf-8
+"""Make requests to the Scrapyd servers with per operation timeouts and a circuit breaker per node.
+
+The latency and failures of the recent requests to every Scrapyd server are tracked, so that the requests
+to an unhealthy Scrapyd server would fail fast instead of stalling the pages and the poll rounds.
+Note that this module is also imported by poll.py, which runs as a standalone script,
+so only the standard library and requests are allowed here.
+"""
+from collections import deque
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+DEFAULT_TIMEOUT = 60
+# Timeouts in seconds, see get_operation()
+OPERATION_TIMEOUTS = dict(daemonstatus=3, listjobs=30, logs=30, addversion=120)
+OPERATION_PATTERN = re.compile(r'^\w+://[^/]+/(?:(daemonstatus|listjobs|addversion)\.json|(jobs|logs|items)\b)')
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+# Number of the recent requests for health scoring
+HEALTH_WINDOW = 20
+# The average latency of the recent requests beyond N seconds would lower the health score by 20 at most
+SLOW_LATENCY = 5
+
+
+def get_operation(url):
+    """Return one of the keys of OPERATION_TIMEOUTS, or None for the other requests.
+
+    'http://127.0.0.1:6800/jobs' -> 'listjobs'
+    'http://127.0.0.1:6800/logs/demo/test/2019-01-01T0_00_01.log' -> 'logs'
+    """
+    m = OPERATION_PATTERN.search(url)
+    if not m:
+        return None
+    if m.group(1):
+        return m.group(1)
+    return 'listjobs' if m.group(2) == 'jobs' else 'logs'
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of sending the request if the circuit of the Scrapyd server is open."""
+
+
+class NodeHealth(object):
+    """The recent latency and failures of a Scrapyd server, along with the state of its circuit breaker.
+
+    The circuit is opened after `threshold` consecutive failures, so that the requests would fail fast.
+    After `cooldown` seconds, the circuit turns half-open and only one probe request is let through,
+    which would close the circuit on success, or reopen it on failure.
+    """
+
+    def __init__(self, threshold=5, cooldown=30):
+        self.lock = threading.Lock()
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0
+        self.probing = False
+        self.records = deque(maxlen=HEALTH_WINDOW)  # [(success, latency)]
+        self.last_error = ''
+
+    def allow_request(self):
+        with self.lock:
+            if self.state == CLOSED or self.threshold <= 0:
+                return True
+            if self.state == OPEN:
+                if time.time() - self.opened_at < self.cooldown:
+                    return False
+                self.state = HALF_OPEN
+                self.probing = False
+            if self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def record(self, success, latency, error=''):
+        with self.lock:
+            self.records.append((success, latency))
+            self.probing = False
+            if success:
+                self.state = CLOSED
+                self.consecutive_failures = 0
+                return
+            self.consecutive_failures += 1
+            self.last_error = error
+            if self.threshold > 0 and (self.state == HALF_OPEN or self.consecutive_failures >= self.threshold):
+                self.state = OPEN
+                self.opened_at = time.time()
+
+    @property
+    def retry_in(self):
+        if self.state != OPEN:
+            return 0
+        return max(0, int(round(self.opened_at + self.cooldown - time.time())))
+
+    @property
+    def score(self):
+        """An integer from 0 to 100 based on the success rate and the average latency of the recent requests,
+        or None if no request has been made yet.
+        """
+        records = list(self.records)
+        if not records:
+            return None
+        if self.state == OPEN:
+            return 0
+        latencies = [latency for (success, latency) in records if success]
+        success_rate = len(latencies) / float(len(records))
+        latency = sum(latencies) / len(latencies) if latencies else SLOW_LATENCY
+        return max(0, int(round(success_rate * 100 - min(latency / SLOW_LATENCY, 1) * 20)))
+
+    def to_dict(self):
+        records = list(self.records)
+        latencies = [latency for (success, latency) in records if success]
+        return dict(
+            state=self.state,
+            score=self.score,
+            requests=len(records),
+            failures=len(records) - len(latencies),
+            consecutive_failures=self.consecutive_failures,
+            latency=int(sum(latencies) * 1000 / len(latencies)) if latencies else None,  # In milliseconds
+            retry_in=self.retry_in,
+            last_error=self.last_error
+        )
+
+
+class NodeClient(object):
+    """A replacement of requests.Session for the requests to the Scrapyd servers, with get() and post() only.
+
+    If timeout is not specified, it defaults to the value in OPERATION_TIMEOUTS according to the url.
+    A response with status code 5xx is considered a failure, along with any exception raised by requests.
+    """
+
+    def __init__(self, threshold=5, cooldown=30, timeouts=None):
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1000, pool_maxsize=1000))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1000, pool_maxsize=1000))
+        self.lock = threading.Lock()
+        self.health_dict = {}  # {'127.0.0.1:6800': NodeHealth()}
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.timeouts = dict(OPERATION_TIMEOUTS)
+        self.timeouts.update(timeouts or {})
+
+    def configure(self, threshold=5, cooldown=30, timeouts=None):
+        with self.lock:
+            self.threshold = threshold
+            self.cooldown = cooldown
+            self.timeouts = dict(OPERATION_TIMEOUTS)
+            self.timeouts.update(timeouts or {})
+            for health in self.health_dict.values():
+                health.threshold = threshold
+                health.cooldown = cooldown
+
+    def get_health(self, scrapyd_server):
+        with self.lock:
+            health = self.health_dict.get(scrapyd_server)
+            if health is None:
+                health = self.health_dict[scrapyd_server] = NodeHealth(self.threshold, self.cooldown)
+            return health
+
+    def get_timeout(self, url):
+        return self.timeouts.get(get_operation(url), DEFAULT_TIMEOUT)
+
+    def request(self, method, url, timeout=None, **kwargs):
+        # 'http://127.0.0.1:6800/daemonstatus.json' -> '127.0.0.1:6800'
+        scrapyd_server = url.split('/')[2]
+        health = self.get_health(scrapyd_server)
+        if not health.allow_request():
+            raise CircuitOpenError("Circuit open for %s after %s consecutive failures, retry in %s seconds: %s"
+                                   % (scrapyd_server, health.consecutive_failures, health.retry_in,
+                                      health.last_error))
+        start = time.time()
+        try:
+            r = self.session.request(method, url, timeout=timeout or self.get_timeout(url), **kwargs)
+        except Exception as err:
+            health.record(False, time.time() - start, str(err))
+            raise
+        health.record(r.status_code < 500, time.time() - start, "Got status_code %s" % r.status_code)
+        return r
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def get_health_report(self, scrapyd_servers):
+        """Return a list of dict for the Scrapyd servers, see NodeHealth.to_dict()."""
+        return [dict(self.get_health(scrapyd_server).to_dict(), server=scrapyd_server)
+                for scrapyd_server in scrapyd_servers]
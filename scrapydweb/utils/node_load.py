@@ -0,0 +1,98 @@
+# coding: utf-8
+"""Track the load of the Scrapyd servers, so as to run the spiders on the least-loaded nodes of the selected ones,
+instead of piling up the jobs on the first node, see ScrapydService.select_nodes().
+
+The load of a Scrapyd server is the number of its pending and running jobs in daemonstatus.json,
+plus the jobs placed on it since that daemonstatus.json was requested, which might not be counted yet,
+plus the jobs placed on it by a batch but not sent yet, divided by its capacity in SCRAPYD_SERVERS_CAPACITIES.
+"""
+import threading
+import time
+
+
+# Request daemonstatus.json again if the last one is older than N seconds
+NODE_LOAD_TTL = 3
+# The placement modes of Run Spider, the timer tasks and the batch schedule API,
+# like {'mode': 'least_loaded', 'amount': 1} to run on the least-loaded node of the selected ones
+ALL = 'all'
+LEAST_LOADED = 'least_loaded'
+
+
+class NodeLoads(object):
+
+    def __init__(self, ttl=NODE_LOAD_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.statuses = {}  # {'127.0.0.1:6800': (requested_at, pending + running)}, None if unreachable
+        self.placements = {}  # {'127.0.0.1:6800': [placed_at]}, the jobs placed since the last daemonstatus.json
+        self.unsent = {}  # {'127.0.0.1:6800': 2}, the jobs placed but not sent yet, see sent()
+
+    def get_stale(self, scrapyd_servers):
+        now = time.time()
+        with self.lock:
+            return [s for s in scrapyd_servers if now - self.statuses.get(s, (0, None))[0] >= self.ttl]
+
+    def update(self, scrapyd_server, js, requested_at):
+        """Update the load with the js of daemonstatus.json requested at the timestamp `requested_at`."""
+        if js.get('status') == 'ok':
+            jobs = js.get('pending', 0) + js.get('running', 0)
+        else:
+            jobs = None
+        with self.lock:
+            self.statuses[scrapyd_server] = (requested_at, jobs)
+            self.placements[scrapyd_server] = [t for t in self.placements.get(scrapyd_server, [])
+                                               if t >= requested_at]
+
+    def select(self, node_servers, amount=1, capacities=None, unsent=False):
+        """Return `amount` nodes from node_servers like [(1, '127.0.0.1:6800')], the least-loaded ones first,
+        and count a job placed on each of them. The unreachable nodes are selected only if there are
+        not enough other nodes, and the ties go to the node with the larger capacity, then the smaller index.
+
+        Set unsent=True if the jobs would not be sent at once, e.g. by ScheduleBatchView, so that they are
+        counted until sent() is called, instead of being dropped by the next update().
+        """
+        capacities = capacities or {}
+        with self.lock:
+            def get_key(node_server):
+                node, scrapyd_server = node_server
+                jobs = self.statuses.get(scrapyd_server, (0, None))[1]
+                capacity = capacities.get(scrapyd_server, 1)
+                if jobs is None:
+                    return 1, 0, -capacity, node
+                # The load after placing one more job, so that the jobs are spread in proportion to the capacities
+                jobs += len(self.placements.get(scrapyd_server, [])) + self.unsent.get(scrapyd_server, 0)
+                return 0, (jobs + 1.0) / capacity, -capacity, node
+
+            selected = sorted(node_servers, key=get_key)[:amount]
+            now = time.time()
+            for node, scrapyd_server in selected:
+                if unsent:
+                    self.unsent[scrapyd_server] = self.unsent.get(scrapyd_server, 0) + 1
+                else:
+                    self.placements.setdefault(scrapyd_server, []).append(now)
+        return [node for (node, scrapyd_server) in selected]
+
+    def sent(self, scrapyd_server):
+        """Called after sending a job selected with unsent=True, no matter whether it succeeds."""
+        with self.lock:
+            self.unsent[scrapyd_server] = max(0, self.unsent.get(scrapyd_server, 0) - 1)
+            self.placements.setdefault(scrapyd_server, []).append(time.time())
+
+    def stats(self):
+        """Return a dict like {'127.0.0.1:6800': dict(jobs=1, placed=2, unsent=0, seconds_ago=1)}
+        for the Settings page.
+        """
+        now = time.time()
+        with self.lock:
+            return dict((s, dict(jobs=jobs, placed=len(self.placements.get(s, [])), unsent=self.unsent.get(s, 0),
+                                 seconds_ago=int(now - requested_at)))
+                        for (s, (requested_at, jobs)) in self.statuses.items())
+
+    def clear(self):
+        with self.lock:
+            self.statuses.clear()
+            self.placements.clear()
+            self.unsent.clear()
+
+
+node_loads = NodeLoads()
@@ -1,10 +1,11 @@
 # coding: utf-8
 import json
 import logging
+from multiprocessing.dummy import Pool as ThreadPool
 import os
 import platform
-import re
 import sys
+import threading
 import time
 import traceback
 
@@ -16,6 +17,13 @@ except ImportError:
 import requests
 from requests.adapters import HTTPAdapter
 
+try:
+    from .jobs_listing import list_jobs
+    from .node_client import NodeClient
+except (ImportError, ValueError):  # Run as a script by start_poll() in sub_process.py
+    from jobs_listing import list_jobs
+    from node_client import NodeClient
+
 
 logger = logging.getLogger('scrapydweb.utils.poll')  # __name__
 _handler = logging.StreamHandler()
@@ -24,21 +32,8 @@ _handler.setFormatter(_formatter)
 logger.addHandler(_handler)
 
 IN_WINDOWS = platform.system() == 'Windows'
-JOB_PATTERN = re.compile(r"""
-                            <tr>
-                                <td>(?P<Project>.*?)</td>
-                                <td>(?P<Spider>.*?)</td>
-                                <td>(?P<Job>.*?)</td>
-                                (?:<td>(?P<PID>.*?)</td>)?
-                                (?:<td>(?P<Start>.*?)</td>)?
-                                (?:<td>(?P<Runtime>.*?)</td>)?
-                                (?:<td>(?P<Finish>.*?)</td>)?
-                                (?:<td>(?P<Log>.*?)</td>)?
-                                (?:<td>(?P<Items>.*?)</td>)?
-                                [\w\W]*?  # Temp support for Scrapyd v1.3.0 (not released)
-                            </tr>
-                          """, re.X)
-JOB_KEYS = ['project', 'spider', 'job', 'pid', 'start', 'runtime', 'finish', 'log', 'items']
+# Max number of Scrapyd servers being polled at the same time
+MAX_NODES_CONCURRENCY = 50
 
 
 class Poll(object):
@@ -47,25 +42,36 @@ class Poll(object):
     def __init__(self, url_scrapydweb, username, password,
                  scrapyd_servers, scrapyd_servers_auths,
                  poll_round_interval, poll_request_interval,
-                 main_pid, verbose, exit_timeout=0):
+                 main_pid, verbose, exit_timeout=0, poll_request_concurrency=1, sync_jobs=False,
+                 scrapyd_request_timeouts=None, circuit_breaker_threshold=5, circuit_breaker_cooldown=30):
         self.url_scrapydweb = url_scrapydweb
         self.auth = (username, password) if username and password else None
 
         self.scrapyd_servers = scrapyd_servers
         self.scrapyd_servers_auths = scrapyd_servers_auths
 
-        self.session = requests.Session()
-        self.session.mount('http://', HTTPAdapter(pool_connections=1000, pool_maxsize=1000))
-        self.session.mount('https://', HTTPAdapter(pool_connections=1000, pool_maxsize=1000))
+        # The requests to an unhealthy Scrapyd server would fail fast, instead of stalling the poll round
+        self.session = NodeClient(threshold=circuit_breaker_threshold, cooldown=circuit_breaker_cooldown,
+                                  timeouts=scrapyd_request_timeouts)
+        # For the requests to ScrapydWeb itself, which should not count in the health of the Scrapyd servers
+        self.web_session = requests.Session()
+        self.web_session.mount('http://', HTTPAdapter(pool_connections=1000, pool_maxsize=1000))
+        self.web_session.mount('https://', HTTPAdapter(pool_connections=1000, pool_maxsize=1000))
         # if username and password:
-            # self.session.auth = (username, password)
+            # self.web_session.auth = (username, password)
+        # For the requests to ScrapydWeb, the timeouts of the requests to Scrapyd are set in NodeClient
         self.timeout = 60
 
         self.poll_round_interval = poll_round_interval
         self.poll_request_interval = poll_request_interval
+        self.poll_request_concurrency = max(1, poll_request_concurrency)
 
         self.ignore_finished_bool_list = [True] * len(self.scrapyd_servers)
         self.finished_jobs_dict = {}
+        # For the rate cap of requests related to the same node, see throttle()
+        self.lock = threading.Lock()
+        self.node_lock_dict = dict((node, threading.Lock()) for node in range(1, len(self.scrapyd_servers) + 1))
+        self.last_request_time_dict = {}
 
         self.main_pid = main_pid
         self.poll_pid = os.getpid()
@@ -78,6 +84,10 @@ class Poll(object):
 
         self.init_time = time.time()
         self.url_stats = self.url_scrapydweb + '/{node}/log/{opt}/{project}/{spider}/{job}/?job_finished={job_finished}'
+        # Sync the jobs into the database in every round, so that the changes would be pushed
+        # to the Jobs pages via Server-Sent Events, see JobsStreamView in jobs.py
+        self.sync_jobs = sync_jobs
+        self.url_jobs = self.url_scrapydweb + '/{node}/jobs/'
 
     def check_exit(self):
         exit_condition_1 = pid_exists is not None and not pid_exists(self.main_pid)
@@ -97,23 +107,20 @@ class Poll(object):
         else:
             return True
 
-    def fetch_jobs(self, node, url, auth):
+    def fetch_jobs(self, node, scrapyd_server, auth):
         running_jobs = []
         finished_jobs_set = set()
-        self.logger.debug("[node %s] fetch_jobs: %s", node, url)
-        r = self.make_request(url, auth=auth, post=False)
+        self.logger.debug("[node %s] fetch_jobs: %s", node, scrapyd_server)
+        status_code, rows, text = list_jobs(self.session, scrapyd_server, auth=auth)
         # Should not invoke update_finished_jobs() if fail to fetch jobs
-        assert r is not None, "[node %s] fetch_jobs failed: %s" % (node, url)
-
-        self.logger.debug("[node %s] fetch_jobs got (%s) %s bytes", node, r.status_code, len(r.content))
-        # Temp support for Scrapyd v1.3.0 (not released)
-        text = re.sub(r'<thead>.*?</thead>', '', r.text, flags=re.S)
-        jobs = [dict(zip(JOB_KEYS, job)) for job in re.findall(JOB_PATTERN, text)]
-        for job in jobs:
-            job_tuple = (job['project'], job['spider'], job['job'])
-            if job['pid']:
+        assert rows is not None, "[node %s] fetch_jobs failed: (%s) %s" % (node, status_code, scrapyd_server)
+
+        self.logger.debug("[node %s] fetch_jobs got (%s) %s jobs", node, status_code, len(rows))
+        for row in rows:
+            job_tuple = (row.project, row.spider, row.job)
+            if row.pid:
                 running_jobs.append(job_tuple)
-            elif job['finish']:
+            elif row.finish:
                 finished_jobs_set.add(job_tuple)
         self.logger.debug("[node %s] got running_jobs: %s", node, len(running_jobs))
         self.logger.debug("[node %s] got finished_jobs_set: %s", node, len(finished_jobs_set))
@@ -124,21 +131,22 @@ class Poll(object):
         job_finished = 'True' if job_tuple in finished_jobs else ''
         kwargs = dict(
             node=node,
-            opt='stats',
+            opt='monitor',
             project=project,
             spider=spider,
             job=job,
             job_finished=job_finished
         )
-        # http://127.0.0.1:5000/log/stats/proxy/test/55f1f388a7ae11e8b9b114dda9e91c2f/
+        # http://127.0.0.1:5000/1/log/monitor/proxy/test/55f1f388a7ae11e8b9b114dda9e91c2f/
         url = self.url_stats.format(**kwargs)
         self.logger.debug("[node %s] fetch_stats: %s", node, url)
-        # Make POST request to trigger alert, see log.py
+        # Make POST request to trigger alert, see handle_monitor() in log.py
         r = self.make_request(url, auth=self.auth, post=True)
         if r is None:
             self.logger.error("[node %s %s] fetch_stats failed: %s", node, self.scrapyd_servers[node-1], url)
             if job_finished:
-                self.finished_jobs_dict[node].remove(job_tuple)
+                with self.lock:
+                    self.finished_jobs_dict[node].discard(job_tuple)
                 self.logger.info("[node %s] retry in next round: %s", node, url)
         else:
             self.logger.debug("[node %s] fetch_stats got (%s) %s bytes from %s",
@@ -167,9 +175,9 @@ class Poll(object):
     def make_request(self, url, auth, post=False):
         try:
             if post:
-                r = self.session.post(url, auth=auth, timeout=self.timeout)
+                r = self.web_session.post(url, auth=auth, timeout=self.timeout)
             else:
-                r = self.session.get(url, auth=auth, timeout=self.timeout)
+                r = self.web_session.get(url, auth=auth, timeout=self.timeout)
             r.encoding = 'utf-8'
             assert r.status_code == 200, "got status_code %s" % r.status_code
         except Exception as err:
@@ -178,28 +186,65 @@ class Poll(object):
         else:
             return r
 
+    def poll_node(self, node):
+        scrapyd_server = self.scrapyd_servers[node-1]
+        if self.sync_jobs:
+            self.throttle(node)
+            self.make_request(self.url_jobs.format(node=node), auth=self.auth, post=True)
+
+        # json.loads(json.dumps({'auth':(1,2)})) => {'auth': [1, 2]}
+        auth = self.scrapyd_servers_auths[node-1]
+        auth = tuple(auth) if auth else None  # TypeError: 'list' object is not callable
+        try:
+            running_jobs, finished_jobs_set = self.fetch_jobs(node, scrapyd_server, auth)
+            finished_jobs = self.update_finished_jobs(node, finished_jobs_set)
+            job_tuples = running_jobs + finished_jobs
+
+            def fetch_stats(job_tuple):
+                self.throttle(node)
+                self.fetch_stats(node, job_tuple, finished_jobs)
+
+            concurrency = min(self.poll_request_concurrency, len(job_tuples))
+            if concurrency > 1:
+                pool = ThreadPool(concurrency)
+                try:
+                    pool.map(fetch_stats, job_tuples)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                for job_tuple in job_tuples:
+                    fetch_stats(job_tuple)
+        except KeyboardInterrupt:
+            raise
+        except AssertionError as err:
+            self.logger.error(err)
+        except Exception:
+            self.logger.error(traceback.format_exc())
+
     def run(self):
-        for node, (scrapyd_server, auth) in enumerate(zip(self.scrapyd_servers, self.scrapyd_servers_auths), 1):
-            # Update Jobs history
-            # url_jobs = self.url_scrapydweb + '/%s/jobs/' % node
-            # self.make_request(url_jobs, auth=self.auth, post=True)
-
-            url_jobs = 'http://%s/jobs' % scrapyd_server
-            # json.loads(json.dumps({'auth':(1,2)})) => {'auth': [1, 2]}
-            auth = tuple(auth) if auth else None  # TypeError: 'list' object is not callable
-            try:
-                running_jobs, finished_jobs_set = self.fetch_jobs(node, url_jobs, auth)
-                finished_jobs = self.update_finished_jobs(node, finished_jobs_set)
-                for job_tuple in running_jobs + finished_jobs:
-                    self.fetch_stats(node, job_tuple, finished_jobs)
-                    self.logger.debug("Sleeping for %ss", self.poll_request_interval)
-                    time.sleep(self.poll_request_interval)
-            except KeyboardInterrupt:
-                raise
-            except AssertionError as err:
-                self.logger.error(err)
-            except Exception:
-                self.logger.error(traceback.format_exc())
+        # Nodes are polled in parallel, while requests related to the same node
+        # are limited by poll_request_concurrency and poll_request_interval.
+        nodes = list(range(1, len(self.scrapyd_servers) + 1))
+        if len(nodes) < 2:
+            for node in nodes:
+                self.poll_node(node)
+            return
+        pool = ThreadPool(min(len(nodes), MAX_NODES_CONCURRENCY))
+        try:
+            pool.map(self.poll_node, nodes)
+        finally:
+            pool.close()
+            pool.join()
+
+    def throttle(self, node):
+        # Start at most one request related to the node every poll_request_interval seconds
+        with self.node_lock_dict[node]:
+            wait = self.last_request_time_dict.get(node, 0) + self.poll_request_interval - time.time()
+            if wait > 0:
+                self.logger.debug("[node %s] Sleeping for %.1fs", node, wait)
+                time.sleep(wait)
+            self.last_request_time_dict[node] = time.time()
 
     def update_finished_jobs(self, node, finished_jobs_set):
         finished_jobs_set_previous = self.finished_jobs_dict.setdefault(node, set())
@@ -230,7 +275,8 @@ def main(args):
     keys = ('url_scrapydweb', 'username', 'password',
             'scrapyd_servers', 'scrapyd_servers_auths',
             'poll_round_interval', 'poll_request_interval',
-            'main_pid', 'verbose', 'exit_timeout')
+            'main_pid', 'verbose', 'exit_timeout', 'poll_request_concurrency', 'sync_jobs',
+            'scrapyd_request_timeouts', 'circuit_breaker_threshold', 'circuit_breaker_cooldown')
     kwargs = dict(zip(keys, args))
     kwargs['scrapyd_servers'] = json.loads(kwargs['scrapyd_servers'])
     kwargs['scrapyd_servers_auths'] = json.loads(kwargs['scrapyd_servers_auths'])
@@ -239,6 +285,11 @@ def main(args):
     kwargs['main_pid'] = int(kwargs['main_pid'])
     kwargs['verbose'] = kwargs['verbose'] == 'True'
     kwargs['exit_timeout'] = int(kwargs.setdefault('exit_timeout', 0))  # For test only
+    kwargs['poll_request_concurrency'] = int(kwargs.setdefault('poll_request_concurrency', 1))
+    kwargs['sync_jobs'] = kwargs.setdefault('sync_jobs', 'False') == 'True'
+    kwargs['scrapyd_request_timeouts'] = json.loads(kwargs.setdefault('scrapyd_request_timeouts', '{}'))
+    kwargs['circuit_breaker_threshold'] = int(kwargs.setdefault('circuit_breaker_threshold', 5))
+    kwargs['circuit_breaker_cooldown'] = int(kwargs.setdefault('circuit_breaker_cooldown', 30))
 
     poll = Poll(**kwargs)
     poll.main()
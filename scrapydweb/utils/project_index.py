@@ -0,0 +1,201 @@
+# coding: utf-8
+"""Index the Scrapy projects in SCRAPY_PROJECTS_DIR for the Deploy page,
+with the latest modification time of the files and the project name in scrapy.cfg of each project.
+
+Note that the functions here do not depend on Flask, since a project could be rescanned out of
+any request context, and the warnings are returned along with the result, see scan_project().
+"""
+import logging
+import os
+import threading
+import time
+
+from six import PY2, text_type
+from six.moves.configparser import Error as ScrapyCfgParseError
+from six.moves.queue import Queue
+
+from ..views.operations.scrapyd_deploy import get_config
+
+
+logger = logging.getLogger(__name__)
+
+# Rescan a project in the background if it has not been scanned for N seconds
+PROJECT_INDEX_TTL = 60
+
+
+def safe_walk(top, topdown=True, onerror=None, followlinks=False, on_ignored=None):
+    """os.walk() which ignores the non-unicode filenames in PY2, passing a message to on_ignored(msg) for each."""
+    islink, join, isdir = os.path.islink, os.path.join, os.path.isdir
+
+    # touch $(echo -e "\x8b\x8bThis is a bad filename")
+    # ('top: ', u'/home/username/download/scrapydweb/scrapydweb/data/demo_projects/ScrapydWeb_demo')
+    # ('names: ', ['\x8b\x8bThis', u'ScrapydWeb_demo', u'filename', u'scrapy.cfg', u'a', u'is', u'bad'])
+    try:
+        names = os.listdir(top)
+    except OSError as err:
+        if onerror is not None:
+            onerror(err)
+        return
+
+    new_names = []
+    for name in names:
+        if isinstance(name, text_type):
+            new_names.append(name)
+        else:
+            msg = "Ignore non-unicode filename %s in %s" % (repr(name), top)
+            if on_ignored is not None:
+                on_ignored(msg)
+    names = new_names
+
+    dirs, nondirs = [], []
+    for name in names:
+        if isdir(join(top, name)):
+            dirs.append(name)
+        else:
+            nondirs.append(name)
+
+    if topdown:
+        yield top, dirs, nondirs
+    for name in dirs:
+        new_path = join(top, name)
+        if followlinks or not islink(new_path):
+            for x in safe_walk(new_path, topdown, onerror, followlinks, on_ignored):
+                yield x
+    if not topdown:
+        yield top, dirs, nondirs
+
+
+def get_modification_time(path, warnings, func_walk=os.walk, retry=True):
+    """Return the latest modification time of the files in the project, appending the warnings to `warnings`."""
+    # https://stackoverflow.com/a/29685234/10517783
+    # https://stackoverflow.com/a/13454267/10517783
+    filepath_list = []
+    in_top_dir = True
+    try:
+        for dirpath, dirnames, filenames in func_walk(path):
+            if in_top_dir:
+                in_top_dir = False
+                dirnames[:] = [d for d in dirnames if d not in ['build', 'project.egg-info']]
+                filenames = [f for f in filenames
+                             if not (f.endswith('.egg') or f in ['setup.py', 'setup_backup.py'])]
+            for filename in filenames:
+                filepath_list.append(os.path.join(dirpath, filename))
+    except UnicodeDecodeError:
+        msg = "Found illegal filenames in %s" % path
+        logger.error(msg)
+        warnings.append(msg)
+        if PY2 and retry:
+            def walk(top):
+                return safe_walk(top, on_ignored=warnings.append)
+            return get_modification_time(path, warnings, func_walk=walk, retry=False)
+        else:
+            raise
+    else:
+        return max([os.path.getmtime(f) for f in filepath_list] or [time.time()])
+
+
+def parse_scrapy_cfg(scrapy_cfg):
+    folder = os.path.basename(os.path.dirname(scrapy_cfg))
+    project = ''
+    try:
+        # lib/configparser.py: def get(self, section, option, *, raw=False, vars=None, fallback=_UNSET):
+        # projectname/scrapy.cfg: [deploy] project = demo
+        # PY2: get() got an unexpected keyword argument 'fallback'
+        # project = get_config(scrapy_cfg).get('deploy', 'project', fallback=folder) or folder
+        project = get_config(scrapy_cfg).get('deploy', 'project')
+    except ScrapyCfgParseError as err:
+        logger.error("%s parse error: %s", scrapy_cfg, err)
+    return project or folder
+
+
+def scan_project(scrapy_cfg):
+    """Return a dict like dict(timestamp=1546275661.0, project='demo', warnings=[]),
+    the warnings are to be flashed by the caller if it is in a request context.
+    """
+    warnings = []
+    timestamp = get_modification_time(os.path.dirname(scrapy_cfg), warnings)
+    return dict(timestamp=timestamp, project=parse_scrapy_cfg(scrapy_cfg), warnings=warnings)
+
+
+class ProjectIndex(object):
+    """Cache the result of scanning each project, keyed by the path of its scrapy.cfg.
+
+    A project is rescanned at once only if the modification time of the project folder or its scrapy.cfg
+    has changed, e.g. when a top level file is added, removed or renamed. Otherwise, the cached result
+    is returned even if it is older than `ttl` seconds, in which case the project is rescanned in the
+    background for the next time. So that loading the Deploy page needs only two stats per project,
+    instead of walking all the files of all the projects.
+
+    The stale projects are rescanned one by one by a single worker thread, started on first use.
+    """
+
+    def __init__(self, ttl=PROJECT_INDEX_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}  # {scrapy_cfg: dict(signature=(mtime, mtime), scanned_at=timestamp, result=dict)}
+        self.refreshing = set()
+        self.queue = Queue()  # (scrapy_cfg, scan) to be rescanned by the worker
+        self.worker = None
+
+    @staticmethod
+    def get_signature(scrapy_cfg):
+        try:
+            return os.path.getmtime(os.path.dirname(scrapy_cfg)), os.path.getmtime(scrapy_cfg)
+        except OSError:
+            return None
+
+    def get(self, scrapy_cfg_list, scan=scan_project):
+        """Return a list of the results of scan(scrapy_cfg) for the scrapy_cfg_list, scanning as few as possible.
+        The entries of the projects not in scrapy_cfg_list would be dropped.
+        """
+        results = []
+        for scrapy_cfg in scrapy_cfg_list:
+            signature = self.get_signature(scrapy_cfg)
+            with self.lock:
+                entry = self.entries.get(scrapy_cfg)
+            if not entry or entry['signature'] != signature:
+                entry = self.scan(scrapy_cfg, signature, scan)
+            elif time.time() - entry['scanned_at'] > self.ttl:
+                self.refresh_in_background(scrapy_cfg, scan)
+            results.append(entry['result'])
+        with self.lock:
+            for scrapy_cfg in set(self.entries).difference(scrapy_cfg_list):
+                logger.debug("Drop %s from the project index", scrapy_cfg)
+                self.entries.pop(scrapy_cfg)
+        return results
+
+    def scan(self, scrapy_cfg, signature, scan):
+        logger.debug("Scanning %s", os.path.dirname(scrapy_cfg))
+        entry = dict(signature=signature, scanned_at=time.time(), result=scan(scrapy_cfg))
+        with self.lock:
+            self.entries[scrapy_cfg] = entry
+        return entry
+
+    def refresh_in_background(self, scrapy_cfg, scan):
+        with self.lock:
+            if scrapy_cfg in self.refreshing:
+                return
+            self.refreshing.add(scrapy_cfg)
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.refresh)
+                self.worker.daemon = True
+                self.worker.start()
+        self.queue.put((scrapy_cfg, scan))
+
+    def refresh(self):
+        while True:
+            scrapy_cfg, scan = self.queue.get()
+            try:
+                self.scan(scrapy_cfg, self.get_signature(scrapy_cfg), scan)
+            except Exception as err:
+                logger.error("Fail to rescan %s: %s", os.path.dirname(scrapy_cfg), err)
+            finally:
+                with self.lock:
+                    self.refreshing.discard(scrapy_cfg)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+project_index = ProjectIndex()
@@ -2,8 +2,10 @@
 import atexit
 import logging
 from pprint import pformat
+import threading
 
-from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_REMOVED
+from apscheduler.events import (EVENT_ALL_JOBS_REMOVED, EVENT_JOB_ADDED, EVENT_JOB_MAX_INSTANCES,
+                                EVENT_JOB_MODIFIED, EVENT_JOB_REMOVED)
 from apscheduler.executors.pool import ThreadPoolExecutor  # , ProcessPoolExecutor
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.jobstores.memory import MemoryJobStore
@@ -86,6 +88,38 @@ def my_listener(event):
 # EVENT_JOB_ERROR and EVENT_JOB_MISSED are caught by logging.FileHandler
 scheduler.add_listener(my_listener, EVENT_JOB_MAX_INSTANCES | EVENT_JOB_REMOVED)
 
+
+# Whether any timer task is scheduled to run, i.e. not paused. It's cached for the navigation menu
+# in BaseView instead of querying the job store in every request, and reset on any change of the tasks.
+tasks_summary = dict(version=0, any_running=None)
+tasks_summary_lock = threading.Lock()
+
+
+def any_running_tasks():
+    with tasks_summary_lock:
+        version, any_running = tasks_summary['version'], tasks_summary['any_running']
+    if any_running is None:
+        any_running = any(job.next_run_time for job in scheduler.get_jobs(jobstore='default'))
+        with tasks_summary_lock:
+            # In case that the tasks are changed while querying the job store
+            if tasks_summary['version'] == version:
+                tasks_summary['any_running'] = any_running
+    return any_running
+
+
+def reset_tasks_summary(event=None):
+    if event is not None and getattr(event, 'jobstore', 'default') != 'default':
+        return
+    with tasks_summary_lock:
+        tasks_summary['version'] += 1
+        tasks_summary['any_running'] = None
+
+
+# pause_job() and resume_job() are dispatched as EVENT_JOB_MODIFIED, and a job which would never fire again,
+# like a task with a date trigger, is removed by the scheduler after being executed
+scheduler.add_listener(reset_tasks_summary,
+                       EVENT_JOB_ADDED | EVENT_JOB_MODIFIED | EVENT_JOB_REMOVED | EVENT_ALL_JOBS_REMOVED)
+
 # if scheduler.state == STATE_STOPPED:
 scheduler.start(paused=True)
 
@@ -0,0 +1,394 @@
+# coding: utf-8
+"""Operations on the Scrapyd servers and text sending, which are shared by the views and the background workers.
+
+The callers like LogView.monitor_alert() and TaskExecutor.schedule_task() used to request the routes of ScrapydWeb
+itself via app.test_client(), which builds a request context and a view instance for every single call.
+Now they call ScrapydService directly instead.
+"""
+from itertools import islice
+import json
+import logging
+from multiprocessing.dummy import Pool as ThreadPool
+import re
+import threading
+import time
+
+from logparser import __version__ as LOGPARSER_VERSION
+from six.moves.queue import Queue
+
+from ..common import get_now_string, json_dumps, make_request, session
+from ..models import Task
+from .jobs_listing import jobs_cache
+from .node_load import node_loads
+from .send_email import send_email
+
+
+API_MAP = dict(start='schedule', stop='cancel', forcestop='cancel', liststats='logs/stats')
+# Max number of Scrapyd servers being requested at the same time, see fan_out()
+MAX_NODES_CONCURRENCY = 50
+# Number of the threads shared by all the fan_out() calls and ClusterJobsView, see get_thread_pool()
+THREAD_POOL_SIZE = 100
+
+thread_pool = None
+thread_pool_lock = threading.Lock()
+thread_local = threading.local()
+
+
+def get_thread_pool():
+    """Return the thread pool shared process-wide, which is created on first use and never closed,
+    instead of a new pool for every request.
+    """
+    global thread_pool
+    with thread_pool_lock:
+        if thread_pool is None:
+            thread_pool = ThreadPool(THREAD_POOL_SIZE, initializer=mark_pool_thread)
+        return thread_pool
+
+
+def mark_pool_thread():
+    thread_local.in_pool = True
+
+
+class ScrapydService(object):
+    OK = 'ok'
+    ERROR = 'error'
+    NA = 'N/A'
+    DEFAULT_LATEST_VERSION = 'default: the latest version'
+    LOGPARSER_VERSION = LOGPARSER_VERSION
+
+    def __init__(self, config, logger=None):
+        self.logger = logger or logging.getLogger(self.__class__.__name__)
+
+        self.SCRAPYD_SERVERS = config.get('SCRAPYD_SERVERS', []) or ['127.0.0.1:6800']
+        self.SCRAPYD_SERVERS_AMOUNT = len(self.SCRAPYD_SERVERS)
+        self.SCRAPYD_SERVERS_AUTHS = config.get('SCRAPYD_SERVERS_AUTHS', []) or [None]
+        self.JOBS_CACHE_TTL = config.get('JOBS_CACHE_TTL', 5)
+        self.SCRAPYD_SERVERS_CAPACITIES = config.get('SCRAPYD_SERVERS_CAPACITIES', {})
+
+        self.SLACK_TOKEN = config.get('SLACK_TOKEN', '')
+        self.SLACK_CHANNEL = config.get('SLACK_CHANNEL', '') or 'general'
+        self.TELEGRAM_TOKEN = config.get('TELEGRAM_TOKEN', '')
+        self.TELEGRAM_CHAT_ID = config.get('TELEGRAM_CHAT_ID', 0)
+        self.EMAIL_SUBJECT = config.get('EMAIL_SUBJECT', '') or 'Email from #scrapydweb'
+        self.EMAIL_SENDER = config.get('EMAIL_SENDER', '')
+        self.EMAIL_RECIPIENTS = config.get('EMAIL_RECIPIENTS', [])
+        self.EMAIL_USERNAME = config.get('EMAIL_USERNAME', '') or self.EMAIL_SENDER
+        self.EMAIL_PASSWORD = config.get('EMAIL_PASSWORD', '')
+        self.SMTP_SERVER = config.get('SMTP_SERVER', '')
+        self.SMTP_PORT = config.get('SMTP_PORT', 0)
+        self.SMTP_OVER_SSL = config.get('SMTP_OVER_SSL', False)
+        self.SMTP_CONNECTION_TIMEOUT = config.get('SMTP_CONNECTION_TIMEOUT', 30)
+
+    def get_server_auth(self, node):
+        assert 0 < node <= self.SCRAPYD_SERVERS_AMOUNT, \
+            'node index error: %s, which should be between 1 and %s' % (node, self.SCRAPYD_SERVERS_AMOUNT)
+        return self.SCRAPYD_SERVERS[node - 1], self.SCRAPYD_SERVERS_AUTHS[node - 1]
+
+    def make_request(self, url, **kwargs):
+        return make_request(url, logger=self.logger, **kwargs)
+
+    def fan_out(self, func, nodes, args=(), ordered=False, concurrency=MAX_NODES_CONCURRENCY):
+        """Call func(node, *args) for the nodes concurrently, with at most `concurrency` calls at the same time,
+        and yield a tuple (node, result) as soon as each call returns, or in the order of nodes if ordered=True.
+        func should return a tuple (status_code, js) like make_request(). The exception raised by func
+        would be logged and yielded as (-1, dict(status='error', status_code=-1, message=str(err))),
+        so that the callers always get a JSON serializable result.
+        """
+        def call(node):
+            try:
+                return node, func(node, *args)
+            except Exception as err:
+                self.logger.error("Fail to call %s for node %s: %s", func.__name__, node, err)
+                return node, (-1, dict(status=self.ERROR, status_code=-1, message=str(err)))
+
+        nodes = list(nodes)
+        if getattr(thread_local, 'in_pool', False):
+            # Called by a func running in the shared pool, which would deadlock if waiting for the pool
+            for node in nodes:
+                yield call(node)
+            return
+        pool = get_thread_pool()
+        results = Queue()
+        pending = iter(enumerate(nodes))
+
+        def run(index, node):
+            results.put((index, call(node)))
+
+        def submit(count=1):
+            for index, node in islice(pending, count):
+                pool.apply_async(run, (index, node))
+
+        submit(min(len(nodes), concurrency))
+        buffered = {}
+        next_index = 0
+        try:
+            for __ in range(len(nodes)):
+                index, result = results.get()
+                submit()  # Start the next call once a call returns, so as to keep the concurrency
+                if not ordered:
+                    yield result
+                    continue
+                buffered[index] = result
+                while next_index in buffered:
+                    yield buffered.pop(next_index)
+                    next_index += 1
+        finally:
+            # Not to block the caller if the generator is closed halfway, e.g. the client disconnects,
+            # the calls left are still made in the background.
+            submit(len(nodes))
+
+    def fan_out_lines(self, func, nodes, get_result, args=(), concurrency=MAX_NODES_CONCURRENCY, queue=None):
+        """Run fan_out() in a background thread, and yield get_result(node, result) as one compact JSON per line
+        in the order of completion, for streaming the results as NDJSON. The dicts put into `queue` beforehand
+        or by func in the meantime, e.g. the progress of the uploads, are streamed as well.
+        The calls go on even if the client disconnects, the same as when the results are not streamed.
+        """
+        queue = Queue() if queue is None else queue
+
+        def run():
+            try:
+                for (node, result) in self.fan_out(func, nodes, args=args, concurrency=concurrency):
+                    queue.put(get_result(node, result))
+            finally:
+                queue.put(None)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        for js in iter(queue.get, None):
+            yield json_dumps(js, sort_keys=False, indent=None) + '\n'
+
+    # Scrapyd
+    def api(self, node, opt, project=None, version_spider_job=None):
+        """Return a tuple (status_code, js), the same as the response of the API view,
+        e.g. api(1, 'listversions', 'demo') or api(1, 'stop', 'demo', '2019-01-01T0_00_01').
+        """
+        server, auth = self.get_server_auth(node)
+        url = 'http://{}/{}.json'.format(server, API_MAP.get(opt, opt))
+        if opt in ['listversions', 'listjobs']:
+            url += '?project=%s' % project
+        elif opt == 'listspiders':
+            if version_spider_job == self.DEFAULT_LATEST_VERSION:
+                url += '?project=%s' % project
+            else:
+                # Should be _version
+                url += '?project=%s&_version=%s' % (project, version_spider_job)
+
+        data = dict(project=project)
+        if opt == 'start':
+            data['spider'] = version_spider_job
+            data['jobid'] = get_now_string()
+        elif opt in ['stop', 'forcestop']:
+            data['job'] = version_spider_job
+        elif opt == 'delversion':
+            data['version'] = version_spider_job
+        elif opt == 'delproject':
+            pass
+        else:
+            data = None
+
+        dumps_json = opt not in ['daemonstatus', 'liststats']
+        times = 2 if opt == 'forcestop' else 1
+        status_code, js = 0, {}
+        for __ in range(times):
+            status_code, js = self.make_request(url, data=data, auth=auth, as_json=True,
+                                                dumps_json=dumps_json)
+            if times != 1:
+                js['times'] = times
+                time.sleep(2)
+        js = self.handle_api_result(server, opt, project, version_spider_job, status_code, js)
+        if opt == 'daemonstatus':
+            js['health'] = session.get_health(server).to_dict()
+        return status_code, js
+
+    def handle_api_result(self, server, opt, project, version_spider_job, status_code, js):
+        if status_code != 200:
+            if opt == 'liststats':
+                if project and version_spider_job:  # 'List Stats' in the Servers page
+                    if status_code == 404:
+                        js = dict(status=self.OK, tip="'pip install logparser' and run command 'logparser'")
+                else:  # XMLHttpRequest in the Jobs page; liststats() for jobs.py
+                    js['tip'] = ("'pip install logparser' on host '%s' and run command 'logparser' "
+                                 "to show crawled_pages and scraped_items. ") % server
+            else:
+                js['tip'] = "Make sure that your Scrapyd server is accessable. "
+        elif js['status'] != self.OK:
+            if re.search('No such file|no active project', js.get('message', '')):
+                js['tip'] = "Maybe the project had been deleted, check out the Projects page. "
+            elif opt == 'listversions':
+                js['tip'] = (
+                    "Maybe it's caused by failing to compare versions, "
+                    "you can check out the HELP section in the Deploy Project page for more info, "
+                    "and solve the problem in the Projects page. "
+                )
+            elif opt == 'listspiders' and re.search("TypeError: 'tuple'", js.get('message', '')):
+                js['tip'] = "Maybe it's a broken project, check out the Projects page to delete it. "
+        elif opt == 'liststats':
+            if js.get('logparser_version') != self.LOGPARSER_VERSION:
+                if project and version_spider_job:  # 'List Stats' in the Servers page
+                    tip = "'pip install --upgrade logparser' to update LogParser to v%s" % self.LOGPARSER_VERSION
+                    js = dict(status=self.OK, tip=tip)
+                else:  # XMLHttpRequest in the Jobs page; liststats() for jobs.py
+                    js['tip'] = ("'pip install --upgrade logparser' on host '%s' and run command 'logparser' "
+                                 "to update LogParser to v%s") % (server, self.LOGPARSER_VERSION)
+                    js['status'] = self.ERROR
+            elif project and version_spider_job:  # 'List Stats' in the Servers page
+                js = self.extract_pages_items(project, version_spider_job, js)
+        return js
+
+    def extract_pages_items(self, project, job, js):
+        details = None
+        if project in js['datas']:
+            for spider in js['datas'][project]:
+                for jobid in js['datas'][project][spider]:
+                    if jobid == job:
+                        details = js['datas'][project][spider][job]
+                        js['project'] = project
+                        js['spider'] = spider
+                        js['jobid'] = jobid
+                        break
+        if not details:
+            details = dict(pages=self.NA, items=self.NA)
+        details.setdefault('project', project)
+        details.setdefault('spider', self.NA)
+        details.setdefault('jobid', job)
+        details['logparser_version'] = js.get('logparser_version', None)
+        return dict(status=self.OK, details=details)
+
+    def schedule(self, node, project, spider, jobid=None, version=None, settings_arguments=None):
+        """Return a tuple (status_code, js) for schedule.json,
+        settings_arguments is a dict like {'setting': ['CLOSESPIDER_TIMEOUT=60'], 'arg1': 'val1'}.
+        """
+        server, auth = self.get_server_auth(node)
+        data = dict(project=project)
+        if version and version != self.DEFAULT_LATEST_VERSION:
+            data['_version'] = version
+        data['spider'] = spider
+        data['jobid'] = jobid or get_now_string()
+        data.update(settings_arguments or {})
+        return self.make_request('http://%s/schedule.json' % server, data=data, auth=auth)
+
+    def schedule_task(self, node, task_id, jobid):
+        """Run the spider of a timer task on a node, an app context is required to query the task."""
+        task = Task.query.get(task_id)
+        if not task:
+            server, auth = self.get_server_auth(node)
+            message = "Task #%s not found" % task_id
+            self.logger.error(message)
+            return -1, dict(url='http://%s/schedule.json' % server, auth=auth, status_code=-1,
+                            status=self.ERROR, message=message)
+        return self.schedule(node, task.project, task.spider, jobid=jobid, version=task.version,
+                             settings_arguments=json.loads(task.settings_arguments))
+
+    def select_nodes(self, nodes, amount=1, unsent=False):
+        """Return the `amount` least-loaded nodes among the nodes, with the loads refreshed via daemonstatus.json
+        if requested more than NODE_LOAD_TTL seconds ago, see utils/node_load.py.
+        Set unsent=True if the job would not be sent at once, and call node_loads.sent() after sending it.
+        """
+        servers = dict((node, self.SCRAPYD_SERVERS[node - 1]) for node in nodes)
+        stale = node_loads.get_stale(servers.values())
+        requested_at = time.time()
+        for node, result in self.fan_out(self.api, [n for n in nodes if servers[n] in stale], args=('daemonstatus', )):
+            node_loads.update(servers[node], result[1], requested_at)
+        selected = node_loads.select([(node, servers[node]) for node in nodes], amount=amount,
+                                     capacities=self.SCRAPYD_SERVERS_CAPACITIES, unsent=unsent)
+        self.logger.debug("Selected nodes %s from %s", selected, nodes)
+        return selected
+
+    def cancel(self, node, project, job, force=False):
+        """Stop a job, the request would be sent twice with force=True, so as to kill the Scrapy process."""
+        return self.api(node, 'forcestop' if force else 'stop', project, job)
+
+    def liststats(self, node):
+        """Return the js of the stats of all jobs parsed by LogParser, with js['status'] set to 'error'
+        if LogParser is not running or outdated on the Scrapyd server.
+        """
+        __, js = self.api(node, 'liststats')
+        return js
+
+    def listjobs(self, node, timeout=None):
+        """Return a tuple (status_code, rows, text) via the process-wide jobs_cache, see list_jobs()."""
+        server, auth = self.get_server_auth(node)
+        return jobs_cache.get(session, server, auth=auth, timeout=timeout, ttl=self.JOBS_CACHE_TTL)
+
+    # Send text
+    def send_text(self, opt, text, channel_chatid_subject=None, recipients=None):
+        """Send text via 'slack', 'telegram' or 'email', with the channel, chat_id or subject
+        defaulting to SLACK_CHANNEL, TELEGRAM_CHAT_ID or EMAIL_SUBJECT respectively.
+        """
+        if opt == 'email':
+            js = self.send_email(text, channel_chatid_subject or self.EMAIL_SUBJECT,
+                                 recipients or self.EMAIL_RECIPIENTS)
+        elif opt == 'slack':
+            js = self.send_slack(text, channel_chatid_subject or self.SLACK_CHANNEL)
+        else:
+            js = self.send_telegram(text, channel_chatid_subject or self.TELEGRAM_CHAT_ID)
+        js['when'] = get_now_string(True)
+        return js
+
+    def send_email(self, text, subject, recipients):
+        if not self.EMAIL_PASSWORD:
+            return dict(status=self.ERROR, result="The EMAIL_PASSWORD option is unset")
+        email_kwargs = dict(
+            email_username=self.EMAIL_USERNAME,
+            email_password=self.EMAIL_PASSWORD,
+            email_sender=self.EMAIL_SENDER,
+            email_recipients=recipients,
+            smtp_server=self.SMTP_SERVER,
+            smtp_port=self.SMTP_PORT,
+            smtp_over_ssl=self.SMTP_OVER_SSL,
+            smtp_connection_timeout=self.SMTP_CONNECTION_TIMEOUT,
+            subject=subject,
+            content=text
+        )
+        result, reason = send_email(to_retry=True, **email_kwargs)
+        if result is True:
+            self.logger.debug("Sent to %s via Email", recipients)
+            js = dict(status=self.OK,
+                      result=dict(reason=reason, sender=self.EMAIL_SENDER, recipients=recipients,
+                                  subject=subject, text=text))
+        else:
+            js = dict(status=self.ERROR, result=dict(reason=reason), debug=email_kwargs)
+            self.logger.error("Fail to send text via Email:\n%s", json_dumps(js))
+        return js
+
+    def send_slack(self, text, channel):
+        if not self.SLACK_TOKEN:
+            return dict(status=self.ERROR, result="The SLACK_TOKEN option is unset")
+        url = 'https://slack.com/api/chat.postMessage'
+        data = dict(token=self.SLACK_TOKEN, channel=channel, text=text)
+        status_code, result = self.make_request(url, data=data, check_status=False, to_scrapyd=False)
+        for key in ['auth', 'status', 'status_code', 'url', 'when']:
+            result.pop(key, None)
+        js = dict(url=url, status_code=status_code, result=result)
+        # {"ok":false,"error":"invalid_auth"}
+        # {"ok":false,"error":"channel_not_found"}
+        # {"ok":false,"error":"no_text"}
+        if result.get('ok', False):
+            self.logger.debug("Sent to bot %s via Slack", result.get('message', {}).get('username', ''))
+            js['status'] = self.OK
+        else:
+            js['status'] = self.ERROR
+            js['debug'] = dict(token=self.SLACK_TOKEN, channel=channel, text=text)
+            self.logger.error("Fail to send text via Slack:\n%s", json_dumps(js))
+        return js
+
+    def send_telegram(self, text, chat_id):
+        if not self.TELEGRAM_TOKEN:
+            return dict(status=self.ERROR, result="The TELEGRAM_TOKEN option is unset")
+        url = 'https://api.telegram.org/bot%s/sendMessage' % self.TELEGRAM_TOKEN
+        data = dict(text=text, chat_id=chat_id)
+        status_code, result = self.make_request(url, data=data, check_status=False, to_scrapyd=False)
+        for key in ['auth', 'status', 'status_code', 'url', 'when']:
+            result.pop(key, None)
+        js = dict(url=url, status_code=status_code, result=result)
+        if result.get('ok', False):
+            self.logger.debug("Sent to %s via Telegram",
+                              result.get('result', {}).get('chat', {}).get('first_name', ''))
+            js['status'] = self.OK
+        # {"ok":false,"error_code":400,"description":"Bad Request: chat not found"}
+        else:
+            js['status'] = self.ERROR
+            js['debug'] = dict(token=self.TELEGRAM_TOKEN, chat_id=chat_id, text=text)
+            self.logger.error("Fail to send text via Telegram:\n%s", json_dumps(js))
+        return js
@@ -0,0 +1,224 @@
+# coding: utf-8
+"""The settings of ScrapydWeb which are read by every view, built from app.config only once.
+
+BaseView used to run about a hundred app.config.get() in every request. Now the settings are collected
+into a read-only Settings object, which is rebuilt only after app.config is modified,
+e.g. by check_app_config() at startup or by the tests. See Config below.
+"""
+import threading
+
+from flask import Config as FlaskConfig
+
+from ..vars import (ALLOWED_SCRAPYD_LOG_EXTENSIONS, APSCHEDULER_DATABASE_URI, DATA_PATH,
+                    DEMO_PROJECTS_PATH, ALERT_TRIGGER_KEYS, SCHEDULE_ADDITIONAL)
+
+
+class Config(FlaskConfig):
+    """flask.Config which drops the cached Settings once modified."""
+
+    def __init__(self, root_path, defaults=None):
+        super(Config, self).__init__(root_path, defaults)
+        self.version = 0
+        self.settings = None  # (version, Settings)
+
+    def changed(self):
+        self.version += 1
+        self.settings = None
+
+    def __setitem__(self, key, value):
+        super(Config, self).__setitem__(key, value)
+        self.changed()
+
+    def __delitem__(self, key):
+        super(Config, self).__delitem__(key)
+        self.changed()
+
+    def update(self, *args, **kwargs):
+        super(Config, self).update(*args, **kwargs)
+        self.changed()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.changed()
+        return super(Config, self).setdefault(key, default)
+
+    def pop(self, *args):
+        self.changed()
+        return super(Config, self).pop(*args)
+
+    def popitem(self):
+        self.changed()
+        return super(Config, self).popitem()
+
+    def clear(self):
+        super(Config, self).clear()
+        self.changed()
+
+
+class Settings(object):
+    """Read-only snapshot of app.config, with the defaults applied and the derived options computed.
+
+    Only the uppercase attributes are settings, see items(). Note that EMAIL_KWARGS should be copied
+    before being modified, since the same Settings object is shared by all requests.
+    """
+
+    def __init__(self, config):
+        # Not in the config file
+        self.DEFAULT_SETTINGS_PY_PATH = config['DEFAULT_SETTINGS_PY_PATH']
+        self.SCRAPYDWEB_SETTINGS_PY_PATH = config['SCRAPYDWEB_SETTINGS_PY_PATH']
+        self.MAIN_PID = config['MAIN_PID']
+        self.LOGPARSER_PID = config['LOGPARSER_PID']
+        self.POLL_PID = config['POLL_PID']
+
+        # System
+        self.DEBUG = config.get('DEBUG', False)
+        self.VERBOSE = config.get('VERBOSE', False)
+        self.DATA_PATH = DATA_PATH
+        self.APSCHEDULER_DATABASE_URI = APSCHEDULER_DATABASE_URI
+        self.SQLALCHEMY_DATABASE_URI = config['SQLALCHEMY_DATABASE_URI']
+        self.SQLALCHEMY_BINDS = config['SQLALCHEMY_BINDS']
+
+        # ScrapydWeb
+        self.SCRAPYDWEB_BIND = config.get('SCRAPYDWEB_BIND', '0.0.0.0')
+        self.SCRAPYDWEB_PORT = config.get('SCRAPYDWEB_PORT', 5000)
+
+        self.ENABLE_AUTH = config.get('ENABLE_AUTH', False)
+        self.USERNAME = config.get('USERNAME', '')
+        self.PASSWORD = config.get('PASSWORD', '')
+
+        self.ENABLE_HTTPS = config.get('ENABLE_HTTPS', False)
+        self.CERTIFICATE_FILEPATH = config.get('CERTIFICATE_FILEPATH', '')
+        self.PRIVATEKEY_FILEPATH = config.get('PRIVATEKEY_FILEPATH', '')
+
+        self.URL_SCRAPYDWEB = config.get('URL_SCRAPYDWEB', 'http://127.0.0.1:5000')
+
+        # Scrapy
+        self.SCRAPY_PROJECTS_DIR = config.get('SCRAPY_PROJECTS_DIR', '') or DEMO_PROJECTS_PATH
+        self.EGG_CACHE_SIZE = config.get('EGG_CACHE_SIZE', 100)
+        self.EGG_CACHE_MAX_AGE = config.get('EGG_CACHE_MAX_AGE', 7)
+        self.EGG_BUILD_PROCESSES = config.get('EGG_BUILD_PROCESSES', 2)
+        self.MEMORY_CACHE_SIZE = config.get('MEMORY_CACHE_SIZE', 64)
+
+        # Scrapyd
+        self.SCRAPYD_SERVERS = config.get('SCRAPYD_SERVERS', []) or ['127.0.0.1:6800']
+        self.SCRAPYD_SERVERS_AMOUNT = len(self.SCRAPYD_SERVERS)
+        self.SCRAPYD_SERVERS_GROUPS = config.get('SCRAPYD_SERVERS_GROUPS', []) or ['']
+        self.SCRAPYD_SERVERS_AUTHS = config.get('SCRAPYD_SERVERS_AUTHS', []) or [None]
+        self.SCRAPYD_SERVERS_PUBLIC_URLS = (config.get('SCRAPYD_SERVERS_PUBLIC_URLS', None)
+                                            or [None] * self.SCRAPYD_SERVERS_AMOUNT)
+
+        self.LOCAL_SCRAPYD_SERVER = config.get('LOCAL_SCRAPYD_SERVER', '')
+        self.LOCAL_SCRAPYD_LOGS_DIR = config.get('LOCAL_SCRAPYD_LOGS_DIR', '')
+        self.SCRAPYD_LOG_EXTENSIONS = (config.get('SCRAPYD_LOG_EXTENSIONS', [])
+                                       or ALLOWED_SCRAPYD_LOG_EXTENSIONS)
+        self.SCRAPYD_REQUEST_TIMEOUTS = config.get('SCRAPYD_REQUEST_TIMEOUTS', {})
+        self.CIRCUIT_BREAKER_THRESHOLD = config.get('CIRCUIT_BREAKER_THRESHOLD', 5)
+        self.CIRCUIT_BREAKER_COOLDOWN = config.get('CIRCUIT_BREAKER_COOLDOWN', 30)
+        self.SCRAPYD_SERVERS_CAPACITIES = config.get('SCRAPYD_SERVERS_CAPACITIES', {})
+
+        # LogParser
+        self.ENABLE_LOGPARSER = config.get('ENABLE_LOGPARSER', False)
+        self.BACKUP_STATS_JSON_FILE = config.get('BACKUP_STATS_JSON_FILE', True)
+
+        # Timer Tasks
+        self.JOBS_SNAPSHOT_INTERVAL = config.get('JOBS_SNAPSHOT_INTERVAL', 300)
+
+        # Run Spider
+        self.SCHEDULE_EXPAND_SETTINGS_ARGUMENTS = config.get('SCHEDULE_EXPAND_SETTINGS_ARGUMENTS', False)
+        self.SCHEDULE_CUSTOM_USER_AGENT = config.get('SCHEDULE_CUSTOM_USER_AGENT', 'Mozilla/5.0')
+        self.SCHEDULE_USER_AGENT = config.get('SCHEDULE_USER_AGENT', None)
+        self.SCHEDULE_ROBOTSTXT_OBEY = config.get('SCHEDULE_ROBOTSTXT_OBEY', None)
+        self.SCHEDULE_COOKIES_ENABLED = config.get('SCHEDULE_COOKIES_ENABLED', None)
+        self.SCHEDULE_CONCURRENT_REQUESTS = config.get('SCHEDULE_CONCURRENT_REQUESTS', None)
+        self.SCHEDULE_DOWNLOAD_DELAY = config.get('SCHEDULE_DOWNLOAD_DELAY', None)
+        self.SCHEDULE_ADDITIONAL = config.get('SCHEDULE_ADDITIONAL', SCHEDULE_ADDITIONAL)
+        self.SCHEDULE_RATE_LIMIT = config.get('SCHEDULE_RATE_LIMIT', 5)
+
+        # Page Display
+        self.SHOW_SCRAPYD_ITEMS = config.get('SHOW_SCRAPYD_ITEMS', True)
+        self.SHOW_JOBS_JOB_COLUMN = config.get('SHOW_JOBS_JOB_COLUMN', False)
+        self.JOBS_FINISHED_JOBS_LIMIT = config.get('JOBS_FINISHED_JOBS_LIMIT', 0)
+        self.JOBS_RELOAD_INTERVAL = config.get('JOBS_RELOAD_INTERVAL', 300)
+        self.JOBS_CACHE_TTL = config.get('JOBS_CACHE_TTL', 5)
+        self.ENABLE_JOBS_STREAM = config.get('ENABLE_JOBS_STREAM', False)
+        self.CLUSTER_JOBS_TIMEOUT = config.get('CLUSTER_JOBS_TIMEOUT', 10)
+        self.DAEMONSTATUS_REFRESH_INTERVAL = config.get('DAEMONSTATUS_REFRESH_INTERVAL', 10)
+
+        # Send text
+        self.SLACK_TOKEN = config.get('SLACK_TOKEN', '')
+        self.SLACK_CHANNEL = config.get('SLACK_CHANNEL', '') or 'general'
+        self.TELEGRAM_TOKEN = config.get('TELEGRAM_TOKEN', '')
+        self.TELEGRAM_CHAT_ID = config.get('TELEGRAM_CHAT_ID', 0)
+        self.EMAIL_SUBJECT = config.get('EMAIL_SUBJECT', '') or 'Email from #scrapydweb'
+
+        # Monitor & Alert
+        self.ENABLE_MONITOR = config.get('ENABLE_MONITOR', False)
+        self.ENABLE_SLACK_ALERT = config.get('ENABLE_SLACK_ALERT', False)
+        self.ENABLE_TELEGRAM_ALERT = config.get('ENABLE_TELEGRAM_ALERT', False)
+        self.ENABLE_EMAIL_ALERT = config.get('ENABLE_EMAIL_ALERT', False)
+
+        self.EMAIL_SENDER = config.get('EMAIL_SENDER', '')
+        self.EMAIL_RECIPIENTS = config.get('EMAIL_RECIPIENTS', [])
+        self.EMAIL_USERNAME = config.get('EMAIL_USERNAME', '') or self.EMAIL_SENDER
+        self.EMAIL_PASSWORD = config.get('EMAIL_PASSWORD', '')
+
+        self.SMTP_SERVER = config.get('SMTP_SERVER', '')
+        self.SMTP_PORT = config.get('SMTP_PORT', 0)
+        self.SMTP_OVER_SSL = config.get('SMTP_OVER_SSL', False)
+        self.SMTP_CONNECTION_TIMEOUT = config.get('SMTP_CONNECTION_TIMEOUT', 30)
+
+        self.EMAIL_KWARGS = dict(
+            email_username=self.EMAIL_USERNAME,
+            email_password=self.EMAIL_PASSWORD,
+            email_sender=self.EMAIL_SENDER,
+            email_recipients=self.EMAIL_RECIPIENTS,
+            smtp_server=self.SMTP_SERVER,
+            smtp_port=self.SMTP_PORT,
+            smtp_over_ssl=self.SMTP_OVER_SSL,
+            smtp_connection_timeout=self.SMTP_CONNECTION_TIMEOUT,
+            subject='subject',
+            content='content'
+        )
+
+        self.POLL_ROUND_INTERVAL = config.get('POLL_ROUND_INTERVAL', 300)
+        self.POLL_REQUEST_INTERVAL = config.get('POLL_REQUEST_INTERVAL', 10)
+        self.POLL_REQUEST_CONCURRENCY = config.get('POLL_REQUEST_CONCURRENCY', 1)
+        self.ALERT_WORKING_DAYS = config.get('ALERT_WORKING_DAYS', [])
+        self.ALERT_WORKING_HOURS = config.get('ALERT_WORKING_HOURS', [])
+        self.ON_JOB_RUNNING_INTERVAL = config.get('ON_JOB_RUNNING_INTERVAL', 0)
+        self.ON_JOB_FINISHED = config.get('ON_JOB_FINISHED', False)
+        # ['CRITICAL', 'ERROR', 'WARNING', 'REDIRECT', 'RETRY', 'IGNORE']
+        for key in ALERT_TRIGGER_KEYS:
+            setattr(self, 'LOG_%s_THRESHOLD' % key, config.get('LOG_%s_THRESHOLD' % key, 0))
+            setattr(self, 'LOG_%s_TRIGGER_STOP' % key, config.get('LOG_%s_TRIGGER_STOP' % key, False))
+            setattr(self, 'LOG_%s_TRIGGER_FORCESTOP' % key, config.get('LOG_%s_TRIGGER_FORCESTOP' % key, False))
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError("Settings is read-only: %s" % name)
+        super(Settings, self).__setattr__(name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError("Settings is read-only: %s" % name)
+
+    def items(self):
+        return [(k, v) for (k, v) in self.__dict__.items() if k.isupper()]
+
+
+settings_lock = threading.Lock()
+
+
+def get_settings(config):
+    """Return the Settings of app.config, which is built on the first call after app.config is modified."""
+    cached = getattr(config, 'settings', None)
+    version = getattr(config, 'version', None)
+    if cached and cached[0] == version:
+        return cached[1]
+    settings = Settings(config)
+    if version is not None:
+        with settings_lock:
+            # In case that app.config is modified while building the Settings
+            if config.version == version:
+                config.settings = (version, settings)
+    return settings
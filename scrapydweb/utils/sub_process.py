@@ -103,7 +103,13 @@ def start_poll(config):
         str(config.get('POLL_ROUND_INTERVAL', 300)),
         str(config.get('POLL_REQUEST_INTERVAL', 10)),
         str(config['MAIN_PID']),
-        str(config.get('VERBOSE', False))
+        str(config.get('VERBOSE', False)),
+        '0',  # exit_timeout
+        str(config.get('POLL_REQUEST_CONCURRENCY', 1)),
+        str(config.get('ENABLE_JOBS_STREAM', False)),  # sync_jobs
+        json_dumps(config.get('SCRAPYD_REQUEST_TIMEOUTS', {})),
+        str(config.get('CIRCUIT_BREAKER_THRESHOLD', 5)),
+        str(config.get('CIRCUIT_BREAKER_COOLDOWN', 30))
     ]
 
     # 'Windows':
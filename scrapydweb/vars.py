@@ -40,12 +40,13 @@ else:
 DATABASE_PATH = os.path.join(DATA_PATH, 'database')
 DEMO_PROJECTS_PATH = os.path.join(DATA_PATH, 'demo_projects')
 DEPLOY_PATH = os.path.join(DATA_PATH, 'deploy')
+EGG_CACHE_PATH = os.path.join(DEPLOY_PATH, 'egg_cache')
 HISTORY_LOG = os.path.join(DATA_PATH, 'history_log')
 PARSE_PATH = os.path.join(DATA_PATH, 'parse')
 SCHEDULE_PATH = os.path.join(DATA_PATH, 'schedule')
 STATS_PATH = os.path.join(DATA_PATH, 'stats')
 
-for path in [DATA_PATH, DATABASE_PATH, DEMO_PROJECTS_PATH, DEPLOY_PATH,
+for path in [DATA_PATH, DATABASE_PATH, DEMO_PROJECTS_PATH, DEPLOY_PATH, EGG_CACHE_PATH,
              HISTORY_LOG, PARSE_PATH, SCHEDULE_PATH, STATS_PATH]:
     if not os.path.isdir(path):
         os.mkdir(path)
@@ -96,9 +97,6 @@ DIRECTORY_PATTERN = re.compile(r"""
 DIRECTORY_KEYS = ['odd_even', 'filename', 'size', 'content_type', 'content_encoding']
 HREF_NAME_PATTERN = re.compile(r'href="(.+?)">(.+?)<')
 
-# For JobsView
-jobs_table_map = {}
-
 # For Timer Tasks
 # STATE_STOPPED = 0, STATE_RUNNING = 1, STATE_PAUSED = 2
 SCHEDULER_STATE_DICT = {
@@ -0,0 +1,116 @@
+# coding: utf-8
+import multiprocessing
+import time
+
+from flask import render_template, request, url_for
+
+from ...utils.service import get_thread_pool
+from ..baseview import BaseView
+
+
+STATUS_ORDER = dict(running=0, pending=1, finished=2)
+
+
+class ClusterJobsView(BaseView):
+    """Merge the jobs of all Scrapyd servers (or the servers of a group) into one table,
+    with the jobs filtered by project, spider and status.
+
+    The Scrapyd servers are requested in parallel, and those failing to respond
+    within CLUSTER_JOBS_TIMEOUT seconds are reported as unreachable.
+    """
+    methods = ['GET']
+
+    def __init__(self):
+        super(ClusterJobsView, self).__init__()
+
+        self.group = request.args.get('group', '')
+        self.project = request.args.get('project', '')
+        self.spider = request.args.get('spider', '')
+        self.status = request.args.get('status', '')
+        self.listjobs = request.args.get('listjobs', None)
+
+        self.nodes = [n for n in range(1, self.SCRAPYD_SERVERS_AMOUNT + 1)
+                      if not self.group or self.SCRAPYD_SERVERS_GROUPS[n - 1] == self.group]
+        self.groups = []
+        for group in self.SCRAPYD_SERVERS_GROUPS:
+            if group and group not in self.groups:
+                self.groups.append(group)
+        self.node_results = []
+        self.jobs = []
+        self.template = 'scrapydweb/cluster_jobs.html'
+
+    def dispatch_request(self, **kwargs):
+        for node, (status_code, rows, text) in zip(self.nodes, self.fetch_all_nodes()):
+            self.node_results.append(dict(
+                node=node,
+                server=self.SCRAPYD_SERVERS[node - 1],
+                group=self.SCRAPYD_SERVERS_GROUPS[node - 1],
+                status=self.OK if rows is not None else self.ERROR,
+                status_code=status_code,
+                message='' if rows is not None else text[:1000],
+                url_jobs=url_for('jobs', node=node)
+            ))
+            if rows is not None:
+                self.add_jobs(node, rows)
+        # Running jobs first, then Pending and Finished, with the latest ones on the top
+        self.jobs.sort(key=lambda job: job['finish'] or job['start'], reverse=True)
+        self.jobs.sort(key=lambda job: STATUS_ORDER[job['status']])
+
+        if self.listjobs:
+            js = dict(status=self.OK, nodes=self.node_results, jobs=self.jobs,
+                      filters=dict(group=self.group, project=self.project, spider=self.spider, status=self.status))
+            return self.json_dumps(js, as_response=True)
+        kwargs = dict(
+            node=self.node,
+            groups=self.groups,
+            group=self.group,
+            project=self.project,
+            spider=self.spider,
+            status=self.status,
+            node_results=self.node_results,
+            jobs=self.jobs,
+            url_listjobs=url_for('clusterjobs', node=self.node, group=self.group, project=self.project,
+                                 spider=self.spider, status=self.status, listjobs='True'),
+            CLUSTER_JOBS_TIMEOUT=self.CLUSTER_JOBS_TIMEOUT
+        )
+        return render_template(self.template, **kwargs)
+
+    def fetch_all_nodes(self):
+        if not self.nodes:
+            return []
+        timeout = self.CLUSTER_JOBS_TIMEOUT
+        # The requests timed out would be finished in the shared pool, instead of blocking the response
+        pool = get_thread_pool()
+        async_results = [pool.apply_async(self.service.listjobs, (node, timeout)) for node in self.nodes]
+        # All the nodes share the same deadline, so that the latency is bounded by the slowest node
+        deadline = time.time() + timeout
+        results = []
+        for node, async_result in zip(self.nodes, async_results):
+            try:
+                results.append(async_result.get(max(0, deadline - time.time())))
+            except multiprocessing.TimeoutError:
+                self.logger.warning("Fail to list jobs of node %s in %s seconds", node, timeout)
+                results.append((-1, None, "Timeout after %s seconds" % timeout))
+        return results
+
+    def add_jobs(self, node, rows):
+        jobs = []
+        finished_jobs = []
+        for row in rows:
+            status = 'finished' if row.finish else ('running' if row.start else 'pending')
+            if ((self.project and row.project != self.project) or (self.spider and row.spider != self.spider)
+               or (self.status and status != self.status)):
+                continue
+            job = dict(row._asdict(), node=node, server=self.SCRAPYD_SERVERS[node - 1],
+                       group=self.SCRAPYD_SERVERS_GROUPS[node - 1], status=status)
+            if status == 'pending':
+                job['url_stats'] = ''
+            else:
+                job_finished = 'True' if row.finish else None
+                job['url_stats'] = url_for('log', node=node, opt='stats', project=row.project,
+                                           spider=row.spider, job=row.job, job_finished=job_finished)
+            (finished_jobs if row.finish else jobs).append(job)
+        # Finished jobs are listed in ascending order by Scrapyd
+        if self.JOBS_FINISHED_JOBS_LIMIT > 0:
+            finished_jobs = finished_jobs[-self.JOBS_FINISHED_JOBS_LIMIT:]
+        self.jobs.extend(jobs + finished_jobs)
@@ -1,24 +1,34 @@
 # coding: utf-8
-from collections import OrderedDict
-from datetime import datetime
-import re
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+import threading
+import time
 import traceback
 
-from flask import flash, get_flashed_messages, render_template, request, url_for
+from flask import Response, flash, get_flashed_messages, render_template, request, stream_with_context, url_for
+from flask_sqlalchemy import Pagination
 from six.moves.urllib.parse import urljoin
+from sqlalchemy import and_, or_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
 
-from ...common import handle_metadata
-from ...models import create_jobs_table, db
-from ...vars import STRICT_NAME_PATTERN, jobs_table_map
+from ...common import handle_metadata, increase_metadata
+from ...models import Job, db
+from ...utils.jobs_listing import JOB_KEYS
 from ..baseview import BaseView
 
 
 _metadata = handle_metadata()
 metadata = dict(
-    pageview=_metadata.get('pageview', 1),
     per_page=_metadata.get('jobs_per_page', 100),
     style=_metadata.get('jobs_style', 'database'),
-    unique_key_strings={}
+    unique_key_strings={},
+    jobs_count={},  # {node: count}, the number of jobs not deleted, see count_jobs()
+    db_sync={},  # {node: dict(inserted=0, updated=0, unchanged=0, deleted=0)}, stats of the latest sync
+    # {node: deque([(datetime, id)])}, the pending jobs deleted from the database, see JobsDeltaView
+    removed_jobs={},
+    # {node: datetime}, a delta since an earlier time would be incomplete since the removed jobs are dropped
+    removed_jobs_since={}
 )
 
 STATUS_PENDING = '0'
@@ -26,22 +36,74 @@ STATUS_RUNNING = '1'
 STATUS_FINISHED = '2'
 NOT_DELETED = '0'
 DELETED = '1'
-HREF_PATTERN = re.compile(r"""href=['"](.+?)['"]""")  # Temp support for Scrapyd v1.3.0 (not released)
-JOB_PATTERN = re.compile(r"""
-                            <tr>
-                                <td>(?P<Project>.*?)</td>
-                                <td>(?P<Spider>.*?)</td>
-                                <td>(?P<Job>.*?)</td>
-                                (?:<td>(?P<PID>.*?)</td>)?
-                                (?:<td>(?P<Start>.*?)</td>)?
-                                (?:<td>(?P<Runtime>.*?)</td>)?
-                                (?:<td>(?P<Finish>.*?)</td>)?
-                                (?:<td>(?P<Log>.*?)</td>)?
-                                (?:<td>(?P<Items>.*?)</td>)?
-                                [\w\W]*?  # Temp support for Scrapyd v1.3.0 (not released)
-                            </tr>
-                          """, re.X)
-JOB_KEYS = ['project', 'spider', 'job', 'pid', 'start', 'runtime', 'finish', 'href_log', 'href_items']
+SELECT_BATCH_SIZE = 500
+START_TIME = datetime.now()
+UNIQUE_KEYS = ['node_server', 'project', 'spider', 'job']
+# Only jobs with any of these columns changed would be written into the database
+CHANGE_DETECTION_KEYS = ['status', 'deleted', 'pid', 'start', 'runtime', 'finish', 'pages', 'items',
+                         'href_log', 'href_items']
+REMOVED_JOBS_LIMIT = 1000
+# Each connection of Server-Sent Events is closed after STREAM_LIFETIME seconds and then reconnected
+# by the browser, with a comment line sent every STREAM_HEARTBEAT seconds to keep it alive.
+STREAM_LIFETIME = 600
+STREAM_HEARTBEAT = 15
+STREAM_RETRY = 3000  # milliseconds
+
+# The watermark of a delta is moved back N seconds, see get_watermark()
+WATERMARK_OVERLAP = 1
+
+# Writes of the jobs of the same node are serialized, so that no row would be committed
+# with an update_time earlier than the watermark of a delta, see JobsDeltaView.get_delta().
+node_lock_dict = {}
+# The version is increased after any job of the node is changed, and the streams would be woken up.
+jobs_condition = threading.Condition()
+jobs_version_dict = {}
+
+
+def get_node_lock(node):
+    return node_lock_dict.setdefault(node, threading.RLock())
+
+
+def get_watermark():
+    """Return the watermark of a delta, the next delta would return the rows with update_time >= watermark.
+
+    It is truncated to whole seconds, since the DATETIME column of MySQL keeps no fractional seconds,
+    and moved back WATERMARK_OVERLAP seconds for the clock skew between the processes writing the jobs.
+    So a row might be returned again by the next delta, and the Jobs page would dedupe the rows by id.
+    """
+    return (datetime.now() - timedelta(seconds=WATERMARK_OVERLAP)).replace(microsecond=0)
+
+
+def notify_jobs_changed(node):
+    """Wake up the streams of the node. Note that it only works within the current process,
+    the changes written by other processes would be found by JobsStreamView every STREAM_HEARTBEAT seconds.
+    """
+    with jobs_condition:
+        jobs_version_dict[node] = jobs_version_dict.get(node, 0) + 1
+        jobs_condition.notify_all()
+
+
+def wait_jobs_changed(node, version, timeout):
+    with jobs_condition:
+        if jobs_version_dict.get(node, 0) == version:
+            jobs_condition.wait(timeout)
+        return jobs_version_dict.get(node, 0)
+
+
+def keyset_filter(keys, backward=False):
+    """Return the condition for the rows after (or before if backward) the cursor in the sort order,
+    i.e. (a > 1) OR (a = 1 AND b < 2) OR ... for the keys [(a, 1, True), (b, 2, False), ...].
+
+    A key with a NULL value in the cursor is skipped, since start and finish are NULL
+    for all the Pending jobs, and finish is NULL for all the Running jobs.
+    """
+    condition = None
+    for column, value, ascending in reversed(keys):
+        if value is None:
+            continue
+        beyond = column > value if ascending != backward else column < value
+        condition = beyond if condition is None else or_(beyond, and_(column == value, condition))
+    return condition
 
 
 class JobsView(BaseView):
@@ -64,6 +126,9 @@ class JobsView(BaseView):
             handle_metadata('jobs_per_page', self.per_page)
             self.logger.debug("Change per_page to %s", self.metadata['per_page'])
         self.page = request.args.get('page', default=1, type=int)
+        # The id of the last job in the previous page, or the first job in the next page, see paginate_jobs()
+        self.after = request.args.get('after', default=None, type=int)
+        self.before = request.args.get('before', default=None, type=int)
 
         self.url = 'http://%s/jobs' % self.SCRAPYD_SERVER
         if self.SCRAPYD_SERVER_PUBLIC_URL:
@@ -72,6 +137,7 @@ class JobsView(BaseView):
             self.public_url = None
         self.text = ''
         self.kwargs = {}
+        self.pageview = 1
         if self.USE_MOBILEUI:
             self.style = 'classic'
             self.template = 'scrapydweb/jobs_mobileui.html'
@@ -91,12 +157,13 @@ class JobsView(BaseView):
         self.running_jobs = []
         self.finished_jobs = []
         self.jobs_pagination = None
+        self.watermark = None
 
-        self.Job = None  # database class Job
+        self.Job = Job  # The unified table for all Scrapyd servers, filtered by node_server
 
     def dispatch_request(self, **kwargs):
-        status_code, self.text = self.make_request(self.url, auth=self.AUTH, as_json=False)
-        if status_code != 200 or not re.search(r'<body><h1>Jobs</h1>', self.text):
+        status_code, rows, self.text = self.service.listjobs(self.node)
+        if rows is None:
             kwargs = dict(
                 node=self.node,
                 url=self.url,
@@ -105,9 +172,7 @@ class JobsView(BaseView):
                 tip="Click the above link to make sure your Scrapyd server is accessable. "
             )
             return render_template(self.template_fail, **kwargs)
-        # Temp support for Scrapyd v1.3.0 (not released)
-        self.text = re.sub(r'<thead>.*?</thead>', '', self.text, flags=re.S)
-        self.jobs = [dict(zip(JOB_KEYS, job)) for job in re.findall(JOB_PATTERN, self.text)]
+        self.jobs = [dict(zip(JOB_KEYS, row)) for row in rows]
         self.jobs_backup = list(self.jobs)
 
         if self.listjobs:
@@ -116,8 +181,8 @@ class JobsView(BaseView):
         if self.POST:  # To update self.liststats_datas
             self.get_liststats_datas()
         else:
-            self.metadata['pageview'] += 1
-            self.logger.debug('metadata: %s', self.metadata)
+            self.pageview = increase_metadata('pageview')
+            self.logger.debug('pageview: %s', self.pageview)
             self.set_flash()
         if self.style == 'database' or self.POST:
             self.handle_jobs_with_db()
@@ -136,7 +201,7 @@ class JobsView(BaseView):
         return render_template(self.template, **self.kwargs)
 
     def set_flash(self):
-        if self.metadata['pageview'] > 2 and self.metadata['pageview'] % 100:
+        if self.pageview > 2 and self.pageview % 100:
             return
         if not self.ENABLE_AUTH and self.SCRAPYD_SERVERS_AMOUNT == 1:
             flash("Set 'ENABLE_AUTH = True' to enable basic auth for web UI", self.INFO)
@@ -160,11 +225,7 @@ class JobsView(BaseView):
 #                     "pages": 3,
 #                     "items": 2,
     def get_liststats_datas(self):
-        # NOTE: get_response_from_view() would update g.url_jobs_list, unexpected for mobileui
-        # request.url: http://localhost/1/api/liststats/
-        # TODO: test https
-        url_liststats = url_for('api', node=self.node, opt='liststats')
-        js = self.get_response_from_view(url_liststats, as_json=True)
+        js = self.service.liststats(self.node)
         if js['status'] == self.OK:
             self.liststats_datas = js.pop('datas', {})
             self.logger.debug("Got datas with %s entries from liststats: %s", len(self.liststats_datas), js)
@@ -172,35 +233,16 @@ class JobsView(BaseView):
             self.logger.warning("Fail to get datas from liststats: (%s) %s %s",
                                 js['status_code'], js['status'], js.get('tip', ''))
 
-    def create_table(self):
-        self.Job = jobs_table_map.get(self.node, None)
-        if self.Job is not None:
-            self.logger.debug("Got table: %s", self.Job.__tablename__)
-        else:
-            self.Job = create_jobs_table(re.sub(STRICT_NAME_PATTERN, '_', self.SCRAPYD_SERVER))
-            # sqlite3.OperationalError: table "127_0_0_1_6800" already exists
-            db.create_all(bind='jobs')
-            self.metadata[self.node] = self.Job
-            jobs_table_map[self.node] = self.Job
-            self.logger.debug("Created table: %s", self.Job.__tablename__)
-
     def handle_jobs_with_db(self):
         try:
             if request.args.get('raise_exception') == 'True':  # For test only
                 assert False, "raise_exception: True"
-            self.handle_unique_constraint()
-            self.create_table()
-            self.db_insert_jobs()
-            self.db_clean_pending_jobs()
+            self.sync_jobs()
             self.query_jobs()
         except Exception as err:
             self.logger.error("Fail to persist jobs in database: %s", traceback.format_exc())
             db.session.rollback()
             flash("Fail to persist jobs in database: %s" % err, self.WARN)
-            # sqlalchemy.exc.InvalidRequestError: Table '127_0_0_1_6800' is already defined for this MetaData instance.
-            # Specify 'extend_existing=True' to redefine options and columns on an existing Table object.
-            if "is already defined for this MetaData instance" in str(err):
-                flash("Please restart ScrapydWeb to work around this occasional bug!", self.WARN)
             if self.style == 'database' and not self.POST:
                 self.style = 'classic'
                 self.template = 'scrapydweb/jobs_classic.html'
@@ -210,6 +252,16 @@ class JobsView(BaseView):
                 self.logger.info(msg)
                 # flash(msg, self.WARN)
 
+    def sync_jobs(self):
+        self.handle_unique_constraint()
+        with get_node_lock(self.node):
+            self.db_insert_jobs()
+            self.db_clean_pending_jobs()
+            self.watermark = get_watermark()
+        db_sync = self.metadata['db_sync'][self.node]
+        if db_sync['inserted'] or db_sync['updated'] or db_sync['deleted']:
+            notify_jobs_changed(self.node)
+
     # Note that there may be jobs with the same combination of (project, spider, job) in the fetched Jobs
     def handle_unique_constraint(self):
         seen_jobs = OrderedDict()
@@ -247,9 +299,15 @@ class JobsView(BaseView):
         self.jobs = list(seen_jobs.values())
 
     def db_insert_jobs(self):
-        records = []
-        for job in self.jobs:  # set(self.jobs): unhashable type: 'dict'
-            record = self.Job.query.filter_by(project=job['project'], spider=job['spider'], job=job['job']).first()
+        rows = [self.get_job_row(job) for job in self.jobs]  # set(self.jobs): unhashable type: 'dict'
+        records_dict = self.db_select_jobs([row['job'] for row in rows])
+        # SQLite DateTime type only accepts Python datetime and date objects as input
+        now = datetime.now()  # datetime.now().replace(microsecond=0)
+        insert_rows = []
+        update_rows = []
+        unchanged_count = 0
+        for job, row in zip(self.jobs, rows):
+            record = records_dict.get((job['project'], job['spider'], job['job']))
             if record:
                 self.logger.debug("Found job in database: %s", record)
                 if record.deleted == DELETED:
@@ -257,61 +315,134 @@ class JobsView(BaseView):
                         self.logger.info("Ignore deleted job: %s", record)
                         continue
                     else:
-                        record.deleted = NOT_DELETED
-                        record.pages = None
-                        record.items = None
+                        row['deleted'] = NOT_DELETED
+                        row['pages'] = None
+                        row['items'] = None
                         self.logger.info("Recover deleted job: %s", record)
                         flash("Recover deleted job: %s" % job, self.WARN)
+                changes = dict((k, v) for (k, v) in row.items()
+                               if k in CHANGE_DETECTION_KEYS and getattr(record, k) != v)
+                if not changes:
+                    unchanged_count += 1
+                    continue
+                self.logger.debug("Changes of %s: %s", record, changes)
+                changes['id'] = record.id
+                changes['update_time'] = now
+                update_rows.append(changes)
             else:
-                record = self.Job()
-            records.append(record)
-            for k, v in job.items():
-                v = v or None  # Save NULL in database for empty string
-                if k in ['start', 'finish']:
-                    v = datetime.strptime(v, '%Y-%m-%d %H:%M:%S') if v else None  # Avoid empty string
-                elif k in ['href_log', 'href_items']:  # <a href='/logs/demo/test/xxx.log'>Log</a>
-                    m = re.search(HREF_PATTERN, v) if v else None
-                    v = m.group(1) if m else v
-                setattr(record, k, v)
-            if not job['start']:
-                record.status = STATUS_PENDING
-            elif not job['finish']:
-                record.status = STATUS_RUNNING
-            else:
-                record.status = STATUS_FINISHED
-            if not job['start']:
-                record.pages = None
-                record.items = None
-            elif self.liststats_datas:
-                try:
-                    data = self.liststats_datas[job['project']][job['spider']][job['job']]
-                    record.pages = data['pages']  # Logparser: None or non-negative int
-                    record.items = data['items']  # Logparser: None or non-negative int
-                except KeyError:
-                    pass
-                except Exception as err:
-                    self.logger.error(err)
-            # SQLite DateTime type only accepts Python datetime and date objects as input
-            record.update_time = datetime.now()  # datetime.now().replace(microsecond=0)
-        # https://www.reddit.com/r/flask/comments/3tea4k/af_flasksqlalchemy_bulk_updateinsert/
-        db.session.add_all(records)
+                row['node_server'] = self.SCRAPYD_SERVER
+                row['create_time'] = now
+                row['update_time'] = now
+                row.setdefault('pages', None)
+                row.setdefault('items', None)
+                insert_rows.append(row)
+        self.db_bulk_insert(insert_rows)
+        if insert_rows or any('deleted' in changes for changes in update_rows):
+            self.metadata['jobs_count'].pop(self.node, None)
+        # https://docs.sqlalchemy.org/en/13/orm/persistence_techniques.html#bulk-operations
+        db.session.bulk_update_mappings(self.Job, update_rows)
         db.session.commit()
+        db_sync = dict(inserted=len(insert_rows), updated=len(update_rows), unchanged=unchanged_count)
+        self.metadata['db_sync'][self.node] = db_sync
+        self.logger.debug("Rows written into table %s for %s: %s", self.Job.__tablename__, self.SCRAPYD_SERVER,
+                          db_sync)
+
+    def get_job_row(self, job):
+        row = {}
+        for k, v in job.items():
+            v = v or None  # Save NULL in database for empty string
+            if k in ['start', 'finish']:
+                v = datetime.strptime(v, '%Y-%m-%d %H:%M:%S') if v else None  # Avoid empty string
+            elif k == 'pid':
+                v = int(v) if v else None
+            row[k] = v
+        if not job['start']:
+            row['status'] = STATUS_PENDING
+        elif not job['finish']:
+            row['status'] = STATUS_RUNNING
+        else:
+            row['status'] = STATUS_FINISHED
+        if not job['start']:
+            row['pages'] = None
+            row['items'] = None
+        elif self.liststats_datas:
+            try:
+                data = self.liststats_datas[job['project']][job['spider']][job['job']]
+                row['pages'] = data['pages']  # Logparser: None or non-negative int
+                row['items'] = data['items']  # Logparser: None or non-negative int
+            except KeyError:
+                pass
+            except Exception as err:
+                self.logger.error(err)
+        return row
+
+    def db_select_jobs(self, jobs):
+        # Select existing records in batches to avoid 'too many SQL variables' in SQLite
+        Job = self.Job
+        records_dict = {}
+        unique_jobs = list(set(jobs))
+        for i in range(0, len(unique_jobs), SELECT_BATCH_SIZE):
+            query = db.session.query(Job.id, Job.project, Job.spider, Job.job, Job.status, Job.deleted,
+                                     Job.pages, Job.items, Job.pid, Job.start, Job.runtime, Job.finish,
+                                     Job.href_log, Job.href_items).filter(Job.node_server == self.SCRAPYD_SERVER)
+            for record in query.filter(Job.job.in_(unique_jobs[i:i+SELECT_BATCH_SIZE])).all():
+                records_dict[(record.project, record.spider, record.job)] = record
+        return records_dict
+
+    def db_bulk_insert(self, rows):
+        if not rows:
+            return
+        # Native upsert is used for MySQL and PostgreSQL in case the same jobs are inserted
+        # by concurrent requests, e.g. the jobs snapshot and the Jobs page.
+        if self.SQLALCHEMY_DATABASE_URI.startswith('postgres'):
+            stmt = postgresql_insert(self.Job.__table__).values(rows)
+            keys = [k for k in rows[0] if k not in UNIQUE_KEYS + ['create_time']]
+            stmt = stmt.on_conflict_do_update(index_elements=UNIQUE_KEYS,
+                                              set_=dict((k, stmt.excluded[k]) for k in keys))
+            db.session.execute(stmt)
+        elif self.SQLALCHEMY_DATABASE_URI.startswith('mysql'):
+            stmt = mysql_insert(self.Job.__table__).values(rows)
+            keys = [k for k in rows[0] if k not in UNIQUE_KEYS + ['create_time']]
+            stmt = stmt.on_duplicate_key_update(**dict((k, stmt.inserted[k]) for k in keys))
+            db.session.execute(stmt)
+        else:
+            db.session.bulk_insert_mappings(self.Job, rows)
 
     def db_clean_pending_jobs(self):
-        current_pending_jobs = [(job['project'], job['spider'], job['job'])
-                                for job in self.jobs_backup if not job['start']]
-        for record in self.Job.query.filter_by(start=None).all():
-            if (record.project, record.spider, record.job) not in current_pending_jobs:
-                db.session.delete(record)
-                db.session.commit()
-                self.logger.info("Deleted pending jobs %s", record)
+        Job = self.Job
+        current_pending_jobs = set((job['project'], job['spider'], job['job'])
+                                   for job in self.jobs_backup if not job['start'])
+        query = Job.query.filter(Job.node_server == self.SCRAPYD_SERVER, Job.start.is_(None))
+        if not current_pending_jobs:
+            ids = [record.id for record in query.with_entities(Job.id)]
+            deleted_count = query.delete(synchronize_session=False)
+        else:
+            # Row value comparison like (project, spider, job) NOT IN (...) is not supported by all databases
+            ids = [record.id for record in query.with_entities(Job.id, Job.project, Job.spider, Job.job)
+                   if (record.project, record.spider, record.job) not in current_pending_jobs]
+            deleted_count = 0
+            for i in range(0, len(ids), SELECT_BATCH_SIZE):
+                deleted_count += Job.query.filter(Job.id.in_(ids[i:i+SELECT_BATCH_SIZE])).delete(
+                    synchronize_session=False)
+        db.session.commit()  # All in one transaction
+        self.metadata['db_sync'].setdefault(self.node, {})['deleted'] = deleted_count
+        if deleted_count:
+            self.metadata['jobs_count'].pop(self.node, None)
+            self.add_removed_jobs(ids)
+            self.logger.info("Deleted %s pending jobs of %s", deleted_count, self.SCRAPYD_SERVER)
+
+    def add_removed_jobs(self, ids):
+        now = datetime.now()
+        removed_jobs = self.metadata['removed_jobs'].setdefault(self.node, deque(maxlen=REMOVED_JOBS_LIMIT))
+        for id_ in ids:
+            if len(removed_jobs) == removed_jobs.maxlen:
+                self.metadata['removed_jobs_since'][self.node] = removed_jobs[0][0]
+            removed_jobs.append((now, id_))
 
     def query_jobs(self):
         current_running_job_pids = [int(job['pid']) for job in self.jobs_backup if job['pid']]
         self.logger.debug("current_running_job_pids: %s", current_running_job_pids)
-        self.jobs_pagination = self.Job.query.filter_by(deleted=NOT_DELETED).order_by(
-            self.Job.status.asc(), self.Job.finish.desc(), self.Job.start.asc(), self.Job.id.asc()).paginate(
-            page=self.page, per_page=self.per_page, error_out=False)
+        self.jobs_pagination = self.paginate_jobs()
         with db.session.no_autoflush:
             for index, job in enumerate(self.jobs_pagination.items,
                                         (self.jobs_pagination.page - 1) * self.jobs_pagination.per_page + 1):
@@ -355,6 +486,38 @@ class JobsView(BaseView):
                     job.url_items = ''
                 job.url_delete = url_for('jobs.xhr', node=self.node, action='delete', id=job.id)
 
+    def count_jobs(self, query):
+        # The count is cached until any job is inserted, deleted or recovered, see db_insert_jobs(),
+        # db_clean_pending_jobs() and JobsXhrView, so that a page view would not run COUNT(*) every time.
+        count = self.metadata['jobs_count'].get(self.node)
+        if count is None:
+            count = self.metadata['jobs_count'][self.node] = query.order_by(None).count()
+        return count
+
+    def paginate_jobs(self):
+        Job = self.Job
+        # The filter and the sort are covered by the index 'ix_job_node_server_deleted_status_finish_start_id'
+        # in models.py, so that the adjacent pages are located by the keys of the cursor instead of OFFSET.
+        query = Job.query.filter_by(node_server=self.SCRAPYD_SERVER, deleted=NOT_DELETED)
+        total = self.count_jobs(query)
+        cursor = None
+        if self.after or self.before:
+            cursor = query.with_entities(Job.id, Job.status, Job.finish, Job.start).filter(
+                Job.id == (self.after or self.before)).first()
+        if cursor:
+            backward = not self.after
+            # (column, value of the cursor, ascending)
+            keys = [(Job.status, cursor.status, True), (Job.finish, cursor.finish, False),
+                    (Job.start, cursor.start, True), (Job.id, cursor.id, True)]
+            order_by = [column.asc() if ascending != backward else column.desc() for (column, __, ascending) in keys]
+            items = query.filter(keyset_filter(keys, backward)).order_by(*order_by).limit(self.per_page).all()
+            if backward:
+                items.reverse()
+        else:  # The first page, jumping to another page, or the job of the cursor has been deleted
+            order_by = [Job.status.asc(), Job.finish.desc(), Job.start.asc(), Job.id.asc()]
+            items = query.order_by(*order_by).limit(self.per_page).offset((self.page - 1) * self.per_page).all()
+        return Pagination(None, self.page, self.per_page, total, items)
+
     def set_jobs_dict(self):
         for job in self.jobs_pagination.items:  # Pagination obj in handle_jobs_with_db() > query_jobs()
             key = '%s/%s/%s' % (job.project, job.spider, job.job)
@@ -392,10 +555,9 @@ class JobsView(BaseView):
                                            spider=job['spider'], job=job['job'], job_finished=job_finished)
                 job['url_clusterreports'] = url_for('clusterreports', node=self.node, project=job['project'],
                                                     spider=job['spider'], job=job['job'])
-                # <a href='/items/demo/test/2018-10-12_205507.jl'>Items</a>
-                m = re.search(HREF_PATTERN, job['href_items'])
-                if m:
-                    job['url_items'] = urljoin(self.public_url or self.url, m.group(1))
+                # '/items/demo/test/2018-10-12_205507.jl'
+                if job['href_items']:
+                    job['url_items'] = urljoin(self.public_url or self.url, job['href_items'])
                 else:
                     job['url_items'] = ''
 
@@ -416,13 +578,17 @@ class JobsView(BaseView):
             LOGPARSER_VERSION=self.LOGPARSER_VERSION,
             JOBS_RELOAD_INTERVAL=self.JOBS_RELOAD_INTERVAL,
             IS_IE_EDGE=self.IS_IE_EDGE,
-            pageview=self.metadata['pageview'],
+            pageview=self.pageview,
             FEATURES=self.FEATURES
         )
         if self.style == 'database':
             self.kwargs.update(dict(
                 url_jobs_classic=url_for('jobs', node=self.node, style='classic'),
-                jobs=self.jobs_pagination
+                jobs=self.jobs_pagination,
+                watermark=str(self.watermark or ''),
+                url_jobs_delta=url_for('jobs.delta', node=self.node),
+                url_jobs_stream=url_for('jobs.stream', node=self.node),
+                ENABLE_JOBS_STREAM=self.ENABLE_JOBS_STREAM and self.ENABLE_MONITOR
             ))
             return
 
@@ -450,14 +616,18 @@ class JobsXhrView(BaseView):
         self.id = self.view_args['id']  # <int:id>
 
         self.js = {}
-        self.Job = jobs_table_map[self.node]  # database class Job
+        self.Job = Job
 
     def dispatch_request(self, **kwargs):
-        job = self.Job.query.get(self.id)
+        job = self.Job.query.filter_by(id=self.id, node_server=self.SCRAPYD_SERVER).first()
         if job:
             try:
-                job.deleted = DELETED
-                db.session.commit()
+                with get_node_lock(self.node):
+                    job.deleted = DELETED
+                    job.update_time = datetime.now()
+                    db.session.commit()
+                self.metadata['jobs_count'].pop(self.node, None)
+                notify_jobs_changed(self.node)
             except Exception as err:
                 self.logger.error(traceback.format_exc())
                 db.session.rollback()
@@ -471,3 +641,122 @@ class JobsXhrView(BaseView):
             self.js['message'] = "job #%s not found in the database" % self.id
 
         return self.json_dumps(self.js, as_response=True)
+
+
+class JobsDeltaView(JobsView):
+    """Return the jobs added, changed or removed since the watermark of the last response,
+    so that the Jobs page could be updated in place instead of being reloaded.
+
+    Set the sync argument to 'False' to skip fetching the jobs from the Scrapyd server.
+    """
+    methods = ['GET']
+
+    def __init__(self):
+        super(JobsDeltaView, self).__init__()
+
+        # The browser would send the id of the last event while reconnecting to the stream
+        self.since = request.headers.get('Last-Event-ID', None) or request.args.get('since', None)
+        self.sync = request.args.get('sync', 'True') == 'True'
+
+    def dispatch_request(self, **kwargs):
+        try:
+            since = self.parse_since(self.since)
+        except ValueError as err:
+            return self.json_dumps(dict(status=self.ERROR, message=str(err)), as_response=True)
+        if self.sync:
+            status_code, rows, text = self.service.listjobs(self.node)
+            if rows is None:
+                return self.json_dumps(dict(status=self.ERROR, status_code=status_code, url=self.url,
+                                            message=text), as_response=True)
+            self.jobs = [dict(zip(JOB_KEYS, row)) for row in rows]
+            self.jobs_backup = list(self.jobs)
+            try:
+                self.sync_jobs()
+            except Exception as err:
+                self.logger.error("Fail to persist jobs in database: %s", traceback.format_exc())
+                db.session.rollback()
+                return self.json_dumps(dict(status=self.ERROR, message=str(err)), as_response=True)
+            finally:
+                get_flashed_messages()
+        return self.json_dumps(self.get_delta(since), as_response=True)
+
+    @staticmethod
+    def parse_since(since):
+        if not since:
+            return None
+        # str(datetime): '2019-01-01 00:00:01' or '2019-01-01 00:00:01.123456'
+        fmt = '%Y-%m-%d %H:%M:%S.%f' if '.' in since else '%Y-%m-%d %H:%M:%S'
+        try:
+            return datetime.strptime(since, fmt)
+        except ValueError:
+            raise ValueError("Invalid since: %s, it should be the watermark of the last delta" % since)
+
+    def get_delta(self, since):
+        Job = self.Job
+        with get_node_lock(self.node):
+            # Rows committed later would get an update_time not earlier than the watermark
+            watermark = get_watermark()
+            db.session.commit()  # Start a new transaction to read the latest rows
+        js = dict(status=self.OK, node=self.node, since=str(since or ''), watermark=str(watermark),
+                  reset=False, added=[], changed=[], removed=[])
+        # The removed jobs are kept in memory, a full reload is required if any of them might have been dropped
+        removed_jobs_since = self.metadata['removed_jobs_since'].get(self.node, START_TIME)
+        if since is None or since < removed_jobs_since:
+            js['reset'] = True
+            return js
+        # Not to use '>' since the rows updated in the same second as the watermark would be missed in MySQL
+        query = Job.query.filter(Job.node_server == self.SCRAPYD_SERVER, Job.update_time >= since)
+        for job in query.order_by(Job.id.asc()):
+            if job.deleted == DELETED:
+                js['removed'].append(job.id)
+            elif job.create_time >= since:
+                js['added'].append(self.get_job_dict(job))
+            else:
+                js['changed'].append(self.get_job_dict(job))
+        for (timestamp, id_) in self.metadata['removed_jobs'].get(self.node, []):
+            if timestamp >= since:
+                js['removed'].append(id_)
+        return js
+
+    @staticmethod
+    def get_job_dict(job):
+        js = {}
+        for column in job.__table__.columns:
+            value = getattr(job, column.name)
+            js[column.name] = str(value) if isinstance(value, datetime) else value
+        return js
+
+
+class JobsStreamView(JobsDeltaView):
+    """Push the delta of jobs via Server-Sent Events whenever the jobs of the node are synced,
+    e.g. by the poll subprocess if ENABLE_JOBS_STREAM is True, see poll_node() in poll.py.
+    The database is also queried every STREAM_HEARTBEAT seconds, see notify_jobs_changed().
+    """
+
+    def dispatch_request(self, **kwargs):
+        try:
+            since = self.parse_since(self.since)
+        except ValueError:
+            since = None
+
+        def generate():
+            last_since = since
+            version = None
+            deadline = time.time() + STREAM_LIFETIME
+            yield 'retry: %s\n\n' % STREAM_RETRY
+            while time.time() < deadline:
+                # Also query the database on timeout, for the jobs written by other processes
+                version = wait_jobs_changed(self.node, version, STREAM_HEARTBEAT)
+                try:
+                    js = self.get_delta(last_since)
+                finally:
+                    db.session.remove()  # Not to hold the connection while waiting
+                last_since = self.parse_since(js['watermark'])
+                if js['reset'] or js['added'] or js['changed'] or js['removed']:
+                    data = self.json_dumps(js, sort_keys=False, indent=None)
+                    yield 'id: %s\ndata: %s\n\n' % (js['watermark'], data)
+                else:
+                    yield ': heartbeat\n\n'
+
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
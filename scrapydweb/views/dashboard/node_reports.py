@@ -1,6 +1,4 @@
 # coding: utf-8
-import json
-
 from flask import render_template, url_for
 
 from ..baseview import BaseView
@@ -20,18 +18,23 @@ class NodeReportsView(BaseView):
         self.template = 'scrapydweb/node_reports.html'
 
     def dispatch_request(self, **kwargs):
-        self.text = self.get_response_from_view(self.url, as_json=False)
-        try:
-            self.jobs = json.loads(self.text)
-        except ValueError as err:
-            self.logger.error("Fail to decode json from %s: %s", self.url, err)
-            return self.text
+        # Fetch from the Scrapyd server directly instead of requesting the Jobs page of ScrapydWeb
+        status_code, self.jobs, self.text = self.service.listjobs(self.node)
+        if self.jobs is None:
+            kwargs = dict(
+                node=self.node,
+                url='http://%s/jobs' % self.SCRAPYD_SERVER,
+                status_code=status_code,
+                text=self.text,
+                tip="Click the above link to make sure your Scrapyd server is accessable. "
+            )
+            return render_template(self.template_fail, **kwargs)
 
         for job in self.jobs:
-            if not job['start']:
+            if not job.start:
                 self.pending_jobs.append(job)
             else:
-                if job['finish']:
+                if job.finish:
                     self.finished_jobs.append(job)
                 else:
                     self.running_jobs.append(job)
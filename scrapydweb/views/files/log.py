@@ -1,5 +1,6 @@
 # coding: utf-8
 from collections import OrderedDict, defaultdict
+from copy import deepcopy
 from datetime import date, datetime
 import io
 import json
@@ -8,11 +9,13 @@ import re
 from subprocess import Popen
 import sys
 import tarfile
+import threading
 import time
 
 from flask import flash, get_flashed_messages, render_template, request, url_for
 from logparser import parse
 
+from ...utils.log_tail import LogTail
 from ...vars import ROOT_DIR
 from ..baseview import BaseView
 
@@ -33,6 +36,9 @@ job_data_dict = {}
 job_finished_key_dict = defaultdict(OrderedDict)
 # For /log/report/
 job_finished_report_dict = defaultdict(OrderedDict)
+# For incremental parsing of logfile: {job_key: (ext, LogTail instance)}
+job_log_tail_dict = OrderedDict()
+job_log_tail_lock = threading.Lock()
 REPORT_KEYS_SET = {'from_memory', 'status', 'pages', 'items', 'shutdown_reason', 'finish_reason', 'runtime',
                    'first_log_time', 'latest_log_time', 'log_categories', 'latest_matches'}
 
@@ -71,7 +77,7 @@ class LogView(BaseView):
 
         self.status_code = 0
         self.text = ''
-        if self.opt == 'report':
+        if self.opt in ['report', 'monitor']:
             self.template = None
         else:
             self.template = 'scrapydweb/%s%s.html' % (self.opt, '_mobileui' if self.USE_MOBILEUI else '')
@@ -86,15 +92,22 @@ class LogView(BaseView):
         self.stats_realtime = False
         self.stats_logparser = False
         self.report_logparser = False
+        # Headless path for poll.py, see handle_monitor()
+        self.monitor_only = False
         if self.opt == 'utf8':
             flash("It's recommended to check out the latest log via: the Stats page >> View log >> Tail", self.WARN)
             self.utf8_realtime = True
         elif self.opt == 'stats':
             self.stats_realtime = True if request.args.get('realtime', None) else False
             self.stats_logparser = not self.stats_realtime
+        elif self.opt == 'monitor':
+            self.stats_logparser = True
+            self.monitor_only = True
         else:
             self.report_logparser = True
         self.logparser_valid = False
+        self.log_tail_valid = False
+        self.tail_status_codes = {}  # {ext: status_code}, the remote logfiles requested by tail_scrapy_log()
         self.backup_stats_valid = False
         spider_path = self.mkdir_spider_path()
         self.backup_stats_path = os.path.join(spider_path, job_without_ext + '.json')
@@ -123,7 +136,11 @@ class LogView(BaseView):
             if not self.logparser_valid:
                 self.request_stats_by_logparser()
 
-        if not self.logparser_valid and not self.text:
+        # Only the bytes appended since last request would be read and parsed
+        if not self.logparser_valid and not self.utf8_realtime:
+            self.tail_scrapy_log()
+
+        if not self.logparser_valid and not self.log_tail_valid and not self.text:
             # Try to read local logfile
             if self.IS_LOCAL_SCRAPYD_SERVER and self.LOCAL_SCRAPYD_LOGS_DIR:
                 self.read_local_scrapy_log()
@@ -134,12 +151,16 @@ class LogView(BaseView):
                     if self.stats_logparser or self.report_logparser:
                         self.load_backup_stats()
                     if not self.backup_stats_valid:
-                        if not self.report_logparser:
+                        if self.monitor_only:
+                            get_flashed_messages()
+                            js = dict(status=self.ERROR, status_code=self.status_code, url=self.url)
+                            return self.json_dumps(js, as_response=True)
+                        elif not self.report_logparser:
                             kwargs = dict(node=self.node, url=self.url, status_code=self.status_code, text=self.text)
                             return render_template(self.template_fail, **kwargs)
             else:
                 self.url += self.SCRAPYD_LOG_EXTENSIONS[0]
-        else:
+        elif not self.log_tail_valid:
             self.url += self.SCRAPYD_LOG_EXTENSIONS[0]
 
         if (not self.utf8_realtime
@@ -163,6 +184,9 @@ class LogView(BaseView):
             else:
                 status_code = self.status_code
             return self.json_dumps(self.stats or dict(status='error'), as_response=True), status_code
+        elif self.monitor_only:
+            get_flashed_messages()
+            return self.handle_monitor()
         else:
             self.update_kwargs()
             if self.ENABLE_MONITOR and self.POST:  # Only poll.py would make POST request
@@ -235,6 +259,11 @@ class LogView(BaseView):
 
     def request_scrapy_log(self):
         for ext in self.SCRAPYD_LOG_EXTENSIONS:
+            # Not to request the logfile again if tail_scrapy_log() has got 404 for it
+            if self.tail_status_codes.get(ext) == 404:
+                self.logger.debug("Skip requesting logfile %s which got 404 when tailing", self.url + ext)
+                self.status_code = 404
+                continue
             url = self.url + ext
             self.status_code, self.text = self.make_request(url, auth=self.AUTH, as_json=False)
             if self.status_code == 200:
@@ -247,6 +276,52 @@ class LogView(BaseView):
             flash(msg, self.WARN)
             self.url += self.SCRAPYD_LOG_EXTENSIONS[0]
 
+    def tail_scrapy_log(self):
+        with job_log_tail_lock:
+            ext_log_tail = job_log_tail_dict.pop(self.job_key, None)
+        if ext_log_tail:
+            candidates = [ext_log_tail]
+        else:
+            candidates = []
+            for ext in self.SCRAPYD_LOG_EXTENSIONS:
+                # Byte offset makes no sense for gzipped logfile
+                if (self.job + ext).endswith('.gz'):
+                    continue
+                log_path = self.log_path + ext
+                if (self.IS_LOCAL_SCRAPYD_SERVER and self.LOCAL_SCRAPYD_LOGS_DIR
+                   and os.path.exists(log_path) and not tarfile.is_tarfile(log_path)):
+                    candidates.append((ext, LogTail(log_path)))
+                else:
+                    candidates.append((ext, LogTail(self.url + ext, auth=self.AUTH)))
+        for ext, log_tail in candidates:
+            try:
+                status_code = log_tail.update()
+            except Exception as err:
+                self.logger.error("Fail to parse the appended log of %s: %s", log_tail.source, err)
+                continue
+            if log_tail.is_url:
+                self.tail_status_codes[ext] = status_code
+            if status_code == 200:
+                break
+        else:
+            self.logger.debug("Fail to tail logfile of %s with extensions %s", self.job_key,
+                              self.SCRAPYD_LOG_EXTENSIONS)
+            return
+
+        self.log_tail_valid = True
+        self.url += ext
+        # The parsed data would be modified in update_kwargs()
+        self.stats = deepcopy(log_tail.data)
+        self.stats.setdefault('crawler_engine', {})
+        with job_log_tail_lock:
+            job_log_tail_dict[self.job_key] = (ext, log_tail)
+            if len(job_log_tail_dict) > self.jobs_to_keep:
+                job_log_tail_dict.popitem(last=False)
+        msg = "Using %s logfile: %s, parsed %s bytes in total" % (
+            'remote' if log_tail.is_url else 'local', self.handle_slash(log_tail.source), log_tail.data['position'])
+        self.logger.debug(msg)
+        flash(msg, self.INFO)
+
     def simplify_stats_for_report(self):
         for key in list(self.stats.keys()):
             if key not in REPORT_KEYS_SET:
@@ -400,6 +475,18 @@ class LogView(BaseView):
                                                       job_finished=self.job_finished, with_ext=self.with_ext,
                                                       ui=self.UI)
 
+    def handle_monitor(self):
+        # Evaluate thresholds and triggers straight from the parsed stats,
+        # skipping the kwargs and url_for() calls which are only needed by stats.html
+        if self.ENABLE_MONITOR and self.POST and self.stats:
+            self.kwargs.update(self.stats)
+            if self.BACKUP_STATS_JSON_FILE and self.job_finished:
+                self.backup_stats()
+            self.monitor_alert()
+        js = dict(status=self.OK, job_key=self.job_key, flag=self.flag,
+                  pages=self.stats.get('pages'), items=self.stats.get('items'))
+        return self.json_dumps(js, as_response=True)
+
     # TODO: https://blog.miguelgrinberg.com/post/the-flask-mega-tutorial-part-x-email-support
     def monitor_alert(self):
         job_data_default = ([0] * 8, [False] * 6, False, time.time())
@@ -426,7 +513,9 @@ class LogView(BaseView):
         self.email_content_kwargs['runtime'] = self.kwargs['runtime']
         self.email_content_kwargs['shutdown_reason'] = self.kwargs['shutdown_reason']
         self.email_content_kwargs['finish_reason'] = self.kwargs['finish_reason']
-        self.email_content_kwargs['url_stats'] = request.url + '%sui=mobile' % '&' if request.args else '?'
+        # Link to the Stats page even if the request comes from the headless monitor path
+        url_stats = request.url.replace('/log/monitor/', '/log/stats/', 1)
+        self.email_content_kwargs['url_stats'] = url_stats + '%sui=mobile' % '&' if request.args else '?'
 
         for idx, key in enumerate(EMAIL_CONTENT_KEYS):
             if self.job_stats_diff[idx]:
@@ -477,14 +566,10 @@ class LogView(BaseView):
                         self.flag = '%s_Trigger' % key if not self.flag else self.flag
             if to_forcestop:
                 self.logger.debug("%s: %s", self.flag, self.job_key)
-                _url = url_for('api', node=self.node, opt='forcestop',
-                               project=self.project, version_spider_job=self.job)
-                self.get_response_from_view(_url)
+                self.service.cancel(self.node, self.project, self.job, force=True)
             elif to_stop:
                 self.logger.debug("%s: %s", self.flag, self.job_key)
-                _url = url_for('api', node=self.node, opt='stop',
-                               project=self.project, version_spider_job=self.job)
-                self.get_response_from_view(_url)
+                self.service.cancel(self.node, self.project, self.job)
 
         if not self.flag and 0 < self.ON_JOB_RUNNING_INTERVAL <= time.time() - self.last_send_timestamp:
             self.flag = 'Running'
@@ -513,12 +598,10 @@ class LogView(BaseView):
             )
             if self.ENABLE_SLACK_ALERT:
                 self.logger.info("Sending alert via Slack: %s", subject)
-                _url = url_for('sendtextapi', opt='slack', channel_chatid_subject=None, text=None)
-                self.get_response_from_view(_url, data=data)
+                self.service.send_text('slack', self.json_dumps(data))
             if self.ENABLE_TELEGRAM_ALERT:
                 self.logger.info("Sending alert via Telegram: %s", subject)
-                _url = url_for('sendtextapi', opt='telegram', channel_chatid_subject=None, text=None)
-                self.get_response_from_view(_url, data=data)
+                self.service.send_text('telegram', self.json_dumps(data))
             if self.ENABLE_EMAIL_ALERT:
                 self.logger.info("Sending alert via Email: %s", subject)
                 args = [
@@ -1,6 +1,5 @@
 # coding: utf-8
 import datetime
-import json
 
 from flask import render_template, request, url_for
 
@@ -20,15 +19,8 @@ class ProjectsView(BaseView):
         self.js = {}
 
     def dispatch_request(self, **kwargs):
-        # self.text = api(self.node, self.opt, self.project, self.version_spider_job)
-        _url = url_for('api', node=self.node, opt=self.opt, project=self.project,
-                       version_spider_job=self.version_spider_job)  # '/1/api/listprojects/'
-        self.text = self.get_response_from_view(_url, as_json=False)
-        # _bind = '127.0.0.1' if self.SCRAPYDWEB_BIND == '0.0.0.0' else self.SCRAPYDWEB_BIND
-        # _url = 'http://{}:{}{}'.format(_bind, self.SCRAPYDWEB_PORT, _url)
-        # _auth = (self.USERNAME, self.PASSWORD) if self.ENABLE_AUTH else None
-        # status_code, self.text = self.make_request(_url, auth=_auth, as_json=False)
-        self.js = json.loads(self.text)
+        __, self.js = self.service.api(self.node, self.opt, self.project, self.version_spider_job)
+        self.text = self.json_dumps(self.js, sort_keys=False)
 
         if self.js['status'] == self.OK:
             return getattr(self, self.opt)()
@@ -5,24 +5,31 @@ import io
 import os
 from pprint import pformat
 import re
-from shutil import copyfile, copyfileobj, rmtree
-from subprocess import CalledProcessError
+from shutil import copyfile, copyfileobj
 import tarfile
 import tempfile
 import time
 import zipfile
 
-from flask import flash, redirect, render_template, request, url_for
+from flask import Response, flash, redirect, render_template, request, url_for
+from six.moves.queue import Queue
 from six import text_type
-from six.moves.configparser import Error as ScrapyCfgParseError
 from werkzeug.utils import secure_filename
 
+from ...utils.egg_builder import BUILD_TIMEOUT, BUILDING, egg_builder
+from ...utils.project_index import project_index
 from ...vars import PY2
 from ..baseview import BaseView
-from .scrapyd_deploy import _build_egg, get_config
-from .utils import mkdir_p, slot
+from .utils import EggUploadBody, mkdir_p, slot
 
 
+# Max number of Scrapyd servers being uploaded to at the same time, see DeployMultinodeView
+MAX_DEPLOY_CONCURRENCY = 10
+# Retry N times if the Scrapyd server is unreachable or returns 5xx, waiting 1, 2, 4... seconds in between
+DEPLOY_RETRY_TIMES = 2
+DEPLOY_RETRY_INTERVAL = 1
+RESULT_KEYS = ['node', 'status', 'status_code', 'node_name', 'project', 'version', 'spiders', 'message', 'url',
+               'attempts']
 SCRAPY_CFG = """
 [settings]
 default = projectname.settings
@@ -32,7 +39,6 @@ url = http://localhost:6800/
 project = projectname
 
 """
-folder_project_dict = {}
 
 
 class DeployView(BaseView):
@@ -55,7 +61,6 @@ class DeployView(BaseView):
         self.project_paths = [os.path.dirname(i) for i in self.scrapy_cfg_list]
         self.folders = [os.path.basename(i) for i in self.project_paths]
         self.get_modification_times()
-        self.parse_scrapy_cfg()
 
         kwargs = dict(
             node=self.node,
@@ -68,7 +73,8 @@ class DeployView(BaseView):
             latest_folder=self.latest_folder,
             SCRAPY_PROJECTS_DIR=self.SCRAPY_PROJECTS_DIR.replace('\\', '/'),
             url_servers=url_for('servers', node=self.node, opt='deploy'),
-            url_deploy_upload=url_for('deploy.upload', node=self.node)
+            url_deploy_upload=url_for('deploy.upload', node=self.node),
+            url_deploy_build=url_for('deploy.build', node=self.node)
         )
         return render_template(self.template, **kwargs)
 
@@ -106,7 +112,13 @@ class DeployView(BaseView):
         self.scrapy_cfg_list.sort(key=lambda x: x.lower())
 
     def get_modification_times(self):
-        timestamps = [self.get_modification_time(path) for path in self.project_paths]
+        # Only the projects modified since the last visit would be scanned, see project_index.py
+        results = project_index.get(self.scrapy_cfg_list)
+        for result in results:
+            for msg in result['warnings']:
+                flash(msg, self.WARN)
+        timestamps = [result['timestamp'] for result in results]
+        self.projects = [result['project'] for result in results]
         self.modification_times = [datetime.fromtimestamp(ts).strftime('%Y-%m-%dT%H_%M_%S') for ts in timestamps]
 
         if timestamps:
@@ -114,66 +126,6 @@ class DeployView(BaseView):
             self.latest_folder = self.folders[max_timestamp_index]
             self.logger.debug('latest_folder: %s', self.latest_folder)
 
-    def get_modification_time(self, path, func_walk=os.walk, retry=True):
-        # https://stackoverflow.com/a/29685234/10517783
-        # https://stackoverflow.com/a/13454267/10517783
-        filepath_list = []
-        in_top_dir = True
-        try:
-            for dirpath, dirnames, filenames in func_walk(path):
-                if in_top_dir:
-                    in_top_dir = False
-                    dirnames[:] = [d for d in dirnames if d not in ['build', 'project.egg-info']]
-                    filenames = [f for f in filenames
-                                 if not (f.endswith('.egg') or f in ['setup.py', 'setup_backup.py'])]
-                for filename in filenames:
-                    filepath_list.append(os.path.join(dirpath, filename))
-        except UnicodeDecodeError:
-            msg = "Found illegal filenames in %s" % path
-            self.logger.error(msg)
-            flash(msg, self.WARN)
-            if PY2 and retry:
-                return self.get_modification_time(path, func_walk=self.safe_walk, retry=False)
-            else:
-                raise
-        else:
-            return max([os.path.getmtime(f) for f in filepath_list] or [time.time()])
-
-    def parse_scrapy_cfg(self):
-        for (idx, scrapy_cfg) in enumerate(self.scrapy_cfg_list):
-            folder = self.folders[idx]
-            key = '%s (%s)' % (folder, self.modification_times[idx])
-
-            project = folder_project_dict.get(key, '')
-            if project:
-                self.projects.append(project)
-                self.logger.debug('Hit %s, project %s', key, project)
-                continue
-            else:
-                project = folder
-                try:
-                    # lib/configparser.py: def get(self, section, option, *, raw=False, vars=None, fallback=_UNSET):
-                    # projectname/scrapy.cfg: [deploy] project = demo
-                    # PY2: get() got an unexpected keyword argument 'fallback'
-                    # project = get_config(scrapy_cfg).get('deploy', 'project', fallback=folder) or folder
-                    project = get_config(scrapy_cfg).get('deploy', 'project')
-                except ScrapyCfgParseError as err:
-                    self.logger.error("%s parse error: %s", scrapy_cfg, err)
-                finally:
-                    project = project or folder
-                    self.projects.append(project)
-                    folder_project_dict[key] = project
-                    self.logger.debug('Add %s, project %s', key, project)
-
-        keys_all = list(folder_project_dict.keys())
-        keys_exist = ['%s (%s)' % (_folder, _modification_time)
-                      for (_folder, _modification_time) in zip(self.folders, self.modification_times)]
-        diff = set(keys_all).difference(set(keys_exist))
-        for key in diff:
-            self.logger.debug('Pop %s, project %s', key, folder_project_dict.pop(key))
-        self.logger.debug(self.json_dumps(folder_project_dict))
-        self.logger.debug('folder_project_dict length: %s', len(folder_project_dict))
-
 
 class DeployUploadView(BaseView):
     methods = ['POST']
@@ -198,11 +150,11 @@ class DeployUploadView(BaseView):
         self.scrapy_cfg_not_found = False
         self.scrapy_cfg_parse_error = ''
         self.build_egg_subprocess_error = ''
+        self.build_id = ''
+        self.build_only = False  # See DeployBuildView
         self.data = None
         self.js = {}
 
-        self.slot = slot
-
     def dispatch_request(self, **kwargs):
         self.handle_form()
 
@@ -233,7 +185,8 @@ class DeployUploadView(BaseView):
                                    alert=alert, text=text, tip=tip, message=message)
         else:
             self.prepare_data()
-            status_code, self.js = self.make_request(self.url, data=self.data, auth=self.AUTH)
+            status_code, self.js = self.make_request(self.url, data=self.data, auth=self.AUTH,
+                                                     headers={'Content-Type': self.data.content_type})
 
         if self.js['status'] != self.OK:
             # With multinodes, would try to deploy to the first selected node first
@@ -264,6 +217,8 @@ class DeployUploadView(BaseView):
                     url_projects_list=[url_for('projects', node=n) for n in range(1, self.SCRAPYD_SERVERS_AMOUNT + 1)],
                     url_xhr=url_for('deploy.xhr', node=self.node, eggname=self.eggname,
                                     project=self.project, version=self.version),
+                    url_deploy_multinode=url_for('deploy.multinode', node=self.node, eggname=self.eggname,
+                                                 project=self.project, version=self.version),
                     url_schedule=url_for('schedule', node=self.node, project=self.project,
                                          version=self.version),
                     url_servers=url_for('servers', node=self.node, opt='schedule', project=self.project,
@@ -294,12 +249,23 @@ class DeployUploadView(BaseView):
         self.project = re.sub(self.STRICT_NAME_PATTERN, '_', request.form.get('project', '')) or self.get_now_string()
         self.version = re.sub(self.LEGAL_NAME_PATTERN, '-', request.form.get('version', '')) or self.get_now_string()
 
-        if request.files.get('file'):
+        # The egg has been built in the background, see DeployBuildView
+        build = egg_builder.get(request.form.get('build_id', ''))
+        if build:
+            self.handle_build(build)
+        elif request.files.get('file'):
             self.handle_uploaded_file()
         else:
             self.folder = request.form['folder']  # Used with SCRAPY_PROJECTS_DIR to get project_path
             self.handle_local_project()
 
+    def handle_build(self, build):
+        self.build_id = build['build_id']
+        self.scrapy_cfg_path = build['scrapy_cfg_path']
+        self.eggname = '%s_%s.egg' % (self.project, self.version)
+        self.eggpath = os.path.join(self.DEPLOY_PATH, self.eggname)
+        self.build_egg()
+
     def handle_local_project(self):
         # Use folder instead of project
         project_path = os.path.join(self.SCRAPY_PROJECTS_DIR, self.folder)
@@ -408,33 +374,88 @@ class DeployUploadView(BaseView):
             self.scrapy_cfg_path = ''
 
     def build_egg(self):
-        try:
-            egg, tmpdir = _build_egg(self.scrapy_cfg_path)
-        except ScrapyCfgParseError as err:
-            self.logger.error(err)
-            self.scrapy_cfg_parse_error = err
+        # The egg is built in a process pool, and the egg built from the same content would be reused,
+        # see egg_builder.py and egg_cache.py
+        self.build_id = self.build_id or egg_builder.submit(self.scrapy_cfg_path)
+        if self.build_only:
             return
-        except CalledProcessError as err:
-            self.logger.error(err)
-            self.build_egg_subprocess_error = err
-            return
-
-        scrapy_cfg_dir = os.path.dirname(self.scrapy_cfg_path)
-        copyfile(egg, os.path.join(scrapy_cfg_dir, self.eggname))
-        copyfile(egg, self.eggpath)
-        rmtree(tmpdir)
-        self.logger.debug("Egg file saved to: %s", self.eggpath)
+        build = egg_builder.wait(self.build_id)
+        if build is None:
+            self.build_egg_subprocess_error = "build_id not found: %s" % self.build_id
+        elif build['status'] == BUILDING:
+            self.build_egg_subprocess_error = "Timeout after waiting %s seconds for building the egg" % BUILD_TIMEOUT
+        elif build['error_type'] == 'scrapy_cfg_parse_error':
+            self.scrapy_cfg_parse_error = build['message']
+        elif build['status'] != self.OK:
+            self.build_egg_subprocess_error = build['message']
+        else:
+            copyfile(build['egg'], os.path.join(os.path.dirname(self.scrapy_cfg_path), self.eggname))
+            copyfile(build['egg'], self.eggpath)
+            self.logger.debug("Egg file %s saved to: %s", "from cache" if build['cached'] else "built", self.eggpath)
 
     def prepare_data(self):
-        with io.open(self.eggpath, 'rb') as f:
-            content = f.read()
-            self.data = {
-                'project': self.project,
-                'version': self.version,
-                'egg': content
-            }
+        # The egg would be streamed from disk, see EggUploadBody
+        self.data = EggUploadBody(self.project, self.version, self.eggpath, eggname=self.eggname)
+        # For deploying to the other selected nodes, see DeployMultinodeView
+        slot.add_egg(self.eggname, self.eggpath)
 
-        self.slot.add_egg(self.eggname, content)
+
+class DeployBuildView(DeployUploadView):
+    """Build the egg in the background and return the build_id at once, with the same form as DeployUploadView.
+    Post the form to DeployUploadView along with the build_id afterwards to deploy the egg built.
+    """
+
+    def __init__(self):
+        super(DeployBuildView, self).__init__()
+
+        self.build_only = True
+
+    def dispatch_request(self, **kwargs):
+        self.handle_form()
+        if not self.build_id:
+            if self.scrapy_cfg_not_found:
+                message = "scrapy.cfg not found"
+            else:
+                message = "No need to build the egg for the egg file uploaded"
+            return self.json_dumps(dict(status=self.ERROR, message=message), as_response=True)
+        js = dict(status=self.OK, build_id=self.build_id,
+                  url_build=url_for('deploy.build_status', node=self.node, build_id=self.build_id))
+        return self.json_dumps(js, as_response=True)
+
+
+class DeployBuildStatusView(BaseView):
+    """Return the status of a build, or stream it as Server-Sent Events until it finishes if stream=True."""
+    methods = ['GET']
+
+    def __init__(self):
+        super(DeployBuildStatusView, self).__init__()
+
+        self.build_id = self.view_args['build_id']
+        self.stream = request.args.get('stream', 'False') == 'True'
+
+    def dispatch_request(self, **kwargs):
+        build = egg_builder.get(self.build_id)
+        if not build:
+            message = "build_id not found: %s" % self.build_id
+            return self.json_dumps(dict(status=self.ERROR, message=message), as_response=True)
+        if not self.stream:
+            return self.json_dumps(dict(egg_builder.summarize(build), node=self.node), as_response=True)
+
+        def generate():
+            build_ = build
+            deadline = time.time() + BUILD_TIMEOUT
+            while True:
+                yield 'data: %s\n\n' % self.json_dumps(egg_builder.summarize(build_), sort_keys=False, indent=None)
+                if build_['status'] != BUILDING or time.time() > deadline:
+                    break
+                # Sending the status regularly also keeps the connection alive
+                build_ = egg_builder.wait(self.build_id, timeout=5) or dict(build_, status=self.ERROR,
+                                                                             message="build_id not found")
+            # Otherwise the EventSource would reconnect
+            yield 'event: end\ndata: \n\n'
+
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return Response(generate(), mimetype='text/event-stream', headers=headers)
 
 
 class DeployXhrView(BaseView):
@@ -442,26 +463,90 @@ class DeployXhrView(BaseView):
     def __init__(self):
         super(DeployXhrView, self).__init__()
 
-        self.eggname = self.view_args['eggname']
+        # Not to read any file out of DEPLOY_PATH
+        self.eggname = os.path.basename(self.view_args['eggname'])
         self.project = self.view_args['project']
         self.version = self.view_args['version']
 
         self.url = 'http://{}/{}.json'.format(self.SCRAPYD_SERVER, 'addversion')
 
-        self.slot = slot
-
     def dispatch_request(self, **kwargs):
-        content = self.slot.egg.get(self.eggname)
-        # content = None  # For test only
-        if not content:
-            eggpath = os.path.join(self.DEPLOY_PATH, self.eggname)
-            with io.open(eggpath, 'rb') as f:
-                content = f.read()
-
-        data = {
-            'project': self.project,
-            'version': self.version,
-            'egg': content
-        }
-        status_code, js = self.make_request(self.url, data=data, auth=self.AUTH)
+        eggpath = os.path.join(self.DEPLOY_PATH, self.eggname)
+        if not os.path.isfile(eggpath):
+            message = "The egg file should exist. Got egg file %s" % self.eggname
+            return self.json_dumps(dict(status=self.ERROR, message=message), as_response=True)
+        data = EggUploadBody(self.project, self.version, eggpath, eggname=self.eggname,
+                             content=slot.get_egg(self.eggname))
+        status_code, js = self.make_request(self.url, data=data, auth=self.AUTH,
+                                            headers={'Content-Type': data.content_type})
         return self.json_dumps(js, as_response=True)
+
+
+class DeployMultinodeView(BaseView):
+    """Deploy the egg built by DeployUploadView to the nodes like nodes=2,3 concurrently,
+    with at most MAX_DEPLOY_CONCURRENCY uploads at the same time.
+
+    The egg is streamed from disk for each upload, which would be retried DEPLOY_RETRY_TIMES times
+    if the node is unreachable or returns 5xx. The results of all nodes are returned in one JSON,
+    or streamed one JSON per line if stream=True, along with the progress lines like
+    {"node": 2, "status": "uploading", "attempt": 1}.
+    """
+    methods = ['POST']
+
+    def __init__(self):
+        super(DeployMultinodeView, self).__init__()
+
+        # Not to read any file out of DEPLOY_PATH
+        self.eggname = os.path.basename(self.view_args['eggname'])
+        self.project = self.view_args['project']
+        self.version = self.view_args['version']
+        self.eggpath = os.path.join(self.DEPLOY_PATH, self.eggname)
+
+        nodes = request.args.get('nodes', '')
+        self.nodes = [int(n) for n in nodes.split(',') if n.strip().isdigit()]
+        self.nodes = [n for n in self.nodes if 0 < n <= self.SCRAPYD_SERVERS_AMOUNT]
+        self.stream = request.args.get('stream', 'False') == 'True'
+        self.progress = None  # A Queue for the progress lines if stream=True
+
+    def dispatch_request(self, **kwargs):
+        if not self.nodes or not os.path.isfile(self.eggpath):
+            message = "nodes should be like 2,3 and the egg file should exist. Got nodes %s, egg file %s" % (
+                request.args.get('nodes', ''), self.eggname)
+            return self.json_dumps(dict(status=self.ERROR, message=message), as_response=True)
+
+        if not self.stream:
+            results = [self.get_result(node, result) for (node, result) in self.service.fan_out(
+                self.deploy, self.nodes, ordered=True, concurrency=MAX_DEPLOY_CONCURRENCY)]
+            return self.json_dumps(dict(status=self.OK, results=results), as_response=True)
+
+        self.progress = Queue()
+        lines = self.service.fan_out_lines(self.deploy, self.nodes, self.get_result,
+                                           concurrency=MAX_DEPLOY_CONCURRENCY, queue=self.progress)
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return Response(lines, mimetype='application/x-ndjson', headers=headers)
+
+    def deploy(self, node):
+        url = 'http://{}/{}.json'.format(self.SCRAPYD_SERVERS[node - 1], 'addversion')
+        auth = self.SCRAPYD_SERVERS_AUTHS[node - 1]
+        for attempt in range(1, DEPLOY_RETRY_TIMES + 2):
+            if self.progress is not None:
+                self.progress.put(dict(node=node, status='uploading', attempt=attempt))
+            # A new body for each attempt, since it can be read only once. The content cached in slot
+            # is shared by all the bodies, otherwise the egg would be streamed from disk.
+            data = EggUploadBody(self.project, self.version, self.eggpath, eggname=self.eggname,
+                                 content=slot.get_egg(self.eggname))
+            status_code, js = self.make_request(url, data=data, auth=auth,
+                                                headers={'Content-Type': data.content_type})
+            data.close()
+            js['attempts'] = attempt
+            if not (status_code == -1 or status_code >= 500) or attempt > DEPLOY_RETRY_TIMES:
+                return status_code, js
+            self.logger.warning("Retry deploying to node %s in %s seconds, got status_code %s",
+                                node, DEPLOY_RETRY_INTERVAL * 2 ** (attempt - 1), status_code)
+            time.sleep(DEPLOY_RETRY_INTERVAL * 2 ** (attempt - 1))
+
+    @staticmethod
+    def get_result(node, result):
+        status_code, js = result
+        js = dict(js, node=node)
+        return dict((k, js[k]) for k in RESULT_KEYS if k in js)
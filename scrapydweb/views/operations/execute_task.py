@@ -5,32 +5,29 @@ import re
 import time
 import traceback
 
-from ...common import get_now_string, get_response_from_view, handle_metadata
+from ...common import get_now_string, handle_metadata
 from ...models import Task, TaskResult, TaskJobResult, db
 from ...utils.scheduler import scheduler
+from ...utils.service import ScrapydService
 
 
 apscheduler_logger = logging.getLogger('apscheduler')
 
-REPLACE_URL_NODE_PATTERN = re.compile(r'^/(\d+)/')
 EXTRACT_URL_SERVER_PATTERN = re.compile(r'//(.+?:\d+)')
 
 
 class TaskExecutor(object):
 
-    def __init__(self, task_id, task_name, url_scrapydweb, url_schedule_task, url_delete_task_result,
-                 auth, selected_nodes):
+    def __init__(self, task_id, task_name, url_scrapydweb, selected_nodes, placement=None):
         self.task_id = task_id
         self.task_name = task_name
         self.url_scrapydweb = url_scrapydweb
-        self.url_schedule_task = url_schedule_task
-        self.url_delete_task_result = url_delete_task_result
-        self.auth = auth
-        self.data = dict(
-            task_id=task_id,
-            jobid='task_%s_%s' % (task_id, get_now_string(allow_space=False))
-        )
+        self.jobid = 'task_%s_%s' % (task_id, get_now_string(allow_space=False))
+        # Schedule the task in process instead of requesting the route 'schedule.task' of ScrapydWeb
+        self.service = ScrapydService(db.app.config)
         self.selected_nodes = selected_nodes
+        # Like dict(mode='least_loaded', amount=1), to select from the selected nodes at each run
+        self.placement = placement
         self.task_result_id = None  # Be set in get_task_result_id()
         self.pass_count = 0
         self.fail_count = 0
@@ -41,6 +38,11 @@ class TaskExecutor(object):
 
     def main(self):
         self.get_task_result_id()
+        if self.placement:
+            self.selected_nodes = self.service.select_nodes(self.selected_nodes,
+                                                            amount=self.placement.get('amount', 1))
+            self.logger.info("Run task #%s (%s) on the least-loaded nodes %s",
+                             self.task_id, self.task_name, self.selected_nodes)
         for index, nodes in enumerate([self.selected_nodes, self.nodes_to_retry]):
             if not nodes:
                 continue
@@ -73,19 +75,12 @@ class TaskExecutor(object):
             self.logger.debug("Get new task_result_id %s for task #%s", self.task_result_id, self.task_id)
 
     def schedule_task(self, node):
-        # TODO: Application was not able to create a URL adapter for request independent URL generation.
-        # You might be able to fix this by setting the SERVER_NAME config variable.
-        # with app.app_context():
-        #     url_schedule_task = url_for('schedule.task', node=node)
-        # http://127.0.0.1:5000/1/schedule/task/
-        # /1/schedule/task/
-        url_schedule_task = re.sub(REPLACE_URL_NODE_PATTERN, r'/%s/' % node, self.url_schedule_task)
         js = {}
         try:
-            # assert '/1/' not in url_schedule_task, u"'故意出错'\r\n\"出错\"'故意出错'\r\n\"出错\""
             # assert False
             # time.sleep(10)
-            js = get_response_from_view(url_schedule_task, auth=self.auth, data=self.data, as_json=True)
+            with db.app.app_context():
+                __, js = self.service.schedule_task(node, self.task_id, self.jobid)
             assert js['status_code'] == 200 and js['status'] == 'ok', "Request got %s" % js
         except Exception as err:
             if node not in self.nodes_to_retry:
@@ -128,13 +123,11 @@ class TaskExecutor(object):
             task_result = TaskResult.query.get(self.task_result_id)
             if not task:
                 apscheduler_logger.error("Task #%s not found", self.task_id)
-                # if task_result:
-                # '/1/tasks/xhr/delete/1/1/'
-                url_delete_task_result = re.sub(r'/\d+/\d+/$', '/%s/%s/' % (self.task_id, self.task_result_id),
-                                                self.url_delete_task_result)
-                js = get_response_from_view(url_delete_task_result, auth=self.auth, data=self.data, as_json=True)
-                apscheduler_logger.warning("Deleted task_result #%s [FAIL %s, PASS %s] of task #%s: %s",
-                                           self.task_result_id, self.fail_count, self.pass_count, self.task_id, js)
+                if task_result:
+                    db.session.delete(task_result)
+                    db.session.commit()
+                apscheduler_logger.warning("Deleted task_result #%s [FAIL %s, PASS %s] of task #%s",
+                                           self.task_result_id, self.fail_count, self.pass_count, self.task_id)
                 return
             if not task_result:
                 apscheduler_logger.error("task_result #%s of task #%s not found", self.task_result_id, self.task_id)
@@ -156,16 +149,11 @@ def execute_task(task_id):
             apscheduler_logger.error("apscheduler_job #{id} removed since task #{id} not exist. ".format(id=task_id))
         else:
             metadata = handle_metadata()
-            username = metadata.get('username', '')
-            password = metadata.get('password', '')
-            url_delete_task_result = metadata.get('url_delete_task_result', '/1/tasks/xhr/delete/1/1/')
             task_executor = TaskExecutor(task_id=task_id,
                                          task_name=task.name,
                                          url_scrapydweb=metadata.get('url_scrapydweb', 'http://127.0.0.1:5000'),
-                                         url_schedule_task=metadata.get('url_schedule_task', '/1/schedule/task/'),
-                                         url_delete_task_result=url_delete_task_result,
-                                         auth=(username, password) if username and password else None,
-                                         selected_nodes=json.loads(task.selected_nodes))
+                                         selected_nodes=json.loads(task.selected_nodes),
+                                         placement=json.loads(task.placement or 'null'))
             try:
                 task_executor.main()
             except Exception:
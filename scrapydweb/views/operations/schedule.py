@@ -10,17 +10,29 @@ import pickle
 import re
 import traceback
 
-from flask import Blueprint, redirect, render_template, request, send_file, url_for
+from flask import Blueprint, Response, redirect, render_template, request, send_file, url_for
+from six import string_types
+from six.moves.queue import Queue
 
 from ...models import Task, db
+from ...utils.node_load import ALL, LEAST_LOADED, node_loads
 from ...vars import RUN_SPIDER_HISTORY_LOG, UA_DICT
 from ..baseview import BaseView
 from .execute_task import execute_task
-from .utils import slot
+from .utils import rate_limiter, slot
 
 
 apscheduler_logger = logging.getLogger('apscheduler')
 
+# Max number of the requests to schedule.json at the same time for a batch, see ScheduleBatchView
+MAX_BATCH_CONCURRENCY = 20
+# Max number of the jobs in a batch, before being multiplied by the number of nodes
+MAX_BATCH_JOBS = 1000
+BATCH_RESULT_KEYS = ['index', 'node', 'project', 'version', 'spider', 'jobid', 'status', 'status_code',
+                     'node_name', 'message']
+# Keys of the data for schedule.json, which can not be passed as arguments of the spider
+RESERVED_KEYS = ['project', '_version', 'spider', 'jobid', 'setting']
+
 
 def generate_cmd(auth, url, data):
     if auth:
@@ -98,6 +110,9 @@ class ScheduleView(BaseView):
 
         self.selected_nodes = json.loads(task.selected_nodes)
         self.first_selected_node = self.selected_nodes[0]
+        placement = json.loads(task.placement or '{}')
+        self.kwargs['placement'] = placement.get('mode', ALL)
+        self.kwargs['placement_amount'] = placement.get('amount', 1)
 
         # 'settings_arguments': {'arg1': '233', 'setting': ['CLOSESPIDER_PAGECOUNT=10',]}
         settings_arguments = json.loads(task.settings_arguments)
@@ -170,6 +185,8 @@ class ScheduleView(BaseView):
                                     version_spider_job='VERSION_PLACEHOLDER'),
             url_schedule_check=url_for('schedule.check', node=self.node)
         ))
+        self.kwargs.setdefault('placement', ALL)
+        self.kwargs.setdefault('placement_amount', 1)
         self.kwargs.setdefault('expand_settings_arguments', self.SCHEDULE_EXPAND_SETTINGS_ARGUMENTS)
         self.kwargs.setdefault('jobid', '')
         # self.kwargs.setdefault('UA_DICT', UA_DICT)
@@ -225,6 +242,8 @@ class ScheduleCheckView(BaseView):
         self.logger.debug('request.form from %s\n%s', request.url, self.json_dumps(request.form))
         self.prepare_data()
         self.update_data_for_timer_task()
+        # Cached as bytes, so added after self.data is complete, see Slot
+        self.slot.add_data(self.filename, self.data)
         # self.logger.warning(self.json_dumps(self.data))  # TypeError: Object of type datetime is not JSON serializable
         cmd = generate_cmd(self.AUTH, self.url, self.data)
         # '-d' may be in project name, like 'ScrapydWeb-demo'
@@ -278,8 +297,6 @@ class ScheduleCheckView(BaseView):
         with io.open(filepath, 'wb') as f:
             f.write(pickle.dumps(self.data))
 
-        self.slot.add_data(self.filename, self.data)
-
     def get_int_from_form(self, key, default, minimum):
         value = request.form.get(key) or default
         try:
@@ -340,6 +357,7 @@ class ScheduleRunView(BaseView):
         self.selected_nodes_amount = 0
         self.selected_nodes = []
         self.first_selected_node = 0
+        self.placement = None  # dict(mode='least_loaded', amount=1), see utils/node_load.py
         self.filename = request.form['filename']
         self.data = {}
         self.task_data = {}
@@ -368,12 +386,15 @@ class ScheduleRunView(BaseView):
             self.url = 'http://%s/schedule.json' % self.SCRAPYD_SERVERS[self.first_selected_node - 1]
             # Note that self.first_selected_node != self.node
             self.AUTH = self.SCRAPYD_SERVERS_AUTHS[self.first_selected_node - 1]
+            if request.form.get('placement') == LEAST_LOADED:
+                amount = request.form.get('placement_amount', default=1, type=int) or 1
+                self.placement = dict(mode=LEAST_LOADED, amount=max(1, amount))
         else:
             self.selected_nodes = [self.node]
             self.url = 'http://%s/schedule.json' % self.SCRAPYD_SERVER
 
         # in handle_action():   self.data.pop('__task_data', {})    self.task_data.pop
-        self.data = self.slot.data.get(self.filename, {})
+        self.data = self.slot.get_data(self.filename)
         # self.data = None  # For test only
         if not self.data:
             filepath = os.path.join(self.SCHEDULE_PATH, self.filename)
@@ -392,8 +413,18 @@ class ScheduleRunView(BaseView):
             self.add_update_task()
         else:
             self._action = 'run'
+            if self.placement:
+                self.select_least_loaded_nodes()
             status_code, self.js = self.make_request(self.url, data=self.data, auth=self.AUTH)
 
+    def select_least_loaded_nodes(self):
+        # The selected nodes are the candidates, which would be selected again at each run for a timer task
+        self.selected_nodes = self.service.select_nodes(self.selected_nodes, amount=self.placement['amount'])
+        self.selected_nodes_amount = len(self.selected_nodes)
+        self.first_selected_node = self.selected_nodes[0]
+        self.url = 'http://%s/schedule.json' % self.SCRAPYD_SERVERS[self.first_selected_node - 1]
+        self.AUTH = self.SCRAPYD_SERVERS_AUTHS[self.first_selected_node - 1]
+
     # https://apscheduler.readthedocs.io/en/latest/userguide.html
     # https://apscheduler.readthedocs.io/en/latest/modules/triggers/cron.html#module-apscheduler.triggers.cron
     def db_insert_update_task(self):
@@ -422,6 +453,7 @@ class ScheduleRunView(BaseView):
         self.task.jobid = data.pop('jobid')
         self.task.settings_arguments = self.json_dumps(data, sort_keys=True, indent=None)
         self.task.selected_nodes = str(self.selected_nodes)
+        self.task.placement = self.json_dumps(self.placement, sort_keys=True, indent=None) if self.placement else None
 
         self.task.name = self.task_data['name']
         self.task.trigger = self.task_data['trigger']
@@ -603,7 +635,7 @@ class ScheduleXhrView(BaseView):
         self.data = None
 
     def dispatch_request(self, **kwargs):
-        self.data = self.slot.data.get(self.filename)
+        self.data = self.slot.get_data(self.filename)
         # self.data = None  # For test only
         if not self.data:
             filepath = os.path.join(self.SCHEDULE_PATH, self.filename)
@@ -619,24 +651,182 @@ class ScheduleTaskView(BaseView):
     def __init__(self):
         super(ScheduleTaskView, self).__init__()
 
-        self.url = 'http://%s/schedule.json' % self.SCRAPYD_SERVER
         self.task_id = request.form['task_id']
         self.jobid = request.form['jobid']
-        self.data = {}
 
     def dispatch_request(self, **kwargs):
-        task = Task.query.get(self.task_id)
-        if not task:
-            message = "Task #%s not found" % self.task_id
-            self.logger.error(message)
-            js = dict(url=self.url, auth=self.AUTH, status_code=-1, status=self.ERROR, message=message)
-        else:
-            self.data['project'] = task.project
-            if task.version != self.DEFAULT_LATEST_VERSION:
-                self.data['_version'] = task.version
-            self.data['spider'] = task.spider
-            self.data['jobid'] = self.jobid
-            self.data.update(json.loads(task.settings_arguments))
-            status_code, js = self.make_request(self.url, data=self.data, auth=self.AUTH)
-
+        # Timer tasks call ScrapydService.schedule_task() directly, see execute_task.py
+        status_code, js = self.service.schedule_task(self.node, self.task_id, self.jobid)
         return self.json_dumps(js, as_response=True)
+
+
+class ScheduleBatchView(BaseView):
+    """Run many spiders on many nodes in one request, by POSTing a JSON like
+    {"jobs": [{"project": "demo", "version": "", "spider": "test", "args": {"arg1": "val1"},
+               "settings": {"CLOSESPIDER_TIMEOUT": 60}}, ...],
+     "nodes": [1, 2]}
+    with "group": "group1" instead of "nodes" to run on the nodes of a group, or neither on the current node.
+    "version", "jobid", "args" and "settings" are optional, and "settings" can also be a list like ["K=V"].
+
+    Every job is scheduled on every node, or only on the least-loaded N of the nodes with
+    "placement": "least_loaded" and "amount": N (defaults to 1), see ScrapydService.select_nodes().
+    There would be at most MAX_BATCH_CONCURRENCY requests at the same time,
+    and the requests to the same Scrapyd server are spaced out according to SCHEDULE_RATE_LIMIT.
+    The results are returned in one JSON as a table with a row per job per node, in the order of the jobs,
+    or streamed one JSON per line as soon as each request returns if stream=True.
+    """
+    methods = ['POST']
+
+    def __init__(self):
+        super(ScheduleBatchView, self).__init__()
+
+        self.js = request.get_json(silent=True) or {}
+        self.entries = self.js.get('jobs') if isinstance(self.js, dict) else None
+        self.nodes = []
+        self.placement = self.js.get('placement', ALL) if isinstance(self.js, dict) else ALL
+        self.amount = self.js.get('amount', 1) if isinstance(self.js, dict) else 1
+        self.stream = request.args.get('stream', 'False') == 'True'
+        self.rows = []  # The rows of the invalid jobs, which would not be scheduled
+        self.jobs = []  # [dict(index=0, node=1, ..., data=dict)]
+
+    def dispatch_request(self, **kwargs):
+        message = self.get_nodes()
+        if not message:
+            if not isinstance(self.entries, list) or not self.entries:
+                message = "'jobs' should be a non-empty list in the JSON of the request body"
+            elif len(self.entries) > MAX_BATCH_JOBS:
+                message = "At most %s jobs in a batch, got %s" % (MAX_BATCH_JOBS, len(self.entries))
+            elif self.placement not in [ALL, LEAST_LOADED]:
+                message = "'placement' should be '%s' or '%s', got %s" % (ALL, LEAST_LOADED, self.placement)
+            elif not isinstance(self.amount, int) or isinstance(self.amount, bool) or self.amount < 1:
+                message = "'amount' should be a positive integer, got %s" % self.amount
+        if message:
+            return self.json_dumps(dict(status=self.ERROR, message=message), as_response=True)
+        self.prepare_jobs()
+
+        if not self.stream:
+            rows = self.rows + [self.get_result(index, result) for (index, result) in self.service.fan_out(
+                self.schedule, list(range(len(self.jobs))), ordered=True, concurrency=MAX_BATCH_CONCURRENCY)]
+            rows.sort(key=lambda row: (row['index'], row['node']))
+            succeeded = len([row for row in rows if row['status'] == self.OK])
+            return self.json_dumps(dict(status=self.OK, total=len(rows), succeeded=succeeded,
+                                        failed=len(rows) - succeeded, results=rows),
+                                   sort_keys=False, as_response=True)
+
+        rows = Queue()
+        for row in self.rows:  # The invalid jobs first
+            rows.put(row)
+        lines = self.service.fan_out_lines(self.schedule, list(range(len(self.jobs))), self.get_result,
+                                           concurrency=MAX_BATCH_CONCURRENCY, queue=rows)
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return Response(lines, mimetype='application/x-ndjson', headers=headers)
+
+    def get_nodes(self):
+        """Set up self.nodes, and return an error message if there is no valid node."""
+        group = self.js.get('group') if isinstance(self.js, dict) else None
+        nodes = self.js.get('nodes') if isinstance(self.js, dict) else None
+        if group:
+            self.nodes = [n for n in range(1, self.SCRAPYD_SERVERS_AMOUNT + 1)
+                          if self.SCRAPYD_SERVERS_GROUPS[n - 1] == group]
+            return '' if self.nodes else "No node found in group %s" % group
+        if not nodes:
+            self.nodes = [self.node]
+            return ''
+        if isinstance(nodes, string_types):
+            nodes = nodes.split(',')
+        elif not isinstance(nodes, list):
+            nodes = [nodes]
+        self.nodes = [int(n) for n in nodes if str(n).strip().isdigit()]
+        self.nodes = [n for n in self.nodes if 0 < n <= self.SCRAPYD_SERVERS_AMOUNT]
+        if not self.nodes:
+            return "'nodes' should be like [1, 2] or '1,2', between 1 and %s. Got %s" % (
+                self.SCRAPYD_SERVERS_AMOUNT, nodes)
+        return ''
+
+    def prepare_jobs(self):
+        jobids = {}  # {(project, spider, jobid): count}, to avoid running the same spider with the same jobid
+        for index, entry in enumerate(self.entries):
+            try:
+                data = self.get_data(entry)
+            except (TypeError, ValueError) as err:
+                entry = entry if isinstance(entry, dict) else {}
+                # The invalid jobs are not placed on any node with the placement 'least_loaded'
+                for node in (self.nodes if self.placement == ALL else [0]):
+                    job = dict(index=index, node=node, project=entry.get('project', ''),
+                               version=entry.get('version') or self.DEFAULT_LATEST_VERSION,
+                               spider=entry.get('spider', ''), jobid=entry.get('jobid', ''))
+                    self.rows.append(self.make_row(job, dict(status=self.ERROR, status_code=0, message=str(err))))
+                continue
+            key = (data['project'], data['spider'], data['jobid'])
+            jobids[key] = jobids.get(key, 0) + 1
+            if jobids[key] > 1:
+                data['jobid'] = '%s_%s' % (data['jobid'], jobids[key])
+            if self.placement == LEAST_LOADED:
+                # Counted as unsent until sent in schedule(), so that the refreshes of the loads
+                # in the meantime would not drop the placements of the jobs waiting in the batch
+                nodes = self.service.select_nodes(self.nodes, amount=self.amount, unsent=True)
+            else:
+                nodes = self.nodes
+            for node in nodes:
+                self.jobs.append(dict(index=index, node=node, project=data['project'],
+                                      version=data.get('_version', self.DEFAULT_LATEST_VERSION),
+                                      spider=data['spider'], jobid=data['jobid'], data=data,
+                                      unsent=self.placement == LEAST_LOADED))
+
+    def get_data(self, entry):
+        """Return the data for schedule.json, in the same format as ScheduleCheckView.prepare_data()."""
+        if not isinstance(entry, dict):
+            raise TypeError("Each job should be a dict like {'project': 'demo', 'spider': 'test'}")
+        data = OrderedDict()
+        for key in ['project', 'spider']:
+            if not entry.get(key) or not isinstance(entry[key], string_types):
+                raise ValueError("'%s' should be a non-empty string" % key)
+            data[key] = entry[key]
+        version = entry.get('version') or self.DEFAULT_LATEST_VERSION
+        if version != self.DEFAULT_LATEST_VERSION:
+            data['_version'] = str(version)
+        jobid = str(entry.get('jobid') or self.get_now_string())
+        data['jobid'] = re.sub(self.LEGAL_NAME_PATTERN, '-', jobid)
+
+        settings = entry.get('settings') or {}
+        if isinstance(settings, dict):
+            data['setting'] = ['%s=%s' % (k, v) for (k, v) in settings.items()]
+        elif isinstance(settings, list) and all(isinstance(i, string_types) and '=' in i for i in settings):
+            data['setting'] = list(settings)
+        else:
+            raise ValueError("'settings' should be a dict, or a list like ['CLOSESPIDER_TIMEOUT=60']")
+        data['setting'].sort()
+
+        args = entry.get('args') or {}
+        if not isinstance(args, dict):
+            raise ValueError("'args' should be a dict like {'arg1': 'val1'}")
+        for (k, v) in args.items():
+            if k in RESERVED_KEYS:
+                raise ValueError("'%s' can not be passed in 'args'" % k)
+            # Only strings would be passed to the spider, so convert the numbers explicitly
+            # and reject the others, e.g. a list would be sent as multiple values of the same key
+            if isinstance(v, bool) or not isinstance(v, string_types + (int, float)):
+                raise ValueError("The value of '%s' in 'args' should be a string or a number, got %s" % (k, repr(v)))
+            data[k] = v if isinstance(v, string_types) else str(v)
+        return data
+
+    def schedule(self, index):
+        job = self.jobs[index]
+        server = self.SCRAPYD_SERVERS[job['node'] - 1]
+        try:
+            rate_limiter.wait(server)
+            return self.make_request('http://%s/schedule.json' % server, data=job['data'],
+                                     auth=self.SCRAPYD_SERVERS_AUTHS[job['node'] - 1])
+        finally:
+            if job['unsent']:
+                node_loads.sent(server)
+
+    def get_result(self, index, result):
+        status_code, js = result
+        return self.make_row(self.jobs[index], dict(js, status_code=status_code))
+
+    @staticmethod
+    def make_row(job, js):
+        js = dict(js)
+        js.update((k, job[k]) for k in ['index', 'node', 'project', 'version', 'spider', 'jobid'])
+        return OrderedDict((k, js.get(k, '')) for k in BATCH_RESULT_KEYS)
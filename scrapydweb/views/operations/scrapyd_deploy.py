@@ -5,16 +5,20 @@ scrapyd-client/scrapyd_client/deploy.py
 """
 import errno
 import glob
+import logging
 import os
 from shutil import copyfile
 from subprocess import check_call
 import sys
 import tempfile
 
-from flask import current_app as app
 from six.moves.configparser import SafeConfigParser
 
 
+# Not to use the logger of the app, since _build_egg() is run in the process pool of EggBuilder
+logger = logging.getLogger(__name__)
+
+
 _SETUP_PY_TEMPLATE = """# Automatically created by: scrapydweb x scrapyd-client
 
 from setuptools import setup, find_packages
@@ -81,6 +85,6 @@ def _build_egg(scrapy_cfg_path):
 def _create_default_setup_py(**kwargs):
     with open('setup.py', 'w') as f:
         content = _SETUP_PY_TEMPLATE % kwargs
-        app.logger.debug('New setup.py')
+        logger.debug('New setup.py')
         # app.logger.debug(content)
         f.write(content)
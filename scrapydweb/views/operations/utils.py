@@ -1,38 +1,204 @@
 # coding: utf-8
 from collections import OrderedDict
 import errno
+import io
 import os
+import pickle
+import threading
+import time
+import uuid
 
 
-class Slot:
-    def __init__(self, limit_egg=10, limit_data=10):
-        self.limit_egg = limit_egg
-        self.limit_data = limit_data
-        self._egg = OrderedDict()
-        self._data = OrderedDict()
+class Slot(object):
+    """Cache the eggs and the schedule data for the requests to the other selected nodes, in a least recently used
+    manner, bounded by `max_bytes` in total instead of by the number of items.
 
-    @property
-    def egg(self):
-        return self._egg
+    A value larger than `max_item_bytes` is never loaded into memory. Instead, it is only marked as on disk,
+    and the caller reads it from its own file, e.g. the egg in DEPLOY_PATH is streamed to Scrapyd
+    via EggUploadBody. The hits, disk hits, misses and evictions are counted, see stats().
+    """
+    KINDS = ['egg', 'data']
+    # Max number of the keys marked as on disk per kind
+    LIMIT_ON_DISK = 1000
 
-    @property
-    def data(self):
-        return self._data
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_bytes // 4
+        self.total_bytes = 0
+        self.cache = OrderedDict()  # {(kind, key): bytes}, shared by all kinds for the byte budget
+        self.on_disk = dict((kind, OrderedDict()) for kind in self.KINDS)  # {kind: {key: size}}
+        self.counters = dict((kind, dict(hits=0, disk_hits=0, misses=0, evictions=0)) for kind in self.KINDS)
 
-    def add_egg(self, key, value):
-        self._egg[key] = value
-        if len(self._egg) > self.limit_egg:
-            self._egg.popitem(last=False)
+    def configure(self, max_bytes=64 * 1024 * 1024):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self.max_item_bytes = max_bytes // 4
+            self.evict()
+
+    def add(self, kind, key, value, size=None):
+        """Add a value in bytes, or mark the key as on disk if the value is None or too large."""
+        size = len(value) if size is None else size
+        with self.lock:
+            on_disk = self.on_disk[kind]
+            if (kind, key) in self.cache:
+                self.total_bytes -= len(self.cache.pop((kind, key)))
+            on_disk.pop(key, None)
+            if value is None or size > self.max_item_bytes:
+                on_disk[key] = size
+                if len(on_disk) > self.LIMIT_ON_DISK:
+                    on_disk.popitem(last=False)
+            else:
+                self.cache[(kind, key)] = value
+                self.total_bytes += size
+                self.evict()
+
+    def get(self, kind, key):
+        """Return the value in bytes, or None if it is on disk or not cached."""
+        with self.lock:
+            counters = self.counters[kind]
+            value = self.cache.pop((kind, key), None)
+            if value is not None:
+                self.cache[(kind, key)] = value  # Move to the end as the most recently used
+                counters['hits'] += 1
+            elif key in self.on_disk[kind]:
+                counters['disk_hits'] += 1
+            else:
+                counters['misses'] += 1
+            return value
+
+    def evict(self):
+        # Called with the lock acquired
+        while self.total_bytes > self.max_bytes:
+            (kind, __), value = self.cache.popitem(last=False)
+            self.total_bytes -= len(value)
+            self.counters[kind]['evictions'] += 1
+
+    def add_egg(self, key, eggpath):
+        size = os.path.getsize(eggpath)
+        if size > self.max_item_bytes:
+            self.add('egg', key, None, size=size)
+        else:
+            with io.open(eggpath, 'rb') as f:
+                self.add('egg', key, f.read())
+
+    def get_egg(self, key):
+        return self.get('egg', key)
 
     def add_data(self, key, value):
-        self._data[key] = value
-        if len(self._data) > self.limit_data:
-            self._data.popitem(last=False)
+        self.add('data', key, pickle.dumps(value))
+
+    def get_data(self, key):
+        # A new object is returned each time, so that modifying it would not affect the cache
+        value = self.get('data', key)
+        return pickle.loads(value) if value is not None else None
+
+    def stats(self):
+        with self.lock:
+            js = dict(max_bytes=self.max_bytes, bytes=self.total_bytes)
+            for kind in self.KINDS:
+                values = [v for ((k, __), v) in self.cache.items() if k == kind]
+                js[kind] = dict(self.counters[kind], items=len(values), bytes=sum(len(v) for v in values),
+                                items_on_disk=len(self.on_disk[kind]))
+            return js
 
 
 slot = Slot()
 
 
+class EggUploadBody(object):
+    """The multipart/form-data body of addversion.json, with the egg file streamed from disk chunk by chunk,
+    so that the egg would not be loaded into memory, no matter how many nodes it is deployed to.
+    Pass in the content of the egg cached in slot instead, if any, see Slot.get_egg().
+
+    Pass it as data along with the Content-Type header, e.g.
+    body = EggUploadBody(project, version, eggpath)
+    make_request(url, data=body, headers={'Content-Type': body.content_type})
+    Note that a body can be read only once, create a new one for each request.
+    """
+
+    def __init__(self, project, version, eggpath, eggname='project.egg', content=None):
+        self.project = project
+        self.version = version
+        self.eggpath = eggpath
+        self.egg_size = os.path.getsize(eggpath) if content is None else len(content)
+        boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary=%s' % boundary
+        lines = []
+        for name, value in [('project', project), ('version', version)]:
+            lines.extend(['--' + boundary, 'Content-Disposition: form-data; name="%s"' % name, '', value])
+        lines.extend(['--' + boundary,
+                      'Content-Disposition: form-data; name="egg"; filename="%s"' % eggname,
+                      'Content-Type: application/octet-stream', '', ''])
+        head = '\r\n'.join(lines).encode('utf-8')
+        tail = ('\r\n--%s--\r\n' % boundary).encode('utf-8')
+        self.length = len(head) + self.egg_size + len(tail)
+        # The egg file is opened on first read
+        self.parts = [io.BytesIO(head), None if content is None else io.BytesIO(content), io.BytesIO(tail)]
+        self.index = 0
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        chunks = []
+        while self.index < len(self.parts) and (size < 0 or size > 0):
+            if self.parts[self.index] is None:
+                self.parts[self.index] = io.open(self.eggpath, 'rb')
+            chunk = self.parts[self.index].read(size)
+            if not chunk or size < 0:
+                self.parts[self.index].close()
+                self.index += 1
+            if chunk:
+                chunks.append(chunk)
+                if size > 0:
+                    size -= len(chunk)
+        return b''.join(chunks)
+
+    def close(self):
+        for part in self.parts:
+            if part is not None:
+                part.close()
+
+
+class RateLimiter(object):
+    """Space out the requests to each Scrapyd server by at least 1 / `rate` seconds, shared by all the callers,
+    so that the concurrent batches would not flood the same Scrapyd server. Set rate to 0 for no limit.
+    """
+
+    def __init__(self, rate=5):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.next_times = {}  # {'127.0.0.1:6800': timestamp}, when the next request is allowed
+
+    def configure(self, rate=5):
+        with self.lock:
+            self.rate = rate
+            self.next_times.clear()
+
+    def wait(self, scrapyd_server):
+        """Block until a request to the Scrapyd server is allowed, and return the seconds waited.
+        The time slot is reserved only when the request is about to be sent, so that a caller which gives up
+        while waiting would not hold a slot, and the waiting callers would just retry after the delay.
+        """
+        waited = 0
+        while True:
+            with self.lock:
+                if self.rate <= 0:
+                    return waited
+                now = time.time()
+                next_time = self.next_times.get(scrapyd_server, 0)
+                if now >= next_time:
+                    self.next_times[scrapyd_server] = now + 1.0 / self.rate
+                    return waited
+                delay = next_time - now
+            time.sleep(delay)
+            waited += delay
+
+
+rate_limiter = RateLimiter()
+
+
 # https://stackoverflow.com/a/600612/10517783
 def mkdir_p(path):
     try:
@@ -1,9 +1,13 @@
 # coding: utf-8
-from flask import render_template, url_for
+from flask import Response, render_template, request, url_for
 
 from ..baseview import BaseView
 
 
+OPTS = ['stop', 'delversion', 'delproject']
+RESULT_KEYS = ['node', 'status', 'status_code', 'node_name', 'prevstate', 'message', 'tip', 'url']
+
+
 class MultinodeView(BaseView):
     methods = ['POST']
 
@@ -42,8 +46,55 @@ class MultinodeView(BaseView):
             version_job=self.version_job,
             selected_nodes=selected_nodes,
             url_xhr=url_xhr,
+            url_multinode_xhr=url_for('multinode.xhr', node=self.node, opt=self.opt, project=self.project,
+                                      version_job=self.version_job),
             url_servers=url_servers,
             btn_servers=btn_servers,
             url_projects_list=[url_for('projects', node=n) for n in range(1, self.SCRAPYD_SERVERS_AMOUNT + 1)]
         )
         return render_template(self.template, **kwargs)
+
+
+class MultinodeXhrView(BaseView):
+    """Execute stop, delversion or delproject on the nodes like nodes=1,3 concurrently, see fan_out() in service.py.
+
+    The results of all nodes are returned in one JSON, or streamed one JSON per line
+    in the order of completion if stream=True.
+    """
+    methods = ['POST']
+
+    def __init__(self):
+        super(MultinodeXhrView, self).__init__()
+
+        self.opt = self.view_args['opt']
+        self.project = self.view_args['project']
+        self.version_job = self.view_args['version_job']
+
+        nodes = request.args.get('nodes', '')
+        self.nodes = [int(n) for n in nodes.split(',') if n.strip().isdigit()]
+        self.nodes = [n for n in self.nodes if 0 < n <= self.SCRAPYD_SERVERS_AMOUNT]
+        self.stream = request.args.get('stream', 'False') == 'True'
+        # Resolved in the main thread, since the app context is not available in the pool threads
+        self.api = self.service.api
+
+    def dispatch_request(self, **kwargs):
+        if self.opt not in OPTS or not self.nodes:
+            message = "opt should be one of %s, and nodes should be like 1,3. Got opt %s, nodes %s" % (
+                OPTS, self.opt, request.args.get('nodes', ''))
+            return self.json_dumps(dict(status=self.ERROR, message=message), as_response=True)
+
+        args = (self.opt, self.project, self.version_job)
+        if not self.stream:
+            results = [self.get_result(node, result) for (node, result)
+                       in self.service.fan_out(self.api, self.nodes, args=args, ordered=True)]
+            return self.json_dumps(dict(status=self.OK, results=results), as_response=True)
+
+        lines = self.service.fan_out_lines(self.api, self.nodes, self.get_result, args=args)
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return Response(lines, mimetype='application/x-ndjson', headers=headers)
+
+    @staticmethod
+    def get_result(node, result):
+        status_code, js = result
+        js = dict(js, node=node)
+        return dict((k, js[k]) for k in RESULT_KEYS if k in js)
@@ -1,15 +1,30 @@
 # coding: utf-8
-from flask import flash, render_template, url_for
+from flask import Response, flash, render_template, request, url_for
 
-from ...common import handle_metadata
+from ...common import increase_metadata, session
+from ...utils.jobs_listing import SingleFlightCache
 from ..baseview import BaseView
 
 
-metadata = dict(pageview=handle_metadata().get('pageview', 1))
+# The daemonstatus of a Scrapyd server is cached for N seconds and shared by all the browser tabs
+DAEMONSTATUS_CACHE_TTL = 3
+DAEMONSTATUS_KEYS = ['node_name', 'pending', 'running', 'finished']
+
+
+class DaemonStatusCache(SingleFlightCache):
+    """Cache of the daemonstatus shared by all the browser tabs, see SingleFlightCache in jobs_listing.py."""
+
+    def __init__(self, ttl=DAEMONSTATUS_CACHE_TTL):
+        super(DaemonStatusCache, self).__init__(ttl=ttl)
+
+    def get_failed(self, scrapyd_server):
+        raise RuntimeError("Fail to get the daemonstatus of %s" % scrapyd_server)
+
+
+daemonstatus_cache = DaemonStatusCache()
 
 
 class ServersView(BaseView):
-    metadata = metadata
 
     def __init__(self):
         super(ServersView, self).__init__()
@@ -24,10 +39,10 @@ class ServersView(BaseView):
         self.selected_nodes = []
 
     def dispatch_request(self, **kwargs):
-        self.metadata['pageview'] += 1
-        self.logger.debug('metadata: %s', self.metadata)
+        self.pageview = increase_metadata('pageview')
+        self.logger.debug('pageview: %s', self.pageview)
 
-        if self.SCRAPYD_SERVERS_AMOUNT > 1 and not (self.metadata['pageview'] > 2 and self.metadata['pageview'] % 100):
+        if self.SCRAPYD_SERVERS_AMOUNT > 1 and not (self.pageview > 2 and self.pageview % 100):
             if not self.ENABLE_AUTH:
                 flash("Set 'ENABLE_AUTH = True' to enable basic auth for web UI", self.INFO)
             if self.IS_LOCAL_SCRAPYD_SERVER and not self.ENABLE_LOGPARSER:
@@ -51,11 +66,13 @@ class ServersView(BaseView):
             spider=self.spider,
             url=self.url,
             selected_nodes=self.selected_nodes,
+            node_health=session.get_health_report(self.SCRAPYD_SERVERS),
             IS_IE_EDGE=self.IS_IE_EDGE,
-            pageview=self.metadata['pageview'],
+            pageview=self.pageview,
             FEATURES=self.FEATURES,
             DEFAULT_LATEST_VERSION=self.DEFAULT_LATEST_VERSION,
             url_daemonstatus=url_for('api', node=self.node, opt='daemonstatus'),
+            url_servers_daemonstatus=url_for('servers.daemonstatus', node=self.node),
             url_getreports=url_for('clusterreports', node=self.node, project='PROJECT_PLACEHOLDER',
                                    spider='SPIDER_PLACEHOLDER', job='JOB_PLACEHOLDER'),
             url_liststats=url_for('api', node=self.node, opt='liststats', project='PROJECT_PLACEHOLDER',
@@ -75,3 +92,57 @@ class ServersView(BaseView):
             url_delproject=url_for('multinode', node=self.node, opt='delproject', project='PROJECT_PLACEHOLDER')
         )
         return render_template(self.template, **kwargs)
+
+
+class ServersDaemonStatusView(BaseView):
+    """Return the daemonstatus of all Scrapyd servers, or the ones specified like nodes=1,3,
+    in one compact JSON array, or as Server-Sent Events in the order of arrival if stream=True.
+
+    The Scrapyd servers are requested concurrently with the timeout of daemonstatus,
+    see SCRAPYD_REQUEST_TIMEOUTS, and the results are cached for DAEMONSTATUS_CACHE_TTL seconds.
+    """
+    methods = ['GET', 'POST']
+
+    def __init__(self):
+        super(ServersDaemonStatusView, self).__init__()
+
+        nodes = request.args.get('nodes', '')
+        self.nodes = [int(n) for n in nodes.split(',') if n.strip().isdigit()] if nodes else []
+        self.nodes = ([n for n in self.nodes if 0 < n <= self.SCRAPYD_SERVERS_AMOUNT]
+                      or list(range(1, self.SCRAPYD_SERVERS_AMOUNT + 1)))
+        self.stream = request.args.get('stream', 'False') == 'True'
+        # Resolved in the main thread, since the app context is not available in the pool threads
+        self.api = self.service.api
+
+    def dispatch_request(self, **kwargs):
+        if not self.stream:
+            results = [self.get_result(node, result) for (node, result) in
+                       self.service.fan_out(self.get_daemonstatus, self.nodes, ordered=True)]
+            return self.json_dumps(results, sort_keys=False, indent=None, as_response=True)
+
+        def generate():
+            for (node, result) in self.service.fan_out(self.get_daemonstatus, self.nodes):
+                yield 'data: %s\n\n' % self.json_dumps(self.get_result(node, result), sort_keys=False, indent=None)
+            # Otherwise the EventSource would reconnect
+            yield 'event: end\ndata: \n\n'
+
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return Response(generate(), mimetype='text/event-stream', headers=headers)
+
+    def get_daemonstatus(self, node):
+        def fetch():
+            __, js = self.api(node, 'daemonstatus')
+            result = dict(status=js.get('status', self.ERROR))
+            if result['status'] == self.OK:
+                result.update((k, js.get(k)) for k in DAEMONSTATUS_KEYS)
+            else:
+                result['status_code'] = js.get('status_code')
+            result['health'] = js.get('health')
+            return result
+
+        return 200, daemonstatus_cache.get(self.SCRAPYD_SERVERS[node - 1], fetch)
+
+    @staticmethod
+    def get_result(node, result):
+        status_code, js = result
+        return dict(js, node=node)
@@ -388,6 +388,7 @@ class TasksXhrView(BaseView):
         self.js['data'] = dict((k, v) for k, v in vars(self.task).items() if not k.startswith('_'))
         self.js['data']['settings_arguments'] = json.loads(self.js['data']['settings_arguments'])
         self.js['data']['selected_nodes'] = json.loads(self.js['data']['selected_nodes'])
+        self.js['data']['placement'] = json.loads(self.js['data'].get('placement') or 'null')
         self.js['data']['create_time'] = str(self.js['data']['create_time'])
         self.js['data']['update_time'] = str(self.js['data']['update_time'])
         if not self.apscheduler_job:
@@ -6,8 +6,10 @@ from flask import render_template
 from logparser import SETTINGS_PY_PATH as LOGPARSER_SETTINGS_PY_PATH
 
 from ...common import json_dumps
+from ...utils.node_load import node_loads
 from ...vars import SCHEDULER_STATE_DICT
 from ..baseview import BaseView
+from ..operations.utils import slot
 
 
 class SettingsView(BaseView):
@@ -69,6 +71,15 @@ class SettingsView(BaseView):
 
         # Scrapy
         self.kwargs['SCRAPY_PROJECTS_DIR'] = self.handle_slash(self.SCRAPY_PROJECTS_DIR) or "''"
+        self.kwargs['egg_build_details'] = self.json_dumps(dict(
+            EGG_CACHE_SIZE=self.EGG_CACHE_SIZE,
+            EGG_CACHE_MAX_AGE=self.EGG_CACHE_MAX_AGE,
+            EGG_BUILD_PROCESSES=self.EGG_BUILD_PROCESSES
+        ))
+        self.kwargs['memory_cache_details'] = self.json_dumps(dict(
+            MEMORY_CACHE_SIZE=self.MEMORY_CACHE_SIZE,
+            stats=slot.stats()
+        ))
 
         # Scrapyd
         servers = defaultdict(list)
@@ -80,6 +91,15 @@ class SettingsView(BaseView):
         self.kwargs['LOCAL_SCRAPYD_SERVER'] = self.LOCAL_SCRAPYD_SERVER or "''"
         self.kwargs['LOCAL_SCRAPYD_LOGS_DIR'] = self.handle_slash(self.LOCAL_SCRAPYD_LOGS_DIR) or "''"
         self.kwargs['SCRAPYD_LOG_EXTENSIONS'] = self.SCRAPYD_LOG_EXTENSIONS
+        self.kwargs['scrapyd_request_details'] = self.json_dumps(dict(
+            SCRAPYD_REQUEST_TIMEOUTS=self.SCRAPYD_REQUEST_TIMEOUTS,
+            CIRCUIT_BREAKER_THRESHOLD=self.CIRCUIT_BREAKER_THRESHOLD,
+            CIRCUIT_BREAKER_COOLDOWN=self.CIRCUIT_BREAKER_COOLDOWN
+        ))
+        self.kwargs['node_load_details'] = self.json_dumps(dict(
+            SCRAPYD_SERVERS_CAPACITIES=self.SCRAPYD_SERVERS_CAPACITIES,
+            loads=node_loads.stats()
+        ))
 
         # LogParser
         self.kwargs['ENABLE_LOGPARSER'] = self.ENABLE_LOGPARSER
@@ -100,7 +120,8 @@ class SettingsView(BaseView):
             SCHEDULE_COOKIES_ENABLED=self.SCHEDULE_COOKIES_ENABLED,
             SCHEDULE_CONCURRENT_REQUESTS=self.SCHEDULE_CONCURRENT_REQUESTS,
             SCHEDULE_DOWNLOAD_DELAY=self.SCHEDULE_DOWNLOAD_DELAY,
-            SCHEDULE_ADDITIONAL=self.SCHEDULE_ADDITIONAL
+            SCHEDULE_ADDITIONAL=self.SCHEDULE_ADDITIONAL,
+            SCHEDULE_RATE_LIMIT=self.SCHEDULE_RATE_LIMIT
         ))
 
         # Page Display
@@ -109,6 +130,9 @@ class SettingsView(BaseView):
             SHOW_JOBS_JOB_COLUMN=self.SHOW_JOBS_JOB_COLUMN,
             JOBS_FINISHED_JOBS_LIMIT=self.JOBS_FINISHED_JOBS_LIMIT,
             JOBS_RELOAD_INTERVAL=self.JOBS_RELOAD_INTERVAL,
+            JOBS_CACHE_TTL=self.JOBS_CACHE_TTL,
+            ENABLE_JOBS_STREAM=self.ENABLE_JOBS_STREAM,
+            CLUSTER_JOBS_TIMEOUT=self.CLUSTER_JOBS_TIMEOUT,
             DAEMONSTATUS_REFRESH_INTERVAL=self.DAEMONSTATUS_REFRESH_INTERVAL
         ))
 
@@ -143,6 +167,7 @@ class SettingsView(BaseView):
         self.kwargs['poll_interval'] = self.json_dumps(dict(
             POLL_ROUND_INTERVAL=self.POLL_ROUND_INTERVAL,
             POLL_REQUEST_INTERVAL=self.POLL_REQUEST_INTERVAL,
+            POLL_REQUEST_CONCURRENCY=self.POLL_REQUEST_CONCURRENCY,
         ))
         self.kwargs['alert_switcher'] = self.json_dumps(dict(
             ENABLE_SLACK_ALERT=self.ENABLE_SLACK_ALERT,
@@ -0,0 +1,97 @@
+# coding: utf-8
+"""Compare JobsTableParser in scrapydweb/utils/jobs_listing.py with the JOB_PATTERN regex it replaced.
+
+Not collected by pytest, run it from the root of the repo:
+python -m tests.benchmark_jobs_listing [--rows 20000 100000] [--broken-rows 2]
+
+The output of both is checked to be identical for the well-formed pages. The broken page, in which
+the rows have no </tr>, is only timed, since JOB_PATTERN backtracks on it and takes time exponential
+in the number of rows, so keep --broken-rows small, e.g. 2 rows of 9 cells took about 6 seconds.
+"""
+import argparse
+import re
+import time
+
+from scrapydweb.utils.jobs_listing import JOB_KEYS, JobsTableParser
+
+
+HREF_PATTERN = re.compile(r"""href=['"](.+?)['"]""")
+# Copied from scrapydweb/views/dashboard/jobs.py before it was replaced
+JOB_PATTERN = re.compile(r"""
+                            <tr>
+                                <td>(?P<Project>.*?)</td>
+                                <td>(?P<Spider>.*?)</td>
+                                <td>(?P<Job>.*?)</td>
+                                (?:<td>(?P<PID>.*?)</td>)?
+                                (?:<td>(?P<Start>.*?)</td>)?
+                                (?:<td>(?P<Runtime>.*?)</td>)?
+                                (?:<td>(?P<Finish>.*?)</td>)?
+                                (?:<td>(?P<Log>.*?)</td>)?
+                                (?:<td>(?P<Items>.*?)</td>)?
+                                [\w\W]*?  # Temp support for Scrapyd v1.3.0 (not released)
+                            </tr>
+                          """, re.X)
+HEAD = ("<html><head><title>Scrapyd</title></head><body><h1>Jobs</h1><table border='1'>"
+        "<tr><th>Project</th><th>Spider</th><th>Job</th><th>PID</th><th>Start</th><th>Runtime</th>"
+        "<th>Finish</th><th>Log</th><th>Items</th></tr>"
+        "<tr><th colspan='9' style='background-color: #ddd'>Finished</th></tr>")
+ROW = ("<tr><td>demo</td><td>test</td><td>2019-01-01T00_00_%(i)s</td><td></td>"
+       "<td>2019-01-01 00:00:01.123456</td><td>0:01:00</td><td>2019-01-01 00:01:01.123456</td>"
+       "<td><a href='/logs/demo/test/2019-01-01T00_00_%(i)s.log'>Log</a></td>"
+       "<td><a href='/items/demo/test/2019-01-01T00_00_%(i)s.jl'>Items</a></td>%(end)s")
+TAIL = "</table></body></html>"
+
+
+def make_page(rows, end='</tr>'):
+    return HEAD + ''.join(ROW % dict(i=i, end=end) for i in range(rows)) + TAIL
+
+
+def parse_with_regex(text):
+    rows = []
+    for job in re.findall(JOB_PATTERN, text):
+        job = list(job)
+        for index in [-2, -1]:
+            m = HREF_PATTERN.search(job[index])
+            job[index] = m.group(1) if m else job[index]
+        rows.append(tuple(job))
+    return rows
+
+
+def parse_with_tokenizer(text):
+    parser = JobsTableParser()
+    for i in range(0, len(text), 64 * 1024):
+        parser.feed(text[i:i + 64 * 1024])
+    return [tuple(row) for row in parser.rows]
+
+
+def timeit(func, text):
+    start = time.time()
+    result = func(text)
+    return time.time() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the parsing of the Jobs page of Scrapyd")
+    parser.add_argument('--rows', type=int, nargs='+', default=[20000, 100000])
+    parser.add_argument('--broken-rows', type=int, default=2,
+                        help="the number of rows without </tr>, set to 0 to skip")
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        text = make_page(rows)
+        seconds_regex, result_regex = timeit(parse_with_regex, text)
+        seconds_tokenizer, result_tokenizer = timeit(parse_with_tokenizer, text)
+        assert len(result_tokenizer) == rows and all(len(row) == len(JOB_KEYS) for row in result_tokenizer)
+        assert result_regex == result_tokenizer, "The output differs from JOB_PATTERN"
+        print("%s rows (%.1f MB): regex %.2fs, tokenizer %.2fs" % (rows, len(text) / 1024.0 / 1024,
+                                                                  seconds_regex, seconds_tokenizer))
+    if args.broken_rows > 0:
+        text = make_page(args.broken_rows, end='')
+        seconds_regex, __ = timeit(parse_with_regex, text)
+        seconds_tokenizer, __ = timeit(parse_with_tokenizer, text)
+        print("%s rows without </tr>: regex %.2fs, tokenizer %.4fs" % (args.broken_rows,
+                                                                      seconds_regex, seconds_tokenizer))
+
+
+if __name__ == '__main__':
+    main()
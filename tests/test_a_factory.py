@@ -5,6 +5,8 @@ from scrapydweb import create_app
 from scrapydweb.common import find_scrapydweb_settings_py
 from scrapydweb.vars import SCRAPYDWEB_SETTINGS_PY
 from scrapydweb.utils.check_app_config import check_app_config, check_email
+from scrapydweb.utils.scheduler import any_running_tasks, reset_tasks_summary, scheduler, tasks_summary
+from scrapydweb.utils.settings import get_settings
 from tests.utils import get_text, req
 from tests.test_z_cleantest import test_cleantest as cleantest
 
@@ -31,6 +33,41 @@ def test_hello(client):
     # assert response.status_code == 500
 
 
+def test_frozen_settings(app):
+    settings = get_settings(app.config)
+    assert get_settings(app.config) is settings
+    try:
+        settings.JOBS_CACHE_TTL = 0
+    except AttributeError:
+        pass
+    else:
+        assert False, "Settings should be read-only"
+
+    jobs_cache_ttl = app.config['JOBS_CACHE_TTL']
+    app.config['JOBS_CACHE_TTL'] = jobs_cache_ttl + 1
+    assert get_settings(app.config) is not settings
+    assert get_settings(app.config).JOBS_CACHE_TTL == jobs_cache_ttl + 1
+    app.config['JOBS_CACHE_TTL'] = jobs_cache_ttl
+
+
+def test_tasks_summary(app):
+    def check(any_running=None):
+        assert tasks_summary['any_running'] is None
+        assert any_running_tasks() == any(job.next_run_time for job in scheduler.get_jobs(jobstore='default'))
+        if any_running is not None:
+            assert tasks_summary['any_running'] is any_running
+
+    reset_tasks_summary()
+    check()
+    scheduler.add_job(func='scrapydweb.utils.scheduler:reset_tasks_summary', trigger='interval', hours=1,
+                      id='test_tasks_summary', jobstore='default')
+    check(any_running=True)
+    scheduler.pause_job('test_tasks_summary')
+    check()
+    scheduler.remove_job('test_tasks_summary')
+    check()
+
+
 def test_find_scrapydweb_settings_py():
     find_scrapydweb_settings_py(SCRAPYDWEB_SETTINGS_PY, os.getcwd())
 
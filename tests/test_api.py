@@ -1,4 +1,9 @@
 # coding: utf-8
+import time
+
+from scrapydweb.common import make_request, session
+from scrapydweb.utils.node_client import CircuitOpenError, NodeClient, get_operation
+from scrapydweb.utils.service import ScrapydService
 from tests.utils import cst, req, upload_file_deploy
 
 
@@ -8,7 +13,65 @@ from tests.utils import cst, req, upload_file_deploy
 # {'status': 'ok', 'pending': 0, 'running': 2, 'finished': 3}
 def test_daemonstatus(app, client):
     req(app, client, view='api', kws=dict(node=1, opt='daemonstatus'),
-        jskws=dict(status=cst.OK), jskeys=['pending', 'running', 'finished'])
+        jskws=dict(status=cst.OK), jskeys=['pending', 'running', 'finished', 'health'])
+
+
+def test_node_client(app, client):
+    assert get_operation('http://127.0.0.1:6800/daemonstatus.json') == 'daemonstatus'
+    assert get_operation('http://127.0.0.1:6800/jobs') == 'listjobs'
+    assert get_operation('http://127.0.0.1:6800/logs/demo/test/2019-01-01T0_00_01.log') == 'logs'
+    assert get_operation('http://127.0.0.1:6800/schedule.json') is None
+    node_client = NodeClient(threshold=2, cooldown=1, timeouts=dict(listjobs=5))
+    assert node_client.get_timeout('http://127.0.0.1:6800/listjobs.json') == 5
+    assert node_client.get_timeout('http://127.0.0.1:6800/addversion.json') == 120
+    assert node_client.get_timeout('http://127.0.0.1:6800/schedule.json') == 60
+
+    url = 'http://127.0.0.1:1/daemonstatus.json'
+    for __ in range(2):
+        try:
+            node_client.get(url)
+        except CircuitOpenError:
+            assert False, "The circuit should not be open yet"
+        except Exception:
+            pass
+    health = node_client.get_health('127.0.0.1:1')
+    assert health.state == 'open' and health.score == 0
+    for __ in range(2):
+        try:
+            node_client.get(url)
+        except CircuitOpenError as err:
+            assert 'Circuit open for 127.0.0.1:1' in str(err)
+        else:
+            assert False, "CircuitOpenError expected"
+    # A probe request is let through after the cooldown, and the circuit would be reopened on failure
+    time.sleep(1.1)
+    assert health.allow_request() and health.state == 'half-open'
+    assert not health.allow_request()
+    health.record(False, 0.1, 'error')
+    assert health.state == 'open' and not health.allow_request()
+    time.sleep(1.1)
+    assert health.allow_request()
+    health.record(True, 0.1)
+    assert health.state == 'closed' and health.consecutive_failures == 0
+    assert health.to_dict()['requests'] == 4 and health.to_dict()['failures'] == 3
+
+    auth = app.config['SCRAPYD_SERVERS_AUTHS'][0]
+    r = node_client.get('http://%s/daemonstatus.json' % app.config['SCRAPYD_SERVERS'][0], auth=auth)
+    assert r.status_code == 200
+    report = node_client.get_health_report(app.config['SCRAPYD_SERVERS'][:1])
+    assert report[0]['state'] == 'closed' and report[0]['score'] > 50 and report[0]['latency'] is not None
+    req(app, client, view='servers', kws=dict(node=1), ins=['label="Health"', 'var node_health = [{'])
+
+
+def test_make_request_to_other_urls(app, client):
+    # The requests to the urls other than the Scrapyd servers, like that of Slack, bypass the circuit breakers
+    for __ in range(10):
+        status_code, js = make_request('http://127.0.0.1:2/api/chat.postMessage', data=dict(text='test'),
+                                       check_status=False, to_scrapyd=False)
+        assert status_code == -1 and 'Circuit open' not in js['message']
+    assert '127.0.0.1:2' not in session.health_dict
+    make_request('http://127.0.0.1:2/daemonstatus.json')
+    assert session.get_health('127.0.0.1:2').consecutive_failures == 1
 
 
 # def test_addversion(app, client):
@@ -58,6 +121,26 @@ def test_listjobs(app, client):
         jskws=dict(status=cst.OK, url='listjobs.json'), jskeys=['pending', 'running', 'finished'])
 
 
+def test_scrapyd_service(app, client):
+    service = ScrapydService(app.config)
+    try:
+        service.listjobs(len(app.config['SCRAPYD_SERVERS']) + 1)
+    except AssertionError as err:
+        assert 'node index error' in str(err)
+    else:
+        assert False, "node index error expected"
+
+    status_code, js = service.schedule(1, cst.PROJECT, cst.SPIDER, jobid=cst.JOBID, version=cst.DEFAULT_LATEST_VERSION,
+                                       settings_arguments=dict(setting='CLOSESPIDER_TIMEOUT=60'))
+    assert status_code == 200 and js['status'] == cst.OK and js['jobid'] == cst.JOBID
+    status_code, rows, text = service.listjobs(1)
+    assert status_code == 200 and cst.JOBID in [row.job for row in rows]
+    status_code, js = service.cancel(1, cst.PROJECT, cst.JOBID)
+    assert status_code == 200 and js['status'] == cst.OK and 'times' not in js
+    js = service.liststats(1)
+    assert 'datas' in js or 'tip' in js  # 'tip' if LogParser is not running
+
+
 # "message": "[WinError 32] 另一个程序正在使用此文件，进程无法访问。: 'eggs\\\\demo\\\\2018-01-01T01_01_01.egg'",
 def test_delversion(app, client):
     kws = dict(node=1, opt='delversion', project=cst.PROJECT, version_spider_job=cst.VERSION)
@@ -1,9 +1,18 @@
 # coding: utf-8
 from functools import partial
 from io import BytesIO
+import json
+from multiprocessing.dummy import Pool as ThreadPool
 import os
 import re
+from shutil import copytree
+import time
 
+from scrapydweb.utils import egg_builder as egg_builder_module
+from scrapydweb.utils.egg_builder import EggBuilder, egg_builder
+from scrapydweb.utils.egg_cache import EggCache, egg_cache
+from scrapydweb.utils.project_index import ProjectIndex, get_modification_time, project_index, scan_project
+from scrapydweb.views.operations.utils import Slot
 from tests.utils import cst, req, switch_scrapyd, upload_file_deploy
 
 
@@ -157,3 +166,267 @@ def test_deploy_xhr(app, client):
         version=cst.VERSION
     )
     req(app, client, view='deploy.xhr', kws=kws, jskws=dict(status=cst.OK, project=cst.PROJECT))
+    for eggname in ['..', 'not-exist.egg']:
+        req(app, client, view='deploy.xhr', kws=dict(kws, eggname=eggname),
+            jskws=dict(status=cst.ERROR, message='egg file should exist'))
+
+
+def test_deploy_multinode(app, client):
+    upload_file_deploy(app, client, filename='demo.egg', project=cst.PROJECT, redirect_project=cst.PROJECT, multinode=False)
+    kws = dict(
+        node=1,
+        eggname='%s_%s_from_file_demo.egg' % (cst.PROJECT, cst.VERSION),
+        project=cst.PROJECT,
+        version=cst.VERSION
+    )
+    __, js = req(app, client, view='deploy.multinode', kws=dict(kws, nodes='1,2'), data={},
+                 jskws=dict(status=cst.OK))
+    assert [(r['node'], r['status_code'], r['attempts']) for r in js['results']] == [(1, 200, 1), (2, -1, 3)]
+    assert js['results'][0]['status'] == cst.OK and js['results'][0]['project'] == cst.PROJECT
+
+    text, __ = req(app, client, view='deploy.multinode', kws=dict(kws, nodes='1', stream='True'), data={})
+    lines = [json.loads(line) for line in text.splitlines()]
+    assert lines[0] == dict(node=1, status='uploading', attempt=1)
+    assert lines[-1]['status'] == cst.OK and lines[-1]['version'] == cst.VERSION
+
+    req(app, client, view='deploy.multinode', kws=dict(kws, nodes='3'), data={}, jskws=dict(status=cst.ERROR))
+    for eggname in ['..', 'not-exist.egg']:
+        req(app, client, view='deploy.multinode', kws=dict(kws, eggname=eggname, nodes='1'), data={},
+            jskws=dict(status=cst.ERROR, message='egg file should exist'))
+
+
+def test_egg_cache(app, client, tmpdir):
+    project_dir = str(tmpdir.mkdir('project'))
+    for path, content in [('scrapy.cfg', b'[deploy]'), ('setup.py', b''), ('demo/__init__.py', b''),
+                          ('build/lib/demo/__init__.py', b'')]:
+        path = os.path.join(project_dir, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(content)
+    cache = EggCache(str(tmpdir.mkdir('cache')), max_size=20)
+    key = cache.get_key(project_dir)
+    # The build directory, setup.py and the eggs are excluded
+    for path in ['setup.py', 'build/lib/demo/__init__.py', 'demo_2019-01-01T01_01_01.egg']:
+        with open(os.path.join(project_dir, path), 'wb') as f:
+            f.write(b'modified')
+    assert cache.get_key(project_dir) == key
+    with open(os.path.join(project_dir, 'demo', '__init__.py'), 'wb') as f:
+        f.write(b'modified')
+    key_modified = cache.get_key(project_dir)
+    assert key_modified != key
+
+    egg = os.path.join(project_dir, 'demo_2019-01-01T01_01_01.egg')
+    copied = os.path.join(str(tmpdir), 'copied.egg')
+    assert not cache.get(key, copied) and not os.path.exists(copied)
+    cache.add(key, egg)
+    assert cache.get(key, copied)
+    with open(copied, 'rb') as f:
+        assert f.read() == b'modified'
+    # Evicted by size, the least recently used first
+    with open(egg, 'wb') as f:
+        f.write(b'0123456789abcdef')
+    cache.add(key_modified, egg)
+    assert not cache.get(key, copied) and cache.get(key_modified, copied)
+    # Evicted by age
+    cache.configure(max_size=20, max_age=0)
+    time.sleep(0.1)
+    assert not cache.get(key_modified, copied)
+
+    # Redeploying a project which has not been modified would skip building the egg
+    data = dict(folder=cst.PROJECT, project=cst.PROJECT, version=cst.VERSION)
+    req(app, client, view='deploy.upload', kws=dict(node=1), data=data, ins='Redirecting')
+    project_key = egg_cache.get_key(os.path.join(cst.ROOT_DIR, 'data', cst.PROJECT))
+    assert egg_cache.get(project_key, copied)
+
+
+def test_egg_cache_skip_build(app, client, monkeypatch, tmpdir):
+    project_dir = os.path.join(str(tmpdir), cst.PROJECT)
+    copytree(os.path.join(cst.ROOT_DIR, 'data', cst.PROJECT), project_dir)
+    with open(os.path.join(project_dir, 'random.txt'), 'w') as f:
+        f.write(str(time.time()))
+    scrapy_cfg_path = os.path.join(project_dir, 'scrapy.cfg')
+
+    calls = []
+    build_egg_in_process = egg_builder_module.build_egg_in_process
+
+    def build(path):
+        calls.append(path)
+        return build_egg_in_process(path)
+
+    monkeypatch.setattr(egg_builder_module, 'build_egg_in_process', build)
+    builder = EggBuilder()
+    # A pool of threads instead of processes, so that the patched build function is called
+    builder.pool = ThreadPool(1)
+    try:
+        build_ = builder.wait(builder.submit(scrapy_cfg_path))
+        assert build_['status'] == cst.OK and not build_['cached'] and len(calls) == 1
+        # Deploying the unchanged sources again skips the build, and so does editing setup.py,
+        # which is always regenerated from scrapy.cfg by _build_egg()
+        with open(os.path.join(project_dir, 'setup.py'), 'a') as f:
+            f.write('\n# modified\n')
+        for __ in range(2):
+            build_ = builder.wait(builder.submit(scrapy_cfg_path))
+            assert build_['status'] == cst.OK and build_['cached'] and os.path.isfile(build_['egg'])
+        assert len(calls) == 1
+        # Editing a source file misses the cache
+        with open(os.path.join(project_dir, 'demo', 'settings.py'), 'a') as f:
+            f.write('\n# modified\n')
+        build_ = builder.wait(builder.submit(scrapy_cfg_path))
+        assert build_['status'] == cst.OK and not build_['cached'] and len(calls) == 2
+    finally:
+        builder.close()
+
+
+def test_project_index(app, client, tmpdir):
+    scrapy_cfg_list = []
+    for folder in ['demo', 'demo2']:
+        scrapy_cfg = os.path.join(str(tmpdir.mkdir(folder)), 'scrapy.cfg')
+        with open(scrapy_cfg, 'w') as f:
+            f.write('[deploy]\nproject = %s\n' % folder)
+        scrapy_cfg_list.append(scrapy_cfg)
+    scanned = []
+
+    def scan(scrapy_cfg):
+        scanned.append(os.path.basename(os.path.dirname(scrapy_cfg)))
+        return dict(project=scanned[-1])
+
+    index = ProjectIndex(ttl=60)
+    assert index.get(scrapy_cfg_list, scan) == [dict(project='demo'), dict(project='demo2')]
+    assert index.get(scrapy_cfg_list, scan) and scanned == ['demo', 'demo2']
+    # Rescan the modified project only
+    os.utime(scrapy_cfg_list[1], (time.time() + 10, time.time() + 10))
+    index.get(scrapy_cfg_list, scan)
+    assert scanned == ['demo', 'demo2', 'demo2']
+    # Return the stale result at once and rescan in the background
+    index.ttl = 0
+    time.sleep(0.1)
+    assert index.get(scrapy_cfg_list[:1], scan) == [dict(project='demo')]
+    for __ in range(50):
+        if not index.refreshing:
+            break
+        time.sleep(0.1)
+    assert scanned.count('demo') == 2
+    assert list(index.entries) == scrapy_cfg_list[:1]
+    # The stale projects are rescanned by a single worker thread
+    worker = index.worker
+    index.get(scrapy_cfg_list, scan)
+    for __ in range(50):
+        if not index.refreshing:
+            break
+        time.sleep(0.1)
+    assert index.worker is worker and worker.is_alive()
+    # demo2 was dropped above, so it is scanned at once instead
+    assert scanned.count('demo') == 3 and scanned.count('demo2') == 3
+
+    # Scanning a project does not need a request context, the warnings are returned instead of flashed
+    result = scan_project(scrapy_cfg_list[0])
+    assert result['project'] == 'demo' and result['warnings'] == [] and result['timestamp'] > 0
+
+    def func_walk(path):
+        raise UnicodeDecodeError('utf-8', b'\x8b', 0, 1, 'invalid start byte')
+        yield
+
+    warnings = []
+    try:
+        get_modification_time(os.path.dirname(scrapy_cfg_list[0]), warnings, func_walk=func_walk, retry=False)
+    except UnicodeDecodeError:
+        pass
+    else:
+        assert False
+    assert warnings == ["Found illegal filenames in %s" % os.path.dirname(scrapy_cfg_list[0])]
+
+    project_index.clear()
+    req(app, client, view='deploy', kws=dict(node=1), ins="var projects = ['demo-copy', 'demo',")
+    assert len(project_index.entries) > 10
+
+
+def test_deploy_build(app, client, tmpdir):
+    data = dict(folder=cst.PROJECT, project=cst.PROJECT, version=cst.VERSION)
+    __, js = req(app, client, view='deploy.build', kws=dict(node=1), data=data, jskeys=['build_id', 'url_build'])
+    build_id = js['build_id']
+    assert egg_builder.wait(build_id)['status'] == cst.OK
+    req(app, client, view='deploy.build_status', kws=dict(node=1, build_id=build_id),
+        jskws=dict(status=cst.OK, build_id=build_id))
+    text, __ = req(app, client, view='deploy.build_status', kws=dict(node=1, build_id=build_id, stream='True'))
+    assert text.startswith('data: {') and text.endswith('event: end\ndata: \n\n')
+    req(app, client, view='deploy.upload', kws=dict(node=1), data=dict(data, build_id=build_id), ins='Redirecting')
+
+    # The concurrent builds of the same content are deduplicated
+    project_dir = os.path.join(str(tmpdir), cst.PROJECT)
+    copytree(os.path.join(cst.ROOT_DIR, 'data', cst.PROJECT), project_dir)
+    with open(os.path.join(project_dir, 'random.txt'), 'w') as f:
+        f.write(str(time.time()))
+    scrapy_cfg_path = os.path.join(project_dir, 'scrapy.cfg')
+    build_id = egg_builder.submit(scrapy_cfg_path)
+    assert egg_builder.submit(scrapy_cfg_path) == build_id
+    build = egg_builder.wait(build_id)
+    assert build['status'] == cst.OK and not build['cached']
+    assert egg_builder.wait(egg_builder.submit(scrapy_cfg_path))['cached']
+
+    req(app, client, view='deploy.build_status', kws=dict(node=1, build_id='not-exist'),
+        jskws=dict(status=cst.ERROR, message='build_id not found'))
+    req(app, client, view='deploy.build', kws=dict(node=1), data=dict(data, folder='demo_without_scrapy_cfg'),
+        jskws=dict(status=cst.ERROR, message='scrapy.cfg not found'))
+
+
+def test_egg_builder_timeout(monkeypatch, tmpdir):
+    project_dir = os.path.join(str(tmpdir), cst.PROJECT)
+    copytree(os.path.join(cst.ROOT_DIR, 'data', cst.PROJECT), project_dir)
+    with open(os.path.join(project_dir, 'random.txt'), 'w') as f:
+        f.write(str(time.time()))
+    scrapy_cfg_path = os.path.join(project_dir, 'scrapy.cfg')
+    builder = EggBuilder()
+    builder.configure(processes=1)
+    try:
+        # The build still in progress after BUILD_TIMEOUT expires, and is no longer shared
+        monkeypatch.setattr(egg_builder_module, 'BUILD_TIMEOUT', 0)
+        build_id = builder.submit(scrapy_cfg_path)
+        build = builder.get(build_id)
+        assert build['status'] == cst.ERROR and build['message'].startswith('Timeout after waiting 0 seconds')
+        assert not builder.building and not builder.events
+        monkeypatch.setattr(egg_builder_module, 'BUILD_TIMEOUT', 600)
+        build_id_ = builder.submit(scrapy_cfg_path)
+        assert build_id_ != build_id
+        assert builder.wait(build_id_)['status'] == cst.OK
+        # The expired build would not be updated when it finishes later
+        assert builder.get(build_id)['status'] == cst.ERROR
+    finally:
+        builder.close()
+
+
+def test_slot(tmpdir):
+    slot = Slot(max_bytes=40)
+    small_egg, large_egg = os.path.join(str(tmpdir), 'small.egg'), os.path.join(str(tmpdir), 'large.egg')
+    with open(small_egg, 'wb') as f:
+        f.write(b'0123456789')
+    with open(large_egg, 'wb') as f:
+        f.write(b'0123456789' * 2)
+    slot.add_egg('small.egg', small_egg)
+    slot.add_egg('large.egg', large_egg)  # Larger than a quarter of max_bytes
+    assert slot.get_egg('small.egg') == b'0123456789'
+    assert slot.get_egg('large.egg') is None
+    assert slot.get_egg('not-exist.egg') is None
+
+    # Evict the least recently used one
+    slot.add_egg('small_2.egg', small_egg)
+    slot.add_egg('small_3.egg', small_egg)
+    slot.add_egg('small_4.egg', small_egg)
+    slot.add_egg('small_5.egg', small_egg)
+    assert slot.get_egg('small.egg') is None
+    stats = slot.stats()
+    assert stats['bytes'] <= stats['max_bytes'] == 40
+    assert stats['egg'] == dict(hits=1, disk_hits=1, misses=2, evictions=1, items=4, bytes=40, items_on_disk=1)
+
+    # The egg and the data share the same byte budget
+    slot.configure(max_bytes=1024)
+    data = dict(project=cst.PROJECT, setting=[])
+    slot.add_data('data.pickle', data)
+    slot.get_data('data.pickle')['setting'].append('CLOSESPIDER_TIMEOUT=60')
+    assert slot.get_data('data.pickle') == data
+    assert slot.stats()['data']['hits'] == 2 and slot.stats()['data']['items'] == 1
+    assert slot.get_egg('small_5.egg') and slot.stats()['egg']['items'] == 4
+    # The least recently used ones are evicted first, regardless of the kind
+    slot.configure(max_bytes=40)
+    assert slot.stats()['data']['evictions'] == 1 and slot.stats()['egg']['items'] == 1
+    assert slot.get_egg('small_5.egg')
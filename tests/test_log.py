@@ -1,14 +1,15 @@
 # coding: utf-8
-from datetime import datetime
+from datetime import datetime, timedelta
 from io import BytesIO
 import json
 import os
 import re
+import threading
 import time
 
 from flask import url_for
 
-from scrapydweb.utils.poll import main as poll_py_main
+from scrapydweb.utils.poll import Poll, main as poll_py_main
 from tests.utils import cst, req, sleep, upload_file_deploy
 
 
@@ -99,6 +100,252 @@ def test_log_utf8_stats(app, client):
             jskws=dict(status=cst.ERROR))
 
 
+# Only jobs with changes would be written into the database
+def test_jobs_db_sync(app, client, monkeypatch):
+    from scrapydweb.models import Job, db
+    from scrapydweb.utils.jobs_listing import JOB_KEYS
+    from scrapydweb.utils.service import ScrapydService
+    from scrapydweb.views.dashboard.jobs import metadata as jobs_metadata  # handle_metadata() requires db.app
+    node = 2  # Unreachable, so the jobs in the database are all from the rows below
+    server = app.config['SCRAPYD_SERVERS'][node - 1]
+    rows = []
+    monkeypatch.setattr(ScrapydService, 'listjobs', lambda self, node, timeout=None: (200, rows, ''))
+
+    def make_row(job, start='', runtime='', finish=''):
+        values = dict(project='demo', spider='test', job=job, pid='', start=start, runtime=runtime, finish=finish,
+                      href_log='', href_items='')
+        return tuple(values[k] for k in JOB_KEYS)
+
+    def sync(**expected):
+        req(app, client, view='jobs', kws=dict(node=node), data={})
+        db_sync = jobs_metadata['db_sync'][node]
+        assert dict((k, db_sync[k]) for k in expected) == expected
+        with app.app_context():
+            return dict((job.job, job.status) for job in Job.query.filter_by(node_server=server, deleted='0'))
+
+    try:
+        rows[:] = [make_row('pending1'), make_row('pending2'),
+                   make_row('running', start='2019-01-01 00:00:01', runtime='0:00:01'),
+                   make_row('finished', start='2019-01-01 00:00:01', finish='2019-01-01 00:01:01')]
+        assert sync(inserted=4, updated=0, unchanged=0, deleted=0) == dict(
+            pending1='0', pending2='0', running='1', finished='2')
+        assert sync(inserted=0, updated=0, unchanged=4, deleted=0) == dict(
+            pending1='0', pending2='0', running='1', finished='2')
+
+        # pending1 starts, the runtime of the running job changes, pending2 is removed and pending3 is added
+        rows[:] = [make_row('pending3'),
+                   make_row('pending1', start='2019-01-01 00:00:02', runtime='0:00:01'),
+                   make_row('running', start='2019-01-01 00:00:01', runtime='0:00:02'),
+                   make_row('finished', start='2019-01-01 00:00:01', finish='2019-01-01 00:01:01')]
+        assert sync(inserted=1, updated=2, unchanged=1, deleted=1) == dict(
+            pending1='1', pending3='0', running='1', finished='2')
+
+        # No pending job at all, then the pending rows are deleted in a single statement
+        rows[:] = rows[1:]
+        assert sync(inserted=0, updated=0, unchanged=3, deleted=1) == dict(
+            pending1='1', running='1', finished='2')
+    finally:
+        with app.app_context():
+            Job.query.filter_by(node_server=server).delete()
+            db.session.commit()
+
+
+def test_jobs_keyset_pagination(app, client):
+    from scrapydweb.models import Job, db
+    from scrapydweb.views.dashboard.jobs import keyset_filter
+    server = 'keyset-test.com:6800'
+    now = datetime.now().replace(microsecond=0)
+    with app.app_context():
+        for i in range(10):
+            status = '0' if i < 2 else ('1' if i < 5 else '2')
+            db.session.add(Job(node_server=server, project='demo', spider='test', job='job_%s' % i,
+                               status=status, deleted='0', create_time=now, update_time=now,
+                               start=None if status == '0' else now.replace(second=i % 3),
+                               finish=now.replace(minute=i % 2) if status == '2' else None))
+        db.session.commit()
+        try:
+            query = Job.query.filter_by(node_server=server, deleted='0')
+            order_by = [Job.status.asc(), Job.finish.desc(), Job.start.asc(), Job.id.asc()]
+            expected = [job.id for job in query.order_by(*order_by)]
+            for backward in [False, True]:
+                ids = []
+                cursor = None
+                while True:
+                    keys = list(zip([Job.status, Job.finish, Job.start, Job.id],
+                                    cursor or [None, None, None, None], [True, False, True, True]))
+                    q = query.filter(keyset_filter(keys, backward)) if cursor else query
+                    q = q.order_by(*[c.asc() if a != backward else c.desc() for (c, __, a) in keys])
+                    page = q.limit(3).all()
+                    if not page:
+                        break
+                    ids.extend(job.id for job in page)
+                    cursor = (page[-1].status, page[-1].finish, page[-1].start, page[-1].id)
+                assert ids == (expected[::-1] if backward else expected)
+        finally:
+            Job.query.filter_by(node_server=server).delete()
+            db.session.commit()
+
+    req(app, client, view='jobs', kws=dict(node=1, style='database'), ins="Vue.extend(Main)")
+    text, __ = req(app, client, view='jobs', kws=dict(node=1, style='database', page=1, per_page=1))
+    first_id = re.search(r'lastId: (\d+),', text).group(1)
+    text, __ = req(app, client, view='jobs', kws=dict(node=1, style='database', page=2, after=first_id))
+    second_id = re.search(r'firstId: (\d+|null),', text).group(1)
+    if second_id != 'null':  # At least two jobs in node 1
+        text, __ = req(app, client, view='jobs', kws=dict(node=1, style='database', page=1, before=second_id))
+        assert re.search(r'firstId: (\d+),', text).group(1) == first_id
+    req(app, client, view='jobs', kws=dict(node=1, style='database', per_page=100))
+
+
+def test_jobs_delta(app, client):
+    from scrapydweb.models import Job, db
+    from scrapydweb.views.dashboard.jobs import START_TIME, WATERMARK_OVERLAP
+    # A delta since a watermark earlier than the start time would ask for a reset
+    time.sleep(max(0, WATERMARK_OVERLAP + 1 - (datetime.now() - START_TIME).total_seconds()))
+    text, __ = req(app, client, view='jobs', kws=dict(node=1, style='database'))
+    since = re.search(r"since: '(.+?)',", text).group(1)
+    req(app, client, view='jobs.delta', kws=dict(node=1, since='invalid'), jskws=dict(status=cst.ERROR))
+    req(app, client, view='jobs.delta', kws=dict(node=1), jskws=dict(status=cst.OK, reset=True))
+    # Wait until the rows synced by the Jobs page are out of the overlap of the watermark
+    time.sleep(WATERMARK_OVERLAP + 1)
+    __, js = req(app, client, view='jobs.delta', kws=dict(node=1, since=since, sync='False'))
+    since = js['watermark']
+    with app.app_context():
+        now = datetime.now()
+        job = Job(node_server=app.config['SCRAPYD_SERVERS'][0], project='demo', spider='test', job='delta_test',
+                  status='2', deleted='0', start=now, finish=now, create_time=now, update_time=now)
+        db.session.add(job)
+        db.session.commit()
+        id_ = job.id
+    try:
+        __, js = req(app, client, view='jobs.delta', kws=dict(node=1, since=since, sync='False'),
+                     jskws=dict(status=cst.OK, reset=False))
+        assert [job['id'] for job in js['added']] == [id_]
+        since = js['watermark']
+        # Truncated to whole seconds, so that it works with the DATETIME column of MySQL
+        assert '.' not in since
+        # A row updated in the same second as the watermark is not missed
+        with app.app_context():
+            job = Job.query.get(id_)
+            job.update_time = datetime.strptime(since, '%Y-%m-%d %H:%M:%S')
+            job.create_time = job.update_time - timedelta(seconds=10)
+            db.session.commit()
+        __, js = req(app, client, view='jobs.delta', kws=dict(node=1, since=since, sync='False'))
+        assert [job['id'] for job in js['changed']] == [id_] and not js['added'] and not js['removed']
+        req(app, client, view='jobs.xhr', kws=dict(node=1, action='delete', id=id_), jskws=dict(status=cst.OK))
+        __, js = req(app, client, view='jobs.delta', kws=dict(node=1, since=since, sync='False'))
+        assert js['removed'] == [id_] and not js['added']
+
+        with app.test_request_context():
+            url = url_for('jobs.stream', node=1, since=since)
+        response = client.get(url, buffered=False)
+        assert response.mimetype == 'text/event-stream'
+        chunks = iter(response.response)
+        assert next(chunks).startswith(b'retry:')
+        event = next(chunks).decode('utf-8')
+        response.close()
+        assert event.startswith('id: ')
+        assert json.loads(event.split('data: ', 1)[1])['removed'] == [id_]
+    finally:
+        with app.app_context():
+            Job.query.filter_by(id=id_).delete()
+            db.session.commit()
+
+
+def test_migrate_jobs_tables(app, client):
+    from scrapydweb.models import Job, db, migrate_jobs_tables
+    server = 'migrate-test.com:6800'
+    with app.app_context():
+        engine = db.get_engine(bind='jobs')
+        legacy = db.Table('migrate_test_com_6800', db.MetaData(),
+                          *[c.copy() for c in Job.__table__.columns if c.name != 'node_server'])
+        legacy.create(engine)
+        engine.execute(legacy.insert().values(project='demo', spider='test', job='job_1', status='0',
+                                              deleted='0', create_time=datetime.now(), update_time=datetime.now()))
+        try:
+            assert migrate_jobs_tables([server]) == ['migrate_test_com_6800']
+            assert migrate_jobs_tables([server]) == []
+            job = Job.query.filter_by(node_server=server).one()
+            assert (job.project, job.spider, job.job, job.status) == ('demo', 'test', 'job_1', '0')
+        finally:
+            Job.query.filter_by(node_server=server).delete()
+            db.session.commit()
+            for name in ['migrate_test_com_6800', 'migrate_test_com_6800_migrated']:
+                db.Table(name, db.MetaData()).drop(engine, checkfirst=True)
+
+
+def test_jobs_listing(app, client):
+    from scrapydweb.utils.jobs_listing import JOB_KEYS, JobsTableParser
+    text = ("<html><head><title>Scrapyd</title></head><body><h1>Jobs</h1><table border='1'>"
+            "<tr><th>Project</th><th>Spider</th><th>Job</th></tr>"
+            "<tr><th colspan='9' style='background-color: #ddd'>Pending</th></tr>"
+            "<tr><td>demo</td><td>test</td><td>job_1</td></tr>"
+            "<tr><th colspan='9' style='background-color: #ddd'>Finished</th></tr>"
+            "<tr><td>demo</td><td>test</td><td>job_2</td><td></td><td>2019-01-01 00:00:01</td>"
+            "<td>0:00:01</td><td>2019-01-01 00:00:02</td><td><a href='/logs/demo/test/job_2.log'>Log</a></td>"
+            "<td><a href='/items/demo/test/job_2.jl'>Items</a></td></tr></table></body></html>")
+    for chunk_size in [7, len(text)]:
+        parser = JobsTableParser()
+        for i in range(0, len(text), chunk_size):
+            parser.feed(text[i:i+chunk_size])
+        assert parser.found_title
+        assert parser.rows[0] == ('demo', 'test', 'job_1', '', '', '', '', '', '')
+        assert parser.rows[1] == ('demo', 'test', 'job_2', '', '2019-01-01 00:00:01', '0:00:01',
+                                  '2019-01-01 00:00:02', '/logs/demo/test/job_2.log', '/items/demo/test/job_2.jl')
+
+    __, js = req(app, client, view='jobs', kws=dict(node=1, listjobs='True'))
+    assert js and set(js[0].keys()) == set(JOB_KEYS)
+    assert all(job['href_log'].startswith('/logs/') for job in js if job['start'])
+
+
+def test_jobs_cache(app, client):
+    from multiprocessing.dummy import Pool as ThreadPool
+    import requests
+    from scrapydweb.utils.jobs_listing import JobsCache
+
+    class SlowSession(requests.Session):
+        count = 0
+
+        def get(self, *args, **kwargs):
+            self.count += 1
+            time.sleep(1)
+            return super(SlowSession, self).get(*args, **kwargs)
+
+    session = SlowSession()
+    jobs_cache = JobsCache()
+    server = app.config['SCRAPYD_SERVERS'][0]
+    auth = app.config['SCRAPYD_SERVERS_AUTHS'][0]
+
+    def get(__):
+        return jobs_cache.get(session, server, auth=auth, ttl=60)
+
+    pool = ThreadPool(5)
+    results = pool.map(get, range(5))
+    pool.close()
+    pool.join()
+    count = session.count
+    assert all(result[0] == 200 and result[1] == results[0][1] for result in results)
+    assert count <= 2  # listjobs.json and the Jobs page for Scrapyd < 1.3.0
+    get(None)
+    assert session.count == count
+    jobs_cache.invalidate(server)
+    get(None)
+    assert session.count > count
+
+    # A stale result is returned at once, even to the request which triggers the refresh
+    count = session.count
+    timestamp, result = jobs_cache.entries[server]
+    jobs_cache.entries[server] = (timestamp - 60, result)
+    start = time.time()
+    assert get(None) == result
+    assert time.time() - start < 1
+    for __ in range(50):
+        if jobs_cache.entries[server][0] > timestamp:
+            break
+        time.sleep(0.1)
+    assert jobs_cache.entries[server][0] > timestamp and session.count > count
+    assert not jobs_cache.flights
+
+
 def test_log_not_exist(app, client):
     # the Stats page
     kws = dict(node=1, opt='stats', project=cst.PROJECT, spider=cst.SPIDER, job=cst.FAKE_JOBID)
@@ -110,6 +357,152 @@ def test_log_not_exist(app, client):
     req(app, client, view='log', kws=kws, ins=ins)
 
 
+def test_log_not_exist_requested_once(app, client, monkeypatch):
+    from scrapydweb.common import session
+    urls = []
+    request = session.request
+
+    def request_(method, url, *args, **kwargs):
+        urls.append(url)
+        return request(method, url, *args, **kwargs)
+
+    monkeypatch.setattr(session, 'request', request_)
+    kws = dict(node=1, opt='stats', project=cst.PROJECT, spider=cst.SPIDER, job=cst.FAKE_JOBID)
+    req(app, client, view='log', kws=kws, ins=['fail - ScrapydWeb', 'status_code: 404'])
+    # The logfiles which got 404 when tailing are not requested again
+    log_urls = [url for url in urls if not url.endswith('.json')]
+    assert log_urls and len(log_urls) == len(set(log_urls))
+
+
+class FakeLogResponse(object):
+    def __init__(self, status_code, content, headers):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+
+class FakeLogSession(object):
+    """Serve the content like Scrapyd, which supports the HTTP Range requests unless support_range is False."""
+
+    def __init__(self, content, support_range=True):
+        self.content = content
+        self.support_range = support_range
+        self.ranges = []
+
+    def get(self, url, headers=None, auth=None, timeout=None):
+        if 'Range' not in (headers or {}):
+            self.ranges.append(None)
+            return FakeLogResponse(200, self.content, {})
+        start, end = [int(i) for i in re.match(r'bytes=(\d+)-(\d+)', headers['Range']).groups()]
+        self.ranges.append((start, end))
+        size = len(self.content)
+        if not self.support_range:
+            return FakeLogResponse(200, self.content, {})
+        if start >= size:
+            return FakeLogResponse(416, b'', {'Content-Range': 'bytes */%s' % size})
+        return FakeLogResponse(206, self.content[start:end + 1],
+                               {'Content-Range': 'bytes %s-%s/%s' % (start, min(end, size - 1), size)})
+
+
+def test_log_tail(monkeypatch):
+    from scrapydweb.utils import log_tail as log_tail_module
+    from scrapydweb.utils.log_tail import LogTail
+
+    with open(os.path.join(cst.ROOT_DIR, 'data', cst.DEMO_LOG), 'rb') as f:
+        content = f.read()
+    # Insert a multi-byte character into the 4th line, which would be split at the end of the first range
+    lines = content.split(b'\n')
+    lines[3] += u' \u4e2d\u6587'.encode('utf-8')
+    content = b'\n'.join(lines)
+    offset = content.index(u'\u4e2d'.encode('utf-8'))
+    line_start = content.rfind(b'\n', 0, offset) + 1
+    assert LogTail('').decode(content[:offset + 1]) == (content[:offset].decode('utf-8'), 1)
+
+    url = 'http://127.0.0.1:6800/logs/%s/%s/%s' % (cst.PROJECT, cst.SPIDER, cst.DEMO_LOG)
+
+    def parse_from_scratch(content_):
+        monkeypatch.setattr(log_tail_module, 'session', FakeLogSession(content_))
+        log_tail_ = LogTail(url)
+        log_tail_.update()
+        monkeypatch.setattr(log_tail_module, 'session', session)
+        return log_tail_.data['position']
+
+    session = FakeLogSession(content[:-100])
+    monkeypatch.setattr(log_tail_module, 'session', session)
+    log_tail = LogTail(url, chunk_size=offset + 1)
+    assert log_tail.update() == 200
+    # The next range starts from the incomplete line, instead of the bytes after the cut character
+    assert session.ranges[:2] == [(0, offset), (line_start, line_start + offset)]
+    assert u'\u4e2d\u6587' in log_tail.data['head']
+    assert log_tail.data['position'] == parse_from_scratch(content[:-100])
+    assert log_tail.data['finish_reason'] == 'N/A'
+
+    # Only the appended bytes are requested
+    position = log_tail.data['position']
+    session.content = content
+    session.ranges = []
+    assert log_tail.update() == 200
+    assert session.ranges[0][0] == position
+    assert log_tail.data['position'] == len(content) and log_tail.data['finish_reason'] == 'finished'
+
+    # Range Not Satisfiable since the logfile shrinks, then parse from 0
+    session.content = content[:line_start]
+    session.ranges = []
+    assert log_tail.update() == 200
+    assert session.ranges[0][0] == len(content) and session.ranges[1][0] == 0
+    assert log_tail.data['position'] == parse_from_scratch(content[:line_start]) > 0
+    assert log_tail.data['finish_reason'] == 'N/A'
+
+    # Fall back to the full content if the server ignores the Range header
+    position = log_tail.data['position']
+    session.support_range = False
+    session.content = content
+    session.ranges = []
+    assert log_tail.update() == 200
+    # The rest of the content is parsed at once, instead of requesting the full content again per chunk
+    assert session.ranges == [(position, position + offset)]
+    assert log_tail.data['position'] == len(content) and log_tail.data['finish_reason'] == 'finished'
+    # The Range header is not sent anymore,
+    # and the full content returned by the server is shorter than the position, then parse from 0
+    session.content = content[:line_start]
+    session.ranges = []
+    assert log_tail.update() == 200
+    assert session.ranges == [None, None]
+    assert log_tail.data['position'] == parse_from_scratch(content[:line_start]) > 0
+    assert log_tail.data['finish_reason'] == 'N/A'
+
+    monkeypatch.setattr(session, 'get', lambda *args, **kwargs: FakeLogResponse(404, b'', {}))
+    assert log_tail.update() == 404
+
+
+def test_log_tail_without_range(monkeypatch):
+    from scrapydweb.utils import log_tail as log_tail_module
+    from scrapydweb.utils.log_tail import LogTail
+
+    with open(os.path.join(cst.ROOT_DIR, 'data', cst.DEMO_LOG), 'rb') as f:
+        content = f.read()
+    half = content.index(b'\n', len(content) // 2) + 1
+    url = 'http://127.0.0.1:6800/logs/%s/%s/%s' % (cst.PROJECT, cst.SPIDER, cst.DEMO_LOG)
+    session = FakeLogSession(content[:half], support_range=False)
+    monkeypatch.setattr(log_tail_module, 'session', session)
+    # The logfile is much larger than chunk_size, but requested only once per update()
+    log_tail = LogTail(url, chunk_size=1000)
+    assert log_tail.update() == 200
+    assert len(session.ranges) == 1 and session.ranges[0] is not None
+    assert 0 < log_tail.data['position'] <= half and log_tail.data['finish_reason'] == 'N/A'
+
+    session.content = content
+    session.ranges = []
+    assert log_tail.update() == 200
+    assert session.ranges == [None]
+    assert log_tail.data['position'] == len(content) and log_tail.data['finish_reason'] == 'finished'
+    expected = LogTail(url)
+    monkeypatch.setattr(log_tail_module, 'session', FakeLogSession(content))
+    expected.update()
+    for key in ['pages', 'items', 'first_log_time', 'latest_log_time', 'runtime', 'finish_reason', 'log_categories']:
+        assert log_tail.data[key] == expected.data[key], key
+
+
 def test_inside_the_logs_page(app, client):
     with app.test_request_context():
         for project, spider in [(cst.PROJECT, None), (cst.PROJECT, cst.SPIDER)]:
@@ -171,6 +564,16 @@ def test_demo_log_with_extension(app, client):
             nos=['<h4>Log</h4>', url_utf8_, '<h4>Source</h4>', url_demo_json_source])
 
 
+# Headless path for poll.py: http://127.0.0.1:5000/1/log/monitor/ScrapydWeb_demo/test/ScrapydWeb_demo.log/
+def test_log_monitor(app, client):
+    kws = dict(node=1, opt='monitor', project=cst.PROJECT, spider=cst.SPIDER, job=cst.DEMO_LOG, with_ext='True')
+    req(app, client, view='log', kws=kws, data={}, jskws=dict(status=cst.OK, flag=''),
+        nos=['Log analysis', '<html'])
+
+    kws = dict(node=1, opt='monitor', project=cst.PROJECT, spider=cst.SPIDER, job=cst.FAKE_JOBID)
+    req(app, client, view='log', kws=kws, data={}, jskws=dict(status=cst.ERROR, status_code=404))
+
+
 # Location: http://127.0.0.1:5000/log/uploaded/ttt.txt
 def test_parse_upload(app, client):
     req(app, client, view='parse.upload', kws=dict(node=1),
@@ -250,6 +653,46 @@ def test_poll_py(app):
     assert ignore_finished_bool_list == [False, True]
 
 
+def test_poll_concurrency_and_throttle(monkeypatch):
+    interval = 0.2
+    poll = Poll('http://127.0.0.1:5000', '', '', ['127.0.0.1:1', '127.0.0.1:2'], [None, None],
+                poll_round_interval=0, poll_request_interval=interval, main_pid=os.getpid(), verbose=False,
+                poll_request_concurrency=3)
+    lock = threading.Lock()
+    starts = {1: [], 2: []}  # {node: [timestamp]}
+    running = {1: 0, 2: 0}
+    peaks = {1: 0, 2: 0}
+
+    class Response(object):
+        status_code = 200
+        content = b''
+
+    def make_request(url, auth, post=False):
+        node = int(url.split('/')[3])
+        with lock:
+            starts[node].append(time.time())
+            running[node] += 1
+            peaks[node] = max(peaks[node], running[node])
+        time.sleep(interval * 2.5)
+        with lock:
+            running[node] -= 1
+        return Response()
+
+    running_jobs = [('demo', 'test', 'job%s' % i) for i in range(6)]
+    monkeypatch.setattr(poll, 'fetch_jobs', lambda node, scrapyd_server, auth: (running_jobs, set()))
+    monkeypatch.setattr(poll, 'make_request', make_request)
+    poll.run()
+    # The nodes are polled in parallel
+    assert abs(starts[1][0] - starts[2][0]) < interval
+    for node in [1, 2]:
+        assert len(starts[node]) == len(running_jobs)
+        # At most poll_request_concurrency requests related to the same node at the same time
+        assert peaks[node] == 3
+        # Started one by one every poll_request_interval seconds
+        gaps = [b - a for (a, b) in zip(starts[node], starts[node][1:])]
+        assert min(gaps) >= interval * 0.95
+
+
 def test_monitor_alert(app, client):
     # In ScrapydWeb_demo_no_delay.egg: unset CONCURRENT_REQUESTS, unset DOWNLOAD_DELAY
     upload_file_deploy(app, client, filename='ScrapydWeb_demo_no_delay.egg',
@@ -92,3 +92,52 @@ def test_scheduler_state(app, client):
         req(app, client, view='metadata', kws=dict(node=1), jskws=dict(scheduler_state=state))
         # ENABLED | DISABLED buttons
         req(app, client, view='tasks', kws=dict(node=1), ins=[scheduler_action_button, url_scheduler_action])
+
+
+def test_metadata_cache(app, client):
+    from scrapydweb.common import handle_metadata, increase_metadata, invalidate_metadata, metadata_cache
+    from scrapydweb.models import Metadata
+
+    def get_pageview_in_db():
+        with app.app_context():
+            return Metadata.query.filter_by(version=__version__).first().pageview
+
+    invalidate_metadata()
+    pageview = get_pageview_in_db()
+    assert handle_metadata()['pageview'] == pageview
+    values = metadata_cache.values
+    # Counters are increased in memory and flushed in batches
+    assert increase_metadata('pageview') == pageview + 1
+    assert increase_metadata('pageview', 2) == pageview + 3
+    assert metadata_cache.values is values
+    assert handle_metadata()['pageview'] == pageview + 3
+    assert get_pageview_in_db() == pageview
+    invalidate_metadata()
+    assert metadata_cache.values is None
+    assert get_pageview_in_db() == pageview + 3
+    # Setting a value discards the pending increments of the same key
+    increase_metadata('pageview')
+    handle_metadata('pageview', pageview)
+    invalidate_metadata()
+    assert get_pageview_in_db() == pageview
+    # The increments are kept for the next flush if the commit fails
+    from scrapydweb.models import db
+    increase_metadata('pageview', 2)
+
+    def commit():
+        raise RuntimeError("Fail to commit")
+    db.session.commit = commit
+    try:
+        metadata_cache.flush()
+    finally:
+        del db.session.commit
+    assert metadata_cache.increments == {'pageview': 2}
+    assert get_pageview_in_db() == pageview
+    metadata_cache.flush()
+    assert metadata_cache.increments == {}
+    assert get_pageview_in_db() == pageview + 2
+    handle_metadata('pageview', pageview)
+    invalidate_metadata()
+    req(app, client, view='servers', kws=dict(node=1))
+    __, js = req(app, client, view='metadata', kws=dict(node=1))
+    assert js['pageview'] == pageview + 1
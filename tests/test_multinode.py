@@ -1,4 +1,9 @@
 # coding: utf-8
+import json
+import threading
+import time
+
+from scrapydweb.utils.service import ScrapydService
 from tests.utils import cst, req
 
 
@@ -13,6 +18,21 @@ def test_multinode_stop(app, client):
     multinode_command(app, client, 'stop', title, cst.PROJECT, version_job=cst.JOBID)
 
 
+def test_multinode_xhr(app, client):
+    kws = dict(node=1, opt='stop', project=cst.PROJECT, version_job=cst.JOBID, nodes='1,2')
+    __, js = req(app, client, view='multinode.xhr', kws=kws, data={}, jskws=dict(status=cst.OK))
+    assert [(i['node'], i['status_code']) for i in js['results']] == [(1, 200), (2, -1)]
+    assert js['results'][1]['status'] == cst.ERROR and 'auth' not in js['results'][0]
+
+    text, __ = req(app, client, view='multinode.xhr', kws=dict(kws, stream='True'), data={})
+    lines = text.strip().split('\n')
+    assert len(lines) == 2 and sorted(json.loads(line)['node'] for line in lines) == [1, 2]
+
+    req(app, client, view='multinode.xhr', kws=dict(kws, opt='start'), data={},
+        jskws=dict(status=cst.ERROR, message='opt should be one of'))
+    req(app, client, view='multinode.xhr', kws=dict(kws, nodes='3'), data={}, jskws=dict(status=cst.ERROR))
+
+
 def test_multinode_delproject(app, client):
     title = 'Delete Project (%s)' % cst.PROJECT
     multinode_command(app, client, 'delproject', title, cst.PROJECT)
@@ -21,3 +41,35 @@ def test_multinode_delproject(app, client):
 def test_multinode_delversion(app, client):
     title = 'Delete Version (%s) of Project (%s)' % (cst.VERSION, cst.PROJECT)
     multinode_command(app, client, 'delversion', title, cst.PROJECT, version_job=cst.VERSION)
+
+
+def test_fan_out():
+    service = ScrapydService({})
+    lock = threading.Lock()
+    running = []
+    peaks = []
+
+    def func(node):
+        with lock:
+            running.append(node)
+            peaks.append(len(running))
+        time.sleep(0.05 * (5 - node % 5))
+        with lock:
+            running.remove(node)
+        if node == 3:
+            raise ValueError("node 3")
+        return 200, dict(node=node)
+
+    nodes = list(range(1, 11))
+    results = list(service.fan_out(func, nodes, ordered=True, concurrency=3))
+    assert [node for (node, result) in results] == nodes
+    assert max(peaks) == 3
+    assert results[2] == (3, (-1, dict(status=cst.ERROR, status_code=-1, message='node 3')))
+    assert results[3] == (4, (200, dict(node=4)))
+    assert sorted(node for (node, result) in service.fan_out(func, nodes)) == nodes
+
+    # fan_out() called inside a func running in the shared pool makes the calls in turn, instead of deadlocking
+    def nested(node):
+        return 200, dict(nodes=[n for (n, r) in service.fan_out(func, [node, node + 5], ordered=True)])
+    results = list(service.fan_out(nested, nodes[:5], ordered=True))
+    assert [result[1]['nodes'] for (node, result) in results] == [[n, n + 5] for n in nodes[:5]]
@@ -1,6 +1,11 @@
 # coding: utf-8
+import threading
+import time
+
 from flask import url_for
 
+from scrapydweb.utils.service import ScrapydService
+from scrapydweb.views.overview.servers import DaemonStatusCache, daemonstatus_cache
 from tests.utils import cst, req, switch_scrapyd
 
 
@@ -88,3 +93,89 @@ def test_switch_node_skip(app, client):
 def test_cluster_reports_exists(app, client):
     ins = ['<span>Cluster Reports</span>', '<el-tab-pane label="Get Reports"']
     req(app, client, view='servers', kws=dict(node=1), ins=ins)
+
+
+def test_servers_daemonstatus(app, client, monkeypatch):
+    req(app, client, view='servers', kws=dict(node=1), ins="var url_servers_daemonstatus = '/1/servers/daemonstatus/';")
+    __, js = req(app, client, view='servers.daemonstatus', kws=dict(node=1))
+    assert [(i['node'], i['status']) for i in js] == [(1, cst.OK), (2, cst.ERROR)]
+    assert all(k in js[0] for k in ['node_name', 'pending', 'running', 'finished', 'health'])
+    assert js[1]['status_code'] == -1
+    __, js = req(app, client, view='servers.daemonstatus', kws=dict(node=1, nodes='2,3'))
+    assert [i['node'] for i in js] == [2]
+
+    text, __ = req(app, client, view='servers.daemonstatus', kws=dict(node=1, stream='True'),
+                   ins=['data: {"status": "ok"', 'event: end'])
+    assert text.count('data: {') == 2
+
+    # The exception raised for a node is returned as an error, instead of failing the whole response
+    def api(self, node, opt, *args, **kwargs):
+        raise ValueError("api error for node %s" % node)
+    monkeypatch.setattr(ScrapydService, 'api', api)
+    daemonstatus_cache.clear()
+    __, js = req(app, client, view='servers.daemonstatus', kws=dict(node=1))
+    assert [(i['node'], i['status'], i['message']) for i in js] == [(1, cst.ERROR, 'api error for node 1'),
+                                                                  (2, cst.ERROR, 'api error for node 2')]
+    text, __ = req(app, client, view='servers.daemonstatus', kws=dict(node=1, stream='True'),
+                   ins=['"message": "api error for node 2"', 'event: end'])
+    assert text.count('data: {') == 2
+
+
+def test_daemonstatus_cache():
+    cache = DaemonStatusCache(ttl=60)
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.5)
+        return dict(status=cst.OK)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('127.0.0.1:6800', fetch)))
+               for __ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # The concurrent refreshes share one request, and the result is cached
+    assert len(calls) == 1 and results == [dict(status=cst.OK)] * 5
+    assert cache.get('127.0.0.1:6800', fetch) == dict(status=cst.OK) and len(calls) == 1
+    cache.clear()
+    cache.get('127.0.0.1:6800', fetch)
+    assert len(calls) == 2
+
+    # The callers waiting for a failed fetch get an error too, and nothing is cached
+    def fetch_fail():
+        time.sleep(0.5)
+        raise ValueError("fetch error")
+
+    errors = []
+
+    def get():
+        try:
+            cache.get('127.0.0.1:6801', fetch_fail)
+        except Exception as err:
+            errors.append(str(err))
+    threads = [threading.Thread(target=get) for __ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(errors) == ["Fail to get the daemonstatus of 127.0.0.1:6801"] * 2 + ["fetch error"]
+    assert '127.0.0.1:6801' not in cache.entries and not cache.flights
+
+
+def test_cluster_jobs(app, client):
+    req(app, client, view='servers', kws=dict(node=1), ins='<span>Cluster Jobs</span>')
+    req(app, client, view='clusterjobs', kws=dict(node=1), ins=['Get the jobs of all Scrapyd servers', 'unreachable'])
+
+    __, js = req(app, client, view='clusterjobs', kws=dict(node=1, listjobs='True'), jskws=dict(status=cst.OK))
+    assert [(n['node'], n['status']) for n in js['nodes']] == [(1, cst.OK), (2, cst.ERROR)]
+    assert all(job['node'] == 1 for job in js['jobs'])
+    for status in ['running', 'pending', 'finished']:
+        __, js = req(app, client, view='clusterjobs', kws=dict(node=1, listjobs='True', status=status))
+        assert all(job['status'] == status for job in js['jobs'])
+    __, js = req(app, client, view='clusterjobs', kws=dict(node=1, listjobs='True', project=cst.FAKE_PROJECT))
+    assert js['jobs'] == []
+    __, js = req(app, client, view='clusterjobs', kws=dict(node=1, listjobs='True', group='Scrapyd-group'))
+    assert [n['node'] for n in js['nodes']] == [2]
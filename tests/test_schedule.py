@@ -1,9 +1,13 @@
 # coding: utf-8
+import json
 import platform
 import re
+import threading
+import time
 
 from scrapy import __version__ as scrapy_version
 
+from scrapydweb.utils.node_load import NodeLoads
 from tests.utils import cst, req, sleep, switch_scrapyd, upload_file_deploy
 
 
@@ -198,3 +202,119 @@ def test_schedule_xhr(app, client):
     req(app, client, view='schedule.xhr',
         kws=dict(node=NODE, filename=FILENAME),
         jskws=dict(status=cst.ERROR))
+
+
+def test_schedule_batch(app, client):
+    upload_file_deploy(app, client, filename='ScrapydWeb_demo.egg', project=cst.PROJECT, redirect_project=cst.PROJECT)
+    jobs = [dict(project=cst.PROJECT, version=cst.VERSION, spider=cst.SPIDER, jobid='batch',
+                 settings=dict(CLOSESPIDER_TIMEOUT=10)),
+            dict(project=cst.PROJECT, spider=cst.SPIDER, jobid='batch', settings=['CLOSESPIDER_TIMEOUT=10'],
+                 args=dict(arg1='val1')),
+            dict(project=cst.PROJECT, spider=cst.SPIDER, args=dict(jobid='jobid'))]
+
+    def req_batch(js, jskws=None, **kws):
+        return req(app, client, view='schedule.batch', kws=dict(node=1, **kws), data=json.dumps(js),
+                   content_type='application/json', jskws=jskws)
+
+    __, js = req_batch(dict(jobs=jobs, nodes=[1, 2]))
+    assert (js['status'], js['total'], js['succeeded'], js['failed']) == (cst.OK, 6, 2, 4)
+    assert [(r['index'], r['node'], r['status_code']) for r in js['results']] == [
+        (0, 1, 200), (0, 2, -1), (1, 1, 200), (1, 2, -1), (2, 1, 0), (2, 2, 0)]
+    assert [r['jobid'] for r in js['results'][:4]] == ['batch', 'batch', 'batch_2', 'batch_2']
+    assert js['results'][1]['version'] == cst.VERSION and js['results'][3]['version'] == cst.DEFAULT_LATEST_VERSION
+    assert "'jobid' can not be passed in 'args'" in js['results'][-1]['message']
+    for jobid in ['batch', 'batch_2']:
+        req(app, client, view='api', kws=dict(node=1, opt='forcestop', project=cst.PROJECT, version_spider_job=jobid))
+
+    __, js = req_batch(dict(jobs=jobs[-1:], group='Scrapyd-group'))
+    assert [(r['node'], r['status']) for r in js['results']] == [(2, cst.ERROR)]
+
+    text, __ = req_batch(dict(jobs=[dict(project=cst.PROJECT, spider=cst.FAKE_SPIDER), 'invalid'], nodes='1'),
+                         stream='True')
+    rows = [json.loads(line) for line in text.splitlines()]
+    assert [(r['index'], r['status_code']) for r in rows] == [(1, 0), (0, 200)]
+    assert rows[1]['status'] == cst.ERROR and 'spider' in rows[1]['message']
+
+    # The values of args should be strings, the numbers are converted explicitly
+    jobs_args = [dict(project=cst.PROJECT, spider=cst.FAKE_SPIDER, args=dict(arg1=v)) for v in [1, [1, 2], dict(a=1)]]
+    __, js = req_batch(dict(jobs=jobs_args, nodes=[1]))
+    assert [(r['index'], r['status_code']) for r in js['results']] == [(0, 200), (1, 0), (2, 0)]
+    assert "The value of 'arg1' in 'args' should be a string or a number" in js['results'][1]['message']
+
+    req_batch(dict(jobs=[]), jskws=dict(status=cst.ERROR, message="'jobs' should be a non-empty list"))
+    req_batch(dict(jobs=jobs, nodes=[3]), jskws=dict(status=cst.ERROR))
+    req_batch(dict(jobs=jobs, group='not-exist'), jskws=dict(status=cst.ERROR, message='No node found'))
+
+    # Node 2 is unreachable, so the jobs are all placed on node 1
+    __, js = req_batch(dict(jobs=[dict(project=cst.PROJECT, spider=cst.FAKE_SPIDER)] * 2 + ['invalid'],
+                            nodes=[1, 2], placement='least_loaded'))
+    assert [(r['index'], r['node']) for r in js['results']] == [(0, 1), (1, 1), (2, 0)]
+    # All the jobs of the batch have been sent
+    from scrapydweb.utils.node_load import node_loads
+    assert node_loads.stats()[app.config['SCRAPYD_SERVERS'][0]]['unsent'] == 0
+    req_batch(dict(jobs=jobs, placement='most_loaded'), jskws=dict(status=cst.ERROR, message="'placement' should be"))
+    req_batch(dict(jobs=jobs, placement='least_loaded', amount=0), jskws=dict(status=cst.ERROR))
+
+
+def test_run_least_loaded(app, client):
+    data = dict(project=cst.PROJECT, _version=cst.VERSION, spider=cst.SPIDER, jobid='least_loaded',
+                additional="-d setting=CLOSESPIDER_TIMEOUT=10")
+    __, js = req(app, client, view='schedule.check', kws=dict(node=NODE), data=data)
+    data = dict(run_data, filename=js['filename'], placement='least_loaded', placement_amount='2')
+    req(app, client, view='schedule.run', kws=dict(node=NODE), data=data,
+        ins=['run results - ScrapydWeb', 'id="checkbox_1"', 'var selected_nodes = [1, 2];'])
+    data.update(placement_amount='1')
+    req(app, client, view='schedule.run', kws=dict(node=NODE), data=data,
+        ins=['run results - ScrapydWeb', 'var selected_nodes = [1];'], nos='id="checkbox_2"')
+    req(app, client, view='api', kws=dict(node=1, opt='forcestop', project=cst.PROJECT, version_spider_job='least_loaded'))
+
+
+def test_rate_limiter():
+    from scrapydweb.views.operations.utils import RateLimiter
+    rate_limiter = RateLimiter(rate=10)
+    assert rate_limiter.wait('a') == 0 and rate_limiter.wait('b') == 0
+    assert 0 < rate_limiter.wait('a') <= 0.1
+    # A waiting caller reserves no slot until its request is about to be sent,
+    # so that a caller which would give up while waiting would not hold a slot
+    next_times = dict(rate_limiter.next_times)
+    thread = threading.Thread(target=rate_limiter.wait, args=('a',))
+    thread.start()
+    time.sleep(0.05)
+    assert rate_limiter.next_times == next_times
+    thread.join()
+    assert rate_limiter.next_times['a'] > next_times['a'] and rate_limiter.next_times['b'] == next_times['b']
+    rate_limiter.configure(rate=0)
+    assert rate_limiter.wait('a') == 0 and rate_limiter.wait('a') == 0
+
+
+def test_node_loads():
+    node_loads = NodeLoads()
+    requested_at = time.time()
+    node_loads.update('a', dict(status='ok', pending=1, running=1), requested_at)
+    node_loads.update('b', dict(status='ok', pending=0, running=0), requested_at)
+    node_loads.update('c', dict(status='error'), requested_at)
+    assert node_loads.get_stale(['a', 'd']) == ['d']
+    node_servers = [(1, 'a'), (2, 'b'), (3, 'c')]
+    # In proportion to the capacities, counting the jobs placed since daemonstatus.json was requested
+    assert [node_loads.select(node_servers, capacities=dict(a=4))[0] for __ in range(6)] == [1, 1, 2, 1, 1, 1]
+    assert node_loads.stats()['a'] == dict(jobs=2, placed=5, unsent=0, seconds_ago=0)
+    # The unreachable node comes last
+    assert node_loads.select(node_servers, amount=3) == [2, 1, 3]
+    node_loads.update('a', dict(status='ok', pending=0, running=0), time.time() + 1)
+    assert node_loads.stats()['a']['placed'] == 0
+
+    # The jobs placed by a batch are counted until sent, even if the loads are refreshed in the meantime
+    node_loads.clear()
+    node_servers = [(1, 'a'), (2, 'b')]
+    for server in ['a', 'b']:
+        node_loads.update(server, dict(status='ok', pending=0, running=0), time.time())
+    assert [node_loads.select(node_servers, unsent=True)[0] for __ in range(3)] == [1, 2, 1]
+    node_loads.update('a', dict(status='ok', pending=0, running=0), time.time() + 1)
+    assert node_loads.stats()['a'] == dict(jobs=0, placed=0, unsent=2, seconds_ago=0)
+    assert node_loads.select(node_servers, unsent=True) == [2]
+    node_loads.sent('a')
+    assert node_loads.stats()['a'] == dict(jobs=0, placed=1, unsent=1, seconds_ago=0)
+    node_loads.sent('a')
+    node_loads.update('a', dict(status='ok', pending=0, running=0), time.time() + 1)
+    assert node_loads.stats()['a'] == dict(jobs=0, placed=0, unsent=0, seconds_ago=0)
+    assert node_loads.select(node_servers) == [1]
@@ -369,3 +369,46 @@ def test_delete_task_or_task_result_on_the_fly(app, client):
         assert len(js['ids']) == 0
 
         req(app, client, view='tasks.xhr', kws=dict(node=1, action='delete', task_id=task_id))
+
+
+def test_task_least_loaded(app, client):
+    req(app, client, view='tasks.xhr', kws=dict(node=NODE, action='enable'), ins='STATE_RUNNING', nos='STATE_PAUSED')
+    req(app, client, view='schedule.check', kws=dict(node=NODE), data=check_data, jskws=dict(filename=FILENAME))
+    data = dict(run_data, placement='least_loaded', placement_amount='1')
+    with app.test_request_context():
+        text, __ = req(app, client, view='schedule.run', kws=dict(node=NODE), data=data,
+                       location=url_for('tasks', node=NODE))
+    task_id = int(re.search(cst.TASK_NEXT_RUN_TIME_PATTERN, unquote_plus(text)).group(1))
+
+    # The selected nodes are kept as the candidates for each run
+    __, js = req(app, client, view='tasks.xhr', kws=dict(node=NODE, action='dump', task_id=task_id))
+    assert js['data']['selected_nodes'] == [1, 2]
+    assert js['data']['placement'] == dict(amount=1, mode='least_loaded')
+    req(app, client, view='schedule', kws=dict(node=NODE, task_id=task_id), ins='value="least_loaded" selected')
+
+    sleep()
+    # Node 2 is unreachable, so the task is run on node 1 only
+    req(app, client, view='tasks', kws=dict(node=NODE, task_id=task_id),
+        ins=["status_code: 200,", "status: 'ok',", "url_stats: '/1/log/stats/", ":total='1'"])
+    req(app, client, view='tasks.xhr', kws=dict(node=NODE, action='delete', task_id=task_id))
+
+
+def test_migrate_task_table(app, client, monkeypatch, tmpdir):
+    from sqlalchemy import create_engine
+    from scrapydweb.models import Task, db, migrate_task_table
+    engine = create_engine('sqlite:///%s' % tmpdir.join('timer_tasks.db'))
+    # The 'task' table created before the column 'placement' was introduced
+    legacy = db.Table('task', db.MetaData(), *[c.copy() for c in Task.__table__.columns if c.name != 'placement'])
+    legacy.create(engine)
+    values = dict(name='legacy', trigger='cron')
+    values.update((c.name, 0 if isinstance(c.type, db.Integer) else '') for c in legacy.columns
+                  if not (c.nullable or c.primary_key or c.default or c.name in values))
+    engine.execute(legacy.insert().values(**values))
+    monkeypatch.setattr(db, 'get_engine', lambda *args, **kwargs: engine)
+    with app.app_context():
+        assert migrate_task_table() == ['placement']
+        assert migrate_task_table() == []
+    columns = [c['name'] for c in db.inspect(engine).get_columns('task')]
+    assert columns[-1] == 'placement' and len(columns) == len(Task.__table__.columns)
+    assert list(engine.execute("SELECT name, placement FROM task")) == [('legacy', None)]
+    engine.dispose()